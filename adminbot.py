@@ -1,20 +1,34 @@
-import json
+import asyncio
+import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
 import os
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     ConversationHandler,
     MessageHandler,
     filters,
     CallbackContext,
 )
+from catalog import catalog
+from persistence import SQLitePersistence, SharedConversationHandler
+from ratelimit import SendScheduler, BULK
+from broadcast import broadcaster
+from bulk import MovieImporter, detect_format, export_movies, parse_genres, parse_url, parse_year
+from cards import card_cache
+from media import media_cache, register_bot, schedule_prefetch
+from metrics import instrument
 
 # Загрузка переменных окружения
 load_dotenv()
 BOT_TOKEN = os.getenv('ADMIN_BOT_TOKEN')
+# Адрес Bot API (для локального сервера или тестов) и размер пула HTTP-соединений
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+CONNECTION_POOL_SIZE = int(os.getenv('CONNECTION_POOL_SIZE', 64))
 ADMIN_ID = int(os.getenv('ADMIN_ID'))
 
 if not BOT_TOKEN or not ADMIN_ID:
@@ -28,11 +42,17 @@ except ValueError:
 # Константы для состояний диалога
 (
     ADD_TITLE, ADD_YEAR, ADD_DIRECTOR, ADD_GENRE, ADD_PHOTO, ADD_URL, 
-    DELETE_ID, ADD_ADMIN_ID, GENERATE_CODE
-) = range(9)
+    DELETE_ID, ADD_ADMIN_ID, GENERATE_CODE, IMPORT_FILE
+) = range(10)
 
-# Путь к JSON файлу
-JSON_FILE = 'movies.json'
+# Просмотр базы: фильмов на странице и предельная длина строки,
+# чтобы страница гарантированно влезала в лимит сообщения Telegram (4096 символов)
+MOVIES_PAGE_SIZE = 15
+MAX_ROW_LENGTH = 250
+
+# Bot API отдаёт ботам файлы до 20 МБ; сколько ошибок импорта показать прямо в сообщении
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+IMPORT_ERRORS_SHOWN = 10
 
 # Логирование
 import logging
@@ -42,61 +62,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Проверка наличия lock-файла
-LOCK_FILE = 'adminbot.lock'
-
-if os.path.exists(LOCK_FILE):
-    print("Админ-бот уже запущен. Удалите файл adminbot.lock, если уверены, что другой экземпляр не работает.")
-    exit()
-
-with open(LOCK_FILE, 'w') as f:
-    f.write(str(os.getpid()))
-
-def cleanup_lock_file():
-    if os.path.exists(LOCK_FILE):
-        os.remove(LOCK_FILE)
+# Администраторы по умолчанию, пока список в базе не заведён
+DEFAULT_ADMINS = frozenset([ADMIN_ID])
 
-import atexit
-atexit.register(cleanup_lock_file)  # Удаляем lock-файл при завершении работы бота
-
-
-# Загрузка данных из JSON файла
-def load_data():
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            if "movies" not in data:
-                data["movies"] = []
-            if "admins" not in data:
-                data["admins"] = [ADMIN_ID]
-            return data
-    except FileNotFoundError:
-        logger.info("Файл movies.json не найден. Создание нового...")
-        return {"movies": [], "admins": [ADMIN_ID]}
-    except json.JSONDecodeError:
-        logger.error("Ошибка чтения JSON-файла. Файл повреждён или пуст.")
-        return {"movies": [], "admins": [ADMIN_ID]}
-
-# Сохранение данных в JSON файл
-def save_data(data):
-    with open(JSON_FILE, 'w', encoding='utf-8') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+# Множество администраторов берётся из памяти каталога, без чтения базы на каждую проверку
+def get_admins():
+    admins = catalog.admins()
+    return admins if admins is not None else DEFAULT_ADMINS
 
 # Проверка прав администратора
 def is_admin(user_id):
-    data = load_data()
-    return user_id in data.setdefault("admins", [])
-
-# Генерация админ-меню с обычными кнопками
-def generate_admin_menu():
-    keyboard = [
-        ["📚 Просмотр базы"],
-        ["➕ Добавить фильм"],
-        ["🗑️ Удалить фильм"],
-        ["👥 Добавить администратора"],
-        ["<< Назад"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return user_id in get_admins()
+
+# Клавиатуры не меняются, поэтому создаются один раз при загрузке модуля
+ADMIN_MENU = ReplyKeyboardMarkup([
+    ["📚 Просмотр базы"],
+    ["➕ Добавить фильм"],
+    ["📥 Импорт из файла"],
+    ["🗑️ Удалить фильм"],
+    ["👥 Добавить администратора"],
+    ["<< Назад"]
+], resize_keyboard=True, one_time_keyboard=True)
+BACK_KEYBOARD = ReplyKeyboardMarkup([["<< Назад"]], resize_keyboard=True)
+SKIP_KEYBOARD = ReplyKeyboardMarkup([["<< Пропустить"]], resize_keyboard=True)
 
 # Приветствие
 async def start(update: Update, context: CallbackContext):
@@ -106,7 +94,7 @@ async def start(update: Update, context: CallbackContext):
 
     await update.message.reply_text(
         "🔒 Добро пожаловать в админ-бот!\nЧто вы хотите сделать?",
-        reply_markup=generate_admin_menu()
+        reply_markup=ADMIN_MENU
     )
 
 # Обработка текстовых команд
@@ -117,6 +105,8 @@ async def handle_admin_command(update: Update, context: CallbackContext):
         await admin_view_movies(update, context)
     elif command == "➕ Добавить фильм":
         await admin_add_movie_start(update, context)
+    elif command == "📥 Импорт из файла":
+        await admin_import_start(update, context)
     elif command == "🗑️ Удалить фильм":
         await admin_delete_movie_start(update, context)
     elif command == "👥 Добавить администратора":
@@ -125,14 +115,55 @@ async def handle_admin_command(update: Update, context: CallbackContext):
         await show_admin_menu(update, context)
     else:
         logger.warning(f"Неизвестная команда: {command}")
-        await update.message.reply_text("❌ Неизвестная команда.", reply_markup=generate_admin_menu())
+        await update.message.reply_text("❌ Неизвестная команда.", reply_markup=ADMIN_MENU)
 
 # Возврат в админ-меню
 async def show_admin_menu(update: Update, context: CallbackContext):
     await update.message.reply_text(
         "🔒 Админ-меню:\nЧто вы хотите сделать дальше?",
-        reply_markup=generate_admin_menu()
+        reply_markup=ADMIN_MENU
+    )
+
+# Строка фильма для списка
+def format_movie_row(movie, max_length=None):
+    row = (
+        f"ID: {movie['id']} | Код: {movie.get('code') or 'Нет кода'} | Название: {movie['title']} | Год: {movie['year']} | "
+        f"Режиссер: {movie['director']} | Жанр: {', '.join(movie['genre'])}"
     )
+    if max_length and len(row) > max_length:
+        row = row[:max_length - 1] + "…"
+    return row
+
+# Одна страница списка фильмов: форматируются только строки этой страницы
+def render_movies_page(page):
+    total = len(catalog)
+    pages = max(1, (total + MOVIES_PAGE_SIZE - 1) // MOVIES_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    movies = catalog.page(page * MOVIES_PAGE_SIZE, MOVIES_PAGE_SIZE)
+
+    lines = [f"📚 Список фильмов (страница {page + 1} из {pages}, всего {total}):", ""]
+    lines.extend(format_movie_row(movie, MAX_ROW_LENGTH) for movie in movies)
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"movies:page:{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"movies:page:{page + 1}"))
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("📄 Выгрузить в файл", callback_data="movies:export")])
+    keyboard.append([
+        InlineKeyboardButton("📊 CSV", callback_data="movies:export:csv"),
+        InlineKeyboardButton("🧾 JSONL", callback_data="movies:export:jsonl"),
+    ])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+# Выгрузка всего списка во временный файл построчно, без сборки одной большой строки
+def export_movies_to_file():
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as file:
+        file.write("📚 Список фильмов:\n\n")
+        for movie in catalog.movies():
+            file.write(format_movie_row(movie) + "\n")
+        return file.name
 
 # Команда: Просмотр базы фильмов
 async def admin_view_movies(update: Update, context: CallbackContext):
@@ -140,21 +171,49 @@ async def admin_view_movies(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ У вас нет прав на доступ к этой команде.")
         return
 
-    data = load_data()
-    movies = data.setdefault("movies", [])
-
-    if not movies:
-        await update.message.reply_text("❌ База фильмов пуста.", reply_markup=generate_admin_menu())
+    if not len(catalog):
+        await update.message.reply_text("❌ База фильмов пуста.", reply_markup=ADMIN_MENU)
         return
 
-    response = "📚 Список фильмов:\n\n"
-    for movie in movies:
-        response += (
-            f"ID: {movie['id']} | Код: {movie.get('code', 'Нет кода')} | Название: {movie['title']} | Год: {movie['year']} | "
-            f"Режиссер: {movie['director']} | Жанр: {', '.join(movie['genre'])}\n"
-        )
+    text, markup = render_movies_page(0)
+    await update.message.reply_text(text, reply_markup=markup)
+
+# Кнопки под списком фильмов: листание страниц и выгрузка в файл
+async def admin_movies_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    if not is_admin(query.from_user.id):
+        await query.answer("❌ У вас нет прав на доступ к этой команде.", show_alert=True)
+        return
+    await query.answer()
+
+    if query.data.startswith("movies:export"):
+        # movies:export — читаемый список, movies:export:csv / movies:export:jsonl — формат для импорта
+        fmt = query.data.split(':')[2] if query.data.count(':') == 2 else None
+        if fmt:
+            path = await asyncio.to_thread(export_movies, fmt)
+        else:
+            path = await asyncio.to_thread(export_movies_to_file)
+        try:
+            with open(path, 'rb') as file:
+                await query.message.reply_document(
+                    document=file,
+                    filename=f"movies_{datetime.now().strftime('%Y-%m-%d')}.{fmt or 'txt'}",
+                    caption=f"📄 Все фильмы базы: {len(catalog)}",
+                    reply_markup=ADMIN_MENU,
+                    rate_limit_args=BULK
+                )
+        finally:
+            os.remove(path)
+        return
 
-    await update.message.reply_text(response, reply_markup=generate_admin_menu())
+    page = int(query.data.rsplit(':', 1)[1])
+    text, markup = render_movies_page(page)
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest as e:
+        # Страница не изменилась (повторное нажатие) — это не ошибка
+        if "not modified" not in str(e):
+            raise
 
 # Команда: Начало добавления нового фильма
 async def admin_add_movie_start(update: Update, context: CallbackContext):
@@ -162,7 +221,7 @@ async def admin_add_movie_start(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ У вас нет прав на доступ к этой команде.")
         return ConversationHandler.END
 
-    await update.message.reply_text("🎥 Введите название фильма:", reply_markup=ReplyKeyboardMarkup([["<< Назад"]], resize_keyboard=True))
+    await update.message.reply_text("🎥 Введите название фильма:", reply_markup=BACK_KEYBOARD)
     return ADD_TITLE
 
 # Добавление названия фильма
@@ -179,9 +238,7 @@ async def admin_add_title(update: Update, context: CallbackContext):
 # Добавление года выпуска фильма
 async def admin_add_year(update: Update, context: CallbackContext):
     try:
-        year = int(update.message.text.strip())
-        if year < 1800 or year > datetime.now().year:
-            raise ValueError
+        year = parse_year(update.message.text)
     except ValueError:
         await update.message.reply_text("❌ Пожалуйста, введите корректный год (число от 1800 до текущего года).")
         return ADD_YEAR
@@ -203,28 +260,28 @@ async def admin_add_director(update: Update, context: CallbackContext):
 
 # Добавление жанров фильма
 async def admin_add_genre(update: Update, context: CallbackContext):
-    genres = [genre.strip() for genre in update.message.text.split(',')]
     if update.message.text.lower() == "<< назад":
         await show_admin_menu(update, context)
         return ConversationHandler.END
 
+    try:
+        genres = parse_genres(update.message.text)
+    except ValueError:
+        await update.message.reply_text("❌ Пожалуйста, введите хотя бы один жанр (через запятую).")
+        return ADD_GENRE
+
     context.user_data['genre'] = genres
-    await update.message.reply_text("🖼️ Отправьте фото фильма (если есть):", reply_markup=ReplyKeyboardMarkup([["<< Пропустить"]], resize_keyboard=True))
+    await update.message.reply_text("🖼️ Отправьте фото фильма (если есть):", reply_markup=SKIP_KEYBOARD)
     return ADD_PHOTO
 
 # Добавление фото фильма
 async def admin_add_photo(update: Update, context: CallbackContext):
     if update.message.photo:
+        # file_id только что получен от Telegram этим ботом — проверять его через get_file не нужно
         photo_url = update.message.photo[-1].file_id
-        try:
-            # Проверяем, что фото действительное
-            file_info = await context.bot.get_file(photo_url)
-            context.user_data['photo_url'] = photo_url
-            await update.message.reply_text("🔗 Введите ссылку для просмотра фильма:")
-        except Exception as e:
-            logger.error(f"Ошибка при загрузке фото: {e}")
-            await update.message.reply_text("❌ Недействительное фото. Пожалуйста, отправьте другое изображение или пропустите этот шаг.")
-            return ADD_PHOTO
+        media_cache.remember_success(context.bot, photo_url, photo_url)
+        context.user_data['photo_url'] = photo_url
+        await update.message.reply_text("🔗 Введите ссылку для просмотра фильма:")
     elif update.message.text == "<< Пропустить":
         context.user_data['photo_url'] = ""
         await update.message.reply_text("🔗 Введите ссылку для просмотра фильма:")
@@ -241,16 +298,20 @@ async def admin_add_url(update: Update, context: CallbackContext):
         await show_admin_menu(update, context)
         return ConversationHandler.END
 
+    try:
+        watch_url = parse_url(watch_url)
+    except ValueError:
+        await update.message.reply_text("❌ Пожалуйста, введите ссылку, начинающуюся с http:// или https://.")
+        return ADD_URL
+
     context.user_data['watch_url'] = watch_url
 
     # Генерация уникального кода фильма
     unique_code = generate_movie_code()
     context.user_data['code'] = unique_code
 
-    # Генерация нового ID
-    data = load_data()
-    movies = data.setdefault("movies", [])
-    new_id = str(len(movies) + 1).zfill(3)
+    # Новый ID из последовательности каталога (ID удалённых фильмов не переиспользуются)
+    new_id = catalog.next_ids()[0]
 
     # Создание фильма
     new_movie = {
@@ -266,29 +327,89 @@ async def admin_add_url(update: Update, context: CallbackContext):
         "ratings": [],
         "reviews": []
     }
-    movies.append(new_movie)
-    save_data(data)
+    catalog.add_movie(new_movie)
+    # Фоном готовим фото для остальных ботов (у каждого бота свой file_id)
+    schedule_prefetch(new_movie, context.bot)
+    # Рассылка новинки подписчикам cinemabot (идёт в фоне, ход рассылки придёт отдельным сообщением)
+    _, subscribers = broadcaster.enqueue(new_movie, update.effective_chat.id)
 
+    card = card_cache.get(new_movie)
     await update.message.reply_text(
         f"🎉 Фильм успешно добавлен!\n\n"
         f"🎬 *ID*: {new_id}\n"
         f"🎞️ *Код*: `{unique_code}`\n"
-        f"🎥 *Название*: {new_movie['title']}\n"
-        f"🗓️ *Год*: {new_movie['year']}\n"
-        f"👨‍🎤 *Режиссер*: {new_movie['director']}\n"
-        f"🎭 *Жанр*: {', '.join(new_movie['genre'])}\n"
-        f"🔗 [Смотреть фильм]({new_movie.get('watch_url', '')})",
-        parse_mode="Markdown",
-        reply_markup=generate_admin_menu()
+        f"{card['caption']}\n"
+        f"📣 Рассылка подписчикам: {subscribers}",
+        parse_mode=card["parse_mode"],
+        reply_markup=ADMIN_MENU
     )
     return ConversationHandler.END
 
-# Генерация уникального кода фильма
+# Генерация уникального кода фильма (проверяем по индексу кодов, чтобы не было совпадений)
 def generate_movie_code():
-    import random
-    import string
-    code_length = 6
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=code_length))
+    return catalog.new_codes()[0]
+
+# Команда: Импорт фильмов из CSV/JSONL файла
+async def admin_import_start(update: Update, context: CallbackContext):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав на доступ к этой команде.")
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "📥 Отправьте файл .csv или .jsonl с фильмами.\n"
+        "Поля: title, year, director, genre (через запятую), watch_url, "
+        "необязательные photo_url, code, added_date.\n"
+        "Такой же файл получается выгрузкой CSV/JSONL из просмотра базы.",
+        reply_markup=BACK_KEYBOARD
+    )
+    return IMPORT_FILE
+
+# Загрузка файла и импорт: строки с ошибками пропускаются, остальные записываются пачками
+async def admin_import_file(update: Update, context: CallbackContext):
+    document = update.message.document
+    if document is None:
+        if update.message.text.lower() == "<< назад":
+            await show_admin_menu(update, context)
+            return ConversationHandler.END
+        await update.message.reply_text("❌ Пожалуйста, отправьте файл .csv или .jsonl или нажмите << Назад.")
+        return IMPORT_FILE
+
+    fmt = detect_format(document.file_name)
+    if fmt is None:
+        await update.message.reply_text("❌ Нужен файл с расширением .csv или .jsonl.")
+        return IMPORT_FILE
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        await update.message.reply_text("❌ Файл больше 20 МБ — разбейте его на части.")
+        return IMPORT_FILE
+
+    await update.message.reply_text("⏳ Импорт начат...")
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        importer = await MovieImporter(source_bot=context.bot).run(path, fmt)
+    finally:
+        os.remove(path)
+
+    errors = [f"Строка {line_num}: {error}" if line_num else error for line_num, error in importer.errors]
+    lines = [f"✅ Импорт завершён: добавлено {importer.imported}, с ошибками {len(errors)}."]
+    lines.extend(errors[:IMPORT_ERRORS_SHOWN])
+    await update.message.reply_text("\n".join(lines), reply_markup=ADMIN_MENU)
+
+    # Полный список ошибок — файлом, если в сообщение он не поместился
+    if len(errors) > IMPORT_ERRORS_SHOWN:
+        with tempfile.TemporaryFile('w+b') as report:
+            for error in errors:
+                report.write(f"{error}\n".encode('utf-8'))
+            report.seek(0)
+            await update.message.reply_document(
+                document=report,
+                filename=f"import_errors_{datetime.now().strftime('%Y-%m-%d')}.txt",
+                caption=f"⚠️ Строки с ошибками: {len(errors)}",
+                rate_limit_args=BULK
+            )
+    return ConversationHandler.END
 
 # Команда: Начало удаления фильма
 async def admin_delete_movie_start(update: Update, context: CallbackContext):
@@ -296,7 +417,7 @@ async def admin_delete_movie_start(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ У вас нет прав на доступ к этой команде.")
         return ConversationHandler.END
 
-    await update.message.reply_text("🗑️ Введите ID фильма для удаления:", reply_markup=ReplyKeyboardMarkup([["<< Назад"]], resize_keyboard=True))
+    await update.message.reply_text("🗑️ Введите ID фильма для удаления:", reply_markup=BACK_KEYBOARD)
     return DELETE_ID
 
 # Подтверждение удаления фильма
@@ -306,18 +427,14 @@ async def admin_confirm_delete(update: Update, context: CallbackContext):
         await show_admin_menu(update, context)
         return ConversationHandler.END
 
-    data = load_data()
-    movies = data.setdefault("movies", [])
-    movie = next((m for m in movies if m['id'] == movie_id), None)
+    movie = catalog.delete_movie(movie_id)
+    card_cache.invalidate(movie_id)
 
     if not movie:
-        await update.message.reply_text(f"❌ Фильм с ID {movie_id} не найден.", reply_markup=generate_admin_menu())
+        await update.message.reply_text(f"❌ Фильм с ID {movie_id} не найден.", reply_markup=ADMIN_MENU)
         return ConversationHandler.END
 
-    movies = [m for m in movies if m['id'] != movie_id]
-    save_data(data)
-
-    await update.message.reply_text(f"✅ Фильм с ID {movie_id} успешно удален.", reply_markup=generate_admin_menu())
+    await update.message.reply_text(f"✅ Фильм с ID {movie_id} успешно удален.", reply_markup=ADMIN_MENU)
     return ConversationHandler.END
 
 # Команда: Добавление нового администратора
@@ -326,7 +443,7 @@ async def add_admin_start(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ У вас нет прав на доступ к этой команде.")
         return ConversationHandler.END
 
-    await update.message.reply_text("👥 Введите Telegram ID нового администратора:", reply_markup=ReplyKeyboardMarkup([["<< Назад"]], resize_keyboard=True))
+    await update.message.reply_text("👥 Введите Telegram ID нового администратора:", reply_markup=BACK_KEYBOARD)
     return ADD_ADMIN_ID
 
 # Подтверждение добавления администратора
@@ -339,58 +456,48 @@ async def confirm_add_admin(update: Update, context: CallbackContext):
     try:
         admin_id = int(admin_id)
     except ValueError:
-        await update.message.reply_text("❌ Пожалуйста, введите корректный ID (число).", reply_markup=generate_admin_menu())
+        await update.message.reply_text("❌ Пожалуйста, введите корректный ID (число).", reply_markup=ADMIN_MENU)
         return ADD_ADMIN_ID
 
-    data = load_data()
-    admins = data.setdefault("admins", [])
+    admins = get_admins()
     if admin_id in admins:
-        await update.message.reply_text(f"❌ Пользователь с ID {admin_id} уже является администратором.", reply_markup=generate_admin_menu())
+        await update.message.reply_text(f"❌ Пользователь с ID {admin_id} уже является администратором.", reply_markup=ADMIN_MENU)
         return ConversationHandler.END
 
-    admins.append(admin_id)
-    data["admins"] = admins
-    save_data(data)
+    if catalog.admins() is None:
+        catalog.add_admin(ADMIN_ID)  # Сохраняем главного админа, раз список заводится впервые
+    catalog.add_admin(admin_id)
 
-    await update.message.reply_text(f"✅ Пользователь с ID {admin_id} успешно добавлен как администратор.", reply_markup=generate_admin_menu())
+    await update.message.reply_text(f"✅ Пользователь с ID {admin_id} успешно добавлен как администратор.", reply_markup=ADMIN_MENU)
     return ConversationHandler.END
 
 # Отмена операции
 async def cancel(update: Update, context: CallbackContext):
-    await update.message.reply_text(" OPERATION CANCELLED.", reply_markup=generate_admin_menu())
+    await update.message.reply_text(" OPERATION CANCELLED.", reply_markup=ADMIN_MENU)
     return ConversationHandler.END
-# Функция для обработки входящих обновлений
-async def process_update(update_data):
-    application = Application.builder().token(BOT_TOKEN).build()
-    update = Update.de_json(update_data, application.bot)
-    await application.process_update(update)
-
-# Основная функция
-async def main():
-    application = Application.builder().token(BOT_TOKEN).build()
-
-    # Удаляем старый webhook
-    await application.bot.delete_webhook()
-
-    # Устанавливаем новый webhook
-    WEBHOOK_URL = f"https://YOUR_RAILWAY_APP_URL/adminbot"
-    await application.bot.set_webhook(url=WEBHOOK_URL)
 
-    # Запуск бота через webhook
-    logger.info("Админ-бот запущен!")
-    await application.start()
-    await application.run_webhook(
-        listen="0.0.0.0",
-        port=int(os.getenv('PORT', 8080)),  # Использует порт из переменных окружения Railway
-        url_path="adminbot",
-        webhook_url=WEBHOOK_URL
+# Создание приложения со всеми обработчиками.
+# Приложение создаётся один раз при старте и переиспользуется для всех обновлений.
+def build_application():
+    builder = (
+        Application.builder().token(BOT_TOKEN)
+        .connection_pool_size(CONNECTION_POOL_SIZE)
+        .rate_limiter(SendScheduler())
+        .persistence(SQLitePersistence("adminbot"))
     )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
+    register_bot("adminbot", application.bot)
 
     # Настройка обработчиков
-    conv_handler = ConversationHandler(
+    conv_handler = SharedConversationHandler(
+        name="admin",
+        persistent=True,
         entry_points=[
             MessageHandler(filters.Regex("^📚 Просмотр базы$"), admin_view_movies),
             MessageHandler(filters.Regex("^➕ Добавить фильм$"), admin_add_movie_start),
+            MessageHandler(filters.Regex("^📥 Импорт из файла$"), admin_import_start),
             MessageHandler(filters.Regex("^🗑️ Удалить фильм$"), admin_delete_movie_start),
             MessageHandler(filters.Regex("^👥 Добавить администратора$"), add_admin_start)
         ],
@@ -401,6 +508,7 @@ async def main():
             ADD_GENRE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_genre)],
             ADD_PHOTO: [MessageHandler(filters.PHOTO | filters.TEXT, admin_add_photo)],
             ADD_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_url)],
+            IMPORT_FILE: [MessageHandler(filters.Document.ALL | (filters.TEXT & ~filters.COMMAND), admin_import_file)],
             DELETE_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_confirm_delete)],
             ADD_ADMIN_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_add_admin)]
         },
@@ -412,18 +520,29 @@ async def main():
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(conv_handler)
+    application.add_handler(CallbackQueryHandler(admin_movies_callback, pattern="^movies:"))
+
+    # Замер времени каждого обработчика (гистограммы для /metrics)
+    instrument(application, "adminbot")
+
+    return application
+
+# Основная функция
+async def main():
+    application = build_application()
+    WEBHOOK_URL = f"https://YOUR_RAILWAY_APP_URL/adminbot"
+
+    await application.initialize()
+
+    # Удаляем старый webhook
+    await application.bot.delete_webhook()
 
     # Запуск бота через webhook
-    logger.info("Админ-бот запущен!")
-    await application.run_webhook(
+    await application.updater.start_webhook(
         listen="0.0.0.0",
-        port=8080,
+        port=int(os.getenv('PORT', 8080)),  # Использует порт из переменных окружения Railway
         url_path="adminbot",
-        webhook_url=f"https://YOUR_RAILWAY_APP_URL/adminbot"
+        webhook_url=WEBHOOK_URL
     )
-
-  # Функция для обработки входящих обновлений
-async def process_update(update_data):
-    application = Application.builder().token(BOT_TOKEN).build()
-    update = Update.de_json(update_data, application.bot)
-    await application.process_update(update)
\ No newline at end of file
+    await application.start()
+    logger.info("Админ-бот запущен!")
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from fake_telegram import FakeTelegram, prepare_bot_environment, serve_in_background, stop_server
+from synthetic import synthetic_movies
+
+# Бенчмарк рассылки новинки: N подписчиков, часть из них заблокировала бота.
+# С --interrupt-after рассылка останавливается посреди работы и запускается заново,
+# как после перезапуска сервера; проверяется, что никто не получил сообщение дважды
+# (с точностью до пачки, не успевшей сохраниться) и никто не пропущен.
+
+
+async def run(args):
+    fake = FakeTelegram(latency=args.api_latency, max_rate=args.api_max_rate)
+    prepare_bot_environment(f"http://127.0.0.1:{args.port}")
+    fake_server = await serve_in_background(fake.app, args.port)
+
+    from catalog import catalog
+    from broadcast import Broadcaster
+    from ratelimit import SendScheduler
+    logging.getLogger().setLevel(logging.WARNING)
+
+    movie = next(synthetic_movies(1))
+    movie["photo_url"] = ""
+    catalog.add_movie(movie)
+    chat_ids = list(range(1000, 1000 + args.subscribers))
+    catalog.store.add_subscribers(chat_ids)
+    fake.blocked_chats = {str(chat_id) for chat_id in chat_ids[::args.blocked_every]} if args.blocked_every else set()
+
+    api_url = f"http://127.0.0.1:{args.port}"
+    bot = ExtBot(
+        "111:main",
+        base_url=f"{api_url}/bot",
+        base_file_url=f"{api_url}/file/bot",
+        request=HTTPXRequest(connection_pool_size=args.concurrency),
+        rate_limiter=SendScheduler(global_rate=args.rate),
+    )
+    await bot.initialize()
+
+    broadcaster = Broadcaster(catalog.store, concurrency=args.concurrency, progress_interval=3600)
+    started = time.perf_counter()
+    broadcaster.start(bot)
+    broadcast_id, total = broadcaster.enqueue(movie)
+
+    restarts = 0
+    if args.interrupt_after:
+        await asyncio.sleep(args.interrupt_after)
+        await broadcaster.stop()
+        restarts += 1
+        broadcaster.start(bot)
+
+    while catalog.store.get_broadcast(broadcast_id)['finished_at'] is None:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    await broadcaster.stop()
+    await bot.shutdown()
+    await stop_server(*fake_server)
+
+    result = catalog.store.get_broadcast(broadcast_id)
+    delivered = [chat for chat in map(str, chat_ids) if chat not in fake.blocked_chats]
+    return {
+        "subscribers": args.subscribers,
+        "concurrency": args.concurrency,
+        "rate_limit": args.rate,
+        "restarts": restarts,
+        "total": total,
+        "sent": result['sent'],
+        "blocked": result['blocked'],
+        "failed": result['failed'],
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(result['sent'] / elapsed, 1),
+        "missed_chats": sum(1 for chat in delivered if not fake.delivered[chat]),
+        "duplicate_chats": sum(1 for chat in delivered if fake.delivered[chat] > 1),
+        "subscribers_left": catalog.store.count_subscribers(),
+        "api_429": fake.errors[429],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк рассылки новинки подписчикам")
+    parser.add_argument('--subscribers', type=int, default=20000)
+    parser.add_argument('--blocked-every', type=int, default=20, help="каждый N-й подписчик заблокировал бота")
+    parser.add_argument('--concurrency', type=int, default=20)
+    # Настоящий Telegram пропускает ~30 сообщений в секунду; по умолчанию лимит выше, чтобы мерить сам движок
+    parser.add_argument('--rate', type=float, default=1000, help="лимит планировщика, сообщений в секунду")
+    parser.add_argument('--api-max-rate', type=int, default=0, help="лимит заглушки Bot API в секунду")
+    parser.add_argument('--api-latency', type=float, default=0.02)
+    parser.add_argument('--interrupt-after', type=float, default=0, help="остановить и возобновить через N секунд")
+    parser.add_argument('--port', type=int, default=18095)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), ensure_ascii=False, indent=2))
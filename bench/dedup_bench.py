@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import httpx
+
+from fake_telegram import FakeTelegram, make_update, prepare_bot_environment, serve_in_background, stop_server
+from handler_bench import write_catalog
+
+# Пользователи, которые жмут кнопки по несколько раз: webhook-сервер с заглушкой Bot API.
+# Каждый пользователь несколько раз подряд жмёт «🎬 Найти фильм», отправляет ID, повторно
+# нажимает фильм в результатах, а один «флудер» шлёт /start без остановки. Сравнивается
+# обработка без отсева (repeat_window=0, без лимита флуда, без склейки карточек) и с ним.
+
+
+def make_callback(update_id, chat_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+            "message": {
+                "message_id": update_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": "🔎 Найдено",
+            },
+            "data": data,
+        },
+    }
+
+
+async def run_mode(args, server, fake, client, movie_ids, base_chat, dedup):
+    from cinemabot import card_requests
+
+    dispatcher = server.dispatchers['cinemabot']
+    if dedup:
+        dispatcher.repeat_window, dispatcher.flood_limit, card_requests.ttl = args.repeat_window, args.flood_limit, 5.0
+    else:
+        dispatcher.repeat_window, dispatcher.flood_limit, card_requests.ttl = 0.0, 10 ** 9, 0.0
+    before_dispatcher = dispatcher.stats()
+    before_cards = card_requests.stats()
+    before_calls = sum(fake.calls.values())
+    update_ids = iter(range(base_chat * 1000, base_chat * 1000 + 10 ** 6))
+
+    async def post(update):
+        response = await client.post("/cinemabot", json=update)
+        response.raise_for_status()
+
+    async def user(chat_id, movie_id):
+        for _ in range(args.presses):
+            await post(make_update(next(update_ids), chat_id, "🎬 Найти фильм"))
+        await post(make_update(next(update_ids), chat_id, movie_id))
+        for _ in range(args.presses):
+            await post(make_callback(next(update_ids), chat_id, f"movie:{movie_id}"))
+            await asyncio.sleep(0.05)
+
+    async def flooder(chat_id):
+        for _ in range(args.flood):
+            await post(make_update(next(update_ids), chat_id, "/start"))
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        flooder(base_chat),
+        *(user(base_chat + 1 + i, movie_ids[i % len(movie_ids)]) for i in range(args.users))
+    )
+    while dispatcher.depth:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.2)
+
+    after = dispatcher.stats()
+    cards = card_requests.stats()
+    return {
+        "seconds": round(elapsed, 3),
+        "updates_sent": args.flood + args.users * (2 * args.presses + 1),
+        **{key: after[key] - before_dispatcher[key] for key in ("accepted", "flooded", "repeated", "processed")},
+        "cards": {key: cards.get(key, 0) - before_cards.get(key, 0) for key in ("executed", "cached", "joined")},
+        "api_calls": sum(fake.calls.values()) - before_calls,
+    }
+
+
+async def run(args):
+    # Лимиты исходящих запросов не нужны: считается работа, а не ожидание лимитов
+    for key in ('RATE_LIMIT_GLOBAL', 'RATE_LIMIT_CHAT', 'RATE_LIMIT_CHAT_BURST'):
+        os.environ[key] = '1000000'
+    fake = FakeTelegram(latency=args.api_latency)
+    workdir = prepare_bot_environment(f"http://127.0.0.1:{args.port}")
+    write_catalog(os.path.join(workdir, 'movies.json'), args.size)
+    fake_server = await serve_in_background(fake.app, args.port)
+
+    import server
+    from catalog import catalog
+    await server.start_bots()
+    logging.getLogger().setLevel(logging.WARNING)
+    movie_ids = [movie['id'] for movie in catalog.movies()[:args.users]]
+
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        results["no_dedup"] = await run_mode(args, server, fake, client, movie_ids, 10 ** 6, False)
+        results["dedup"] = await run_mode(args, server, fake, client, movie_ids, 2 * 10 ** 6, True)
+
+    await server.stop_bots()
+    await stop_server(*fake_server)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Повторные нажатия и флуд: отсев до обработчиков")
+    parser.add_argument('--users', type=int, default=50, help="пользователей, жмущих кнопки повторно")
+    parser.add_argument('--presses', type=int, default=3, help="нажатий каждой кнопки подряд")
+    parser.add_argument('--flood', type=int, default=300, help="обновлений от флудера")
+    parser.add_argument('--flood-limit', type=int, default=20)
+    parser.add_argument('--repeat-window', type=float, default=1.5)
+    parser.add_argument('--size', type=int, default=1000, help="фильмов в каталоге")
+    parser.add_argument('--api-latency', type=float, default=0.02)
+    parser.add_argument('--port', type=int, default=18140)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), ensure_ascii=False, indent=2))
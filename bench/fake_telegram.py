@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from urllib.parse import parse_qs
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Локальная заглушка Telegram Bot API для нагрузочных тестов.
+# Отвечает на вызовы ботов правдоподобными объектами, считает вызовы по методам,
+# умеет добавлять задержку ответа и возвращать 429 (flood control): каждый N-й вызов
+# или, как настоящий Telegram, при превышении лимита сообщений в секунду на бота и на чат.
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, flood_every=0, retry_after=1, max_rate=0, chat_rate=0):
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.max_rate = max_rate
+        self.chat_rate = chat_rate
+        self._recent = deque()
+        self._recent_by_chat = defaultdict(deque)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.blocked_chats = set()
+        self.delivered = Counter()
+        self._message_ids = itertools.count(1)
+        self._call_numbers = itertools.count(1)
+        self.app = Starlette(routes=[
+            Route('/bot{token}/{method}', self.handle, methods=['GET', 'POST']),
+            Route('/file/bot{token}/{path:path}', self.download),
+            Route('/stats', self.stats),
+        ])
+
+    async def _params(self, request):
+        content_type = request.headers.get('content-type', '')
+        body = await request.body()
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        return {}
+
+    def _message(self, params):
+        chat_id = params.get('chat_id', 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get('text') or params.get('caption') or "",
+        }
+
+    def _result(self, method, params):
+        if method == 'getMe':
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if method == 'sendPhoto':
+            message = self._message(params)
+            message["photo"] = [{
+                "file_id": f"fake-photo-{message['message_id']}", "file_unique_id": "fake",
+                "width": 320, "height": 480
+            }]
+            return message
+        if method in ('sendMessage', 'sendDocument', 'editMessageText'):
+            return self._message(params)
+        if method == 'getFile':
+            return {
+                "file_id": params.get('file_id', ''), "file_unique_id": "fake",
+                "file_size": 1, "file_path": "photos/fake.jpg"
+            }
+        return True
+
+    # Превышен ли лимит: больше limit вызовов за последнюю секунду
+    @staticmethod
+    def _over_limit(recent, limit, now):
+        while recent and now - recent[0] >= 1.0:
+            recent.popleft()
+        if len(recent) >= limit:
+            return True
+        recent.append(now)
+        return False
+
+    def _flooded(self, params):
+        if self.flood_every and next(self._call_numbers) % self.flood_every == 0:
+            return True
+        now = time.monotonic()
+        chat_id = params.get('chat_id')
+        if self.chat_rate and chat_id is not None:
+            if self._over_limit(self._recent_by_chat[str(chat_id)], self.chat_rate, now):
+                return True
+        return bool(self.max_rate) and self._over_limit(self._recent, self.max_rate, now)
+
+    async def handle(self, request: Request):
+        method = request.path_params['method']
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self._flooded(params):
+            self.errors[429] += 1
+            return JSONResponse({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }, status_code=429)
+
+        if str(params.get('chat_id')) in self.blocked_chats:
+            self.errors[403] += 1
+            return JSONResponse({
+                "ok": False, "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user"
+            }, status_code=403)
+
+        if method in ('sendMessage', 'sendPhoto'):
+            self.delivered[str(params.get('chat_id'))] += 1
+        return JSONResponse({"ok": True, "result": self._result(method, params)})
+
+    # Скачивание файла по file_path из getFile: отдаём несколько байт «картинки»
+    async def download(self, request: Request):
+        self.calls['download'] += 1
+        return Response(b'\xff\xd8\xff\xe0fake-jpeg', media_type='image/jpeg')
+
+    async def stats(self, request: Request):
+        return JSONResponse({"calls": dict(self.calls), "errors": dict(self.errors)})
+
+
+# Синтетическое обновление с текстовым сообщением от пользователя
+def make_update(update_id, chat_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+        "text": text,
+    }
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+# Окружение для импорта ботов: токены, адрес заглушки и отдельный рабочий каталог
+# (там окажутся база, файл блокировки лидера и снимки). Вызывать до импорта cinemabot/adminbot/server.
+def prepare_bot_environment(api_url, workdir=None):
+    workdir = workdir or tempfile.mkdtemp(prefix='kinobot-bench-')
+    os.environ.setdefault('MAIN_BOT_TOKEN', '111:main')
+    os.environ.setdefault('ADMIN_BOT_TOKEN', '222:admin')
+    os.environ.setdefault('ADMIN_ID', '1')
+    os.environ['TELEGRAM_API_URL'] = api_url
+    os.environ['MOVIES_DB'] = os.path.join(workdir, 'movies.db')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    os.chdir(workdir)
+    return workdir
+
+
+# Запуск ASGI-приложения в текущем event loop; возвращает сервер и его задачу
+async def serve_in_background(app, port, host='127.0.0.1'):
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level='warning'))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def stop_server(server, task):
+    server.should_exit = True
+    await task
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунды")
+    parser.add_argument('--flood-every', type=int, default=0, help="каждый N-й вызов отвечает 429")
+    parser.add_argument('--max-rate', type=int, default=0, help="лимит вызовов в секунду на бота")
+    parser.add_argument('--chat-rate', type=int, default=0, help="лимит вызовов в секунду на чат")
+    args = parser.parse_args()
+    fake = FakeTelegram(
+        latency=args.latency, flood_every=args.flood_every, max_rate=args.max_rate, chat_rate=args.chat_rate
+    )
+    uvicorn.run(fake.app, host='127.0.0.1', port=args.port)
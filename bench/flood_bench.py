@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from fake_telegram import FakeTelegram, serve_in_background, stop_server
+from ratelimit import SendScheduler, BULK
+
+# Проверка планировщика исходящих сообщений на заглушке Bot API, которая, как Telegram,
+# отвечает 429 при превышении лимитов на бота и на чат.
+# Одновременно идут ответы пользователям (несколько сообщений подряд в каждый чат)
+# и массовая рассылка; без планировщика (--no-limiter) часть сообщений теряется.
+
+
+def latency_stats(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    return {
+        "p50_s": round(statistics.median(samples), 3),
+        "p99_s": round(samples[max(int(len(samples) * 0.99) - 1, 0)], 3),
+        "max_s": round(samples[-1], 3),
+    }
+
+
+async def run(args):
+    fake = FakeTelegram(
+        latency=args.api_latency, retry_after=args.retry_after, max_rate=args.max_rate, chat_rate=args.chat_rate
+    )
+    fake_server = await serve_in_background(fake.app, args.port)
+    api_url = f"http://127.0.0.1:{args.port}"
+
+    scheduler = None if args.no_limiter else SendScheduler(global_rate=args.max_rate * 0.9)
+    bot = ExtBot(
+        "111:bench",
+        base_url=f"{api_url}/bot",
+        base_file_url=f"{api_url}/file/bot",
+        request=HTTPXRequest(connection_pool_size=64),
+        rate_limiter=scheduler,
+    )
+    await bot.initialize()
+
+    latencies = {"interactive": [], "bulk": []}
+    failed = {"interactive": 0, "bulk": 0}
+    started = time.perf_counter()
+
+    async def send(chat_id, text, kind):
+        try:
+            if kind == "bulk":
+                await bot.send_message(chat_id, text, rate_limit_args=BULK)
+            else:
+                await bot.send_message(chat_id, text)
+            latencies[kind].append(time.perf_counter() - started)
+        except Exception:
+            failed[kind] += 1
+
+    jobs = [
+        send(1000 + chat, f"Ответ {i}", "interactive")
+        for chat in range(args.chats) for i in range(args.messages)
+    ]
+    jobs += [send(100000 + chat, "Рассылка", "bulk") for chat in range(args.bulk)]
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - started
+
+    await bot.shutdown()
+    await stop_server(*fake_server)
+
+    return {
+        "limiter": scheduler is not None,
+        "interactive_sent": len(latencies["interactive"]),
+        "interactive_failed": failed["interactive"],
+        "interactive_latency": latency_stats(latencies["interactive"]),
+        "bulk_sent": len(latencies["bulk"]),
+        "bulk_failed": failed["bulk"],
+        "bulk_latency": latency_stats(latencies["bulk"]),
+        "seconds": round(elapsed, 3),
+        "api_calls": fake.calls["sendMessage"],
+        "api_429": fake.errors[429],
+        "scheduler": scheduler.stats() if scheduler else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Проверка планировщика исходящих сообщений")
+    parser.add_argument('--chats', type=int, default=50, help="чатов с интерактивными ответами")
+    parser.add_argument('--messages', type=int, default=3, help="сообщений подряд в каждый чат")
+    parser.add_argument('--bulk', type=int, default=200, help="сообщений массовой рассылки")
+    parser.add_argument('--max-rate', type=int, default=30, help="лимит заглушки на бота, в секунду")
+    parser.add_argument('--chat-rate', type=int, default=3, help="лимит заглушки на чат, в секунду")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--api-latency', type=float, default=0.02)
+    parser.add_argument('--port', type=int, default=18090)
+    parser.add_argument('--no-limiter', action='store_true', help="отправлять без планировщика")
+    logging.getLogger().setLevel(logging.WARNING)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), ensure_ascii=False, indent=2))
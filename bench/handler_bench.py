@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+from fake_telegram import make_update, prepare_bot_environment
+from synthetic import synthetic_movies
+
+# Набор бенчмарков обработчиков на синтетических каталогах (1k / 10k / 100k / 1M фильмов).
+# Для каждого размера запускается отдельный процесс: каталог и боты — синглтоны модулей,
+# а пик RSS процесса должен относиться к одному размеру. Заглушка Bot API работает
+# в своём процессе, чтобы её ответы не искажали замеры времени и записанных байт.
+#
+# Сценарии (обновления в формате Telegram, как их присылает webhook):
+#   find_movie        — поиск по ID/коду в cinemabot (шаг диалога после «🎬 Найти фильм»)
+#   search_movie      — полнотекстовый поиск по названию
+#   admin_view_movies — первая страница «📚 Просмотр базы»
+#   add_movie         — весь диалог ADD_* (каждый шаг отдельно и операция целиком)
+#   webhook /stats /metrics /health — HTTP-эндпоинты server.py
+#
+# Результат — JSON; --compare печатает изменения p50/p99 относительно прошлого прогона.
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+ADMIN_CHAT = 1
+ADD_STEPS = ("admin_add_title", "admin_add_year", "admin_add_director", "admin_add_genre",
+             "admin_add_photo", "admin_add_url")
+
+
+def read_io():
+    try:
+        with open('/proc/self/io') as file:
+            return {key: int(value) for key, value in (line.split(': ') for line in file)}
+    except OSError:
+        return {}
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        return None
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def db_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+
+# Каталог movies.json пишется по одному фильму, без сборки всего документа в памяти
+def write_catalog(path, size):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{"admins": [%d], "movies": [\n' % ADMIN_CHAT)
+        for i, movie in enumerate(synthetic_movies(size)):
+            file.write((",\n" if i else "") + json.dumps(movie, ensure_ascii=False))
+        file.write("\n]}\n")
+
+
+# Замер серии операций: задержки, пропускная способность, память и запись на диск
+class Recorder:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.results = {}
+
+    def start(self):
+        self._io = read_io()
+        self._db = db_bytes(self.db_path)
+        self._started = time.perf_counter()
+
+    def finish(self, name, samples, operations=None):
+        elapsed = time.perf_counter() - self._started
+        io = read_io()
+        operations = operations or len(samples)
+        samples = sorted(samples)
+        result = {
+            "operations": operations,
+            "p50_ms": round(statistics.median(samples) * 1000, 3),
+            "p99_ms": round(samples[max(int(len(samples) * 0.99) - 1, 0)] * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+            "ops_per_second": round(operations / elapsed, 1),
+            "rss_mb": round(current_rss_mb() or 0, 1),
+            "peak_rss_mb": round(max(peak_rss_mb(), current_rss_mb() or 0), 1),
+            "db_growth_bytes_per_op": round((db_bytes(self.db_path) - self._db) / operations, 1),
+        }
+        if io:
+            result["io_write_bytes_per_op"] = round((io['wchar'] - self._io['wchar']) / operations, 1)
+            result["disk_write_bytes_per_op"] = round((io['write_bytes'] - self._io['write_bytes']) / operations, 1)
+        self.results[name] = result
+        return result
+
+
+async def run_size(args):
+    # Лимиты отправки Telegram здесь не нужны: меряется работа самих обработчиков
+    for key in ('RATE_LIMIT_GLOBAL', 'RATE_LIMIT_CHAT', 'RATE_LIMIT_CHAT_BURST'):
+        os.environ[key] = '1000000'
+    workdir = prepare_bot_environment(args.api_url)
+    write_catalog(os.path.join(workdir, 'movies.json'), args.size)
+    logging.basicConfig(level=logging.WARNING)
+
+    started = time.perf_counter()
+    import server
+    from catalog import catalog
+    from telegram import Update
+    logging.getLogger().setLevel(logging.WARNING)
+    len(catalog)
+    load_seconds = time.perf_counter() - started
+
+    await server.start_bots()
+    cinemabot = server.applications['cinemabot']
+    adminbot = server.applications['adminbot']
+    recorder = Recorder(os.environ['MOVIES_DB'])
+    rng = random.Random(7)
+    movies = catalog.movies()
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def send(application, chat_id, text):
+        update = Update.de_json(make_update(next(update_ids), chat_id, text), application.bot)
+        started = time.perf_counter()
+        await application.process_update(update)
+        return time.perf_counter() - started
+
+    # Каждая операция — в своём чате, как у разных пользователей
+    async def dialog(application, entry, queries, name):
+        await send(application, 10 ** 6, entry)
+        await send(application, 10 ** 6, queries[0])
+        recorder.start()
+        samples = []
+        for i, query in enumerate(queries):
+            await send(application, 10 ** 6 + i, entry)
+            samples.append(await send(application, 10 ** 6 + i, query))
+        recorder.finish(name, samples)
+
+    picks = [rng.choice(movies) for _ in range(args.ops)]
+    await dialog(cinemabot, "🎬 Найти фильм",
+                 [movie['id'] if i % 2 else movie['code'] for i, movie in enumerate(picks)], "find_movie")
+    index_started = time.perf_counter()
+    catalog.index("search")
+    index_seconds = time.perf_counter() - index_started
+    await dialog(cinemabot, "🔎 Поиск по названию",
+                 [" ".join(movie['title'].split()[:2]) for movie in picks], "search_movie")
+
+    await send(adminbot, ADMIN_CHAT, "📚 Просмотр базы")
+    recorder.start()
+    samples = [await send(adminbot, ADMIN_CHAT, "📚 Просмотр базы") for _ in range(args.ops)]
+    recorder.finish("admin_view_movies", samples)
+
+    steps = {name: [] for name in ADD_STEPS}
+    totals = []
+    recorder.start()
+    for i in range(max(args.ops // 5, 1)):
+        answers = (f"Бенчмарк {i}", "2001", "Режиссёр", "Драма, Комедия", "<< Пропустить", f"https://example.com/{i}")
+        total = await send(adminbot, ADMIN_CHAT, "➕ Добавить фильм")
+        for name, text in zip(ADD_STEPS, answers):
+            elapsed = await send(adminbot, ADMIN_CHAT, text)
+            steps[name].append(elapsed)
+            total += elapsed
+        totals.append(total)
+    recorder.finish("add_movie", totals)
+    for name, samples in steps.items():
+        recorder.results["add_movie"].setdefault("steps", {})[name] = {
+            "p50_ms": round(statistics.median(samples) * 1000, 3),
+            "p99_ms": round(sorted(samples)[max(int(len(samples) * 0.99) - 1, 0)] * 1000, 3),
+        }
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def request(method, path, **kwargs):
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        recorder.start()
+        samples = [
+            await request("POST", "/cinemabot", json=make_update(next(update_ids), 2 * 10 ** 6 + i, "/start"))
+            for i in range(args.ops)
+        ]
+        while server.dispatchers['cinemabot'].depth:
+            await asyncio.sleep(0.01)
+        recorder.finish("webhook", samples)
+        for path in ("/stats", "/metrics", "/health"):
+            recorder.start()
+            samples = [await request("GET", path) for _ in range(max(args.ops // 5, 1))]
+            recorder.finish(path.strip('/'), samples)
+
+    await server.stop_bots()
+    return {
+        "size": args.size,
+        "catalog_load_seconds": round(load_seconds, 3),
+        "search_index_seconds": round(index_seconds, 3),
+        "scenarios": recorder.results,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Изменение p50/p99 по сравнению с прошлым прогоном (в процентах; плюс — стало медленнее)
+def compare(previous, current):
+    old = {(run["size"], name): result for run in previous["runs"] for name, result in run["scenarios"].items()}
+    changes = []
+    for run in current["runs"]:
+        for name, result in run["scenarios"].items():
+            before = old.get((run["size"], name))
+            if not before:
+                continue
+            changes.append({
+                "size": run["size"],
+                "scenario": name,
+                **{
+                    f"{key}_change_pct": round((result[key] - before[key]) / before[key] * 100, 1)
+                    for key in ("p50_ms", "p99_ms") if before[key]
+                },
+            })
+    return changes
+
+
+def main(args):
+    script = os.path.abspath(__file__)
+    api = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(script), "fake_telegram.py"), "--port", str(args.api_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{api_url}/stats")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        runs = []
+        for size in (int(size) for size in args.sizes.split(',')):
+            output = subprocess.run(
+                [sys.executable, script, "--worker", "--size", str(size), "--ops", str(args.ops), "--api-url", api_url],
+                capture_output=True, text=True, check=True
+            ).stdout
+            runs.append(json.loads(output))
+            print(f"{size}: готово", file=sys.stderr)
+    finally:
+        api.terminate()
+        api.wait()
+
+    result = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec='seconds'),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "ops": args.ops,
+        },
+        "runs": runs,
+    }
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            result["compare"] = compare(json.load(file), result)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + "\n")
+    print(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков ботов на синтетических каталогах")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="размеры каталога через запятую")
+    parser.add_argument('--ops', type=int, default=500, help="операций на сценарий")
+    parser.add_argument('--api-port', type=int, default=18110)
+    parser.add_argument('--output', help="сохранить результат в файл")
+    parser.add_argument('--compare', help="файл прошлого прогона для сравнения")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(asyncio.run(run_size(args)), ensure_ascii=False))
+    else:
+        main(args)
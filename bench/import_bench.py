@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import synthetic_movies
+
+# Бенчмарк массового импорта фильмов из CSV/JSONL (как после загрузки файла в админ-бот)
+# и потоковой выгрузки обратно. Каждый N-й фильм портится, чтобы проверить отчёт об ошибках.
+
+
+def write_file(path, fmt, count, broken_every):
+    fields = ("title", "year", "director", "genre", "photo_url", "watch_url")
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        if fmt == "csv":
+            writer.writerow(fields)
+        for i, movie in enumerate(synthetic_movies(count), 1):
+            if broken_every and i % broken_every == 0:
+                movie["year"] = "не год"
+            if fmt == "csv":
+                writer.writerow([", ".join(movie[f]) if f == "genre" else movie[f] for f in fields])
+            else:
+                file.write(json.dumps({f: movie[f] for f in fields}, ensure_ascii=False) + "\n")
+
+
+async def run(args, workdir):
+    from catalog import Catalog
+    import bulk
+
+    path = os.path.join(workdir, f"movies.{args.format}")
+    write_file(path, args.format, args.rows, args.broken_every)
+
+    catalog = Catalog(os.path.join(workdir, "bench.db"), os.path.join(workdir, "missing.json"))
+    if args.with_search:
+        catalog.index("search")
+        catalog.index("facets")
+
+    # Самая долгая остановка event loop за время импорта (обработчики в это время стоят)
+    # и самый долгий поиск с просмотром жанра, как у обработчика, включая эту остановку
+    stalls = [0.0, 0.0]
+
+    async def ticker():
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls[0] = max(stalls[0], time.perf_counter() - tick - 0.01)
+            if args.with_search:
+                catalog.search("фильм")
+                catalog.browse("драма")
+                stalls[1] = max(stalls[1], time.perf_counter() - tick - 0.01)
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    importer = await bulk.MovieImporter(catalog, batch_size=args.batch).run(path, args.format)
+    import_seconds = time.perf_counter() - started
+    ticking.cancel()
+
+    bulk.catalog = catalog
+    started = time.perf_counter()
+    export_path = bulk.export_movies(args.format)
+    export_seconds = time.perf_counter() - started
+    export_size = os.path.getsize(export_path)
+    os.remove(export_path)
+
+    return {
+        "rows": args.rows,
+        "format": args.format,
+        "batch": args.batch,
+        "with_search": args.with_search,
+        "imported": importer.imported,
+        "errors": len(importer.errors),
+        "import_seconds": round(import_seconds, 3),
+        "rows_per_second": round(args.rows / import_seconds),
+        "loop_max_stall_ms": round(stalls[0] * 1000, 1),
+        "search_max_ms": round(stalls[1] * 1000, 1),
+        "in_database": catalog.store.conn.execute("SELECT COUNT(*) FROM movies").fetchone()[0],
+        "export_seconds": round(export_seconds, 3),
+        "export_mb": round(export_size / 1024 / 1024, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк импорта и выгрузки каталога")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--format', choices=("csv", "jsonl"), default="csv")
+    parser.add_argument('--batch', type=int, default=5000, help="строк на транзакцию")
+    parser.add_argument('--broken-every', type=int, default=1000, help="каждая N-я строка с ошибкой")
+    parser.add_argument('--with-search', action='store_true', help="поисковый индекс уже построен")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        print(json.dumps(asyncio.run(run(args, workdir)), ensure_ascii=False, indent=2))
@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+
+from fake_telegram import FakeTelegram, make_update, prepare_bot_environment, serve_in_background, stop_server
+
+# Нагрузочный тест webhook-сервера: N обновлений /start в /cinemabot с заданной параллельностью.
+# Считает, сколько запросов в секунду принимает сервер и сколько ответов бот успевает
+# отправить в заглушку Bot API.
+
+
+async def run(args):
+    fake = FakeTelegram(latency=args.api_latency)
+    api_port, server_port = args.port, args.port + 1
+    prepare_bot_environment(f"http://127.0.0.1:{api_port}")
+    fake_server = await serve_in_background(fake.app, api_port)
+
+    import server
+    logging.getLogger().setLevel(logging.WARNING)  # Логи каждого запроса искажают замер
+    bots_server = await serve_in_background(server.app, server_port)
+
+    url = f"http://127.0.0.1:{server_port}/cinemabot"
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses = {}
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        async def send(update_id):
+            async with semaphore:
+                response = await client.post(url, json=make_update(update_id, 1000 + update_id, "/start"))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(1, args.requests + 1)))
+        accepted = time.perf_counter() - started
+
+        while fake.calls['sendMessage'] < args.requests and time.perf_counter() - started < args.timeout:
+            await asyncio.sleep(0.01)
+        processed = time.perf_counter() - started
+
+    dispatcher_stats = server.dispatchers['cinemabot'].stats()
+    await stop_server(*bots_server)
+    await stop_server(*fake_server)
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "statuses": statuses,
+        "accept_seconds": round(accepted, 3),
+        "accept_rps": round(args.requests / accepted, 1),
+        "replies_sent": fake.calls['sendMessage'],
+        "end_to_end_seconds": round(processed, 3),
+        "end_to_end_rps": round(fake.calls['sendMessage'] / processed, 1),
+        "dispatcher": dispatcher_stats,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Нагрузочный тест webhook-сервера")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--api-latency', type=float, default=0.05, help="задержка заглушки Bot API, секунды")
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), ensure_ascii=False, indent=2))
@@ -0,0 +1,97 @@
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from handler_bench import write_catalog
+
+# Память процесса под каталог: словари (как их отдаёт база) против записей MovieRecord
+# со ссылками в общем файле снимка (mmap). Каждый режим — в своём процессе.
+# anonymous — собственная память воркера; прочитанные через mmap ссылки попадают в file:
+# это страницы кэша ОС, одни на все воркеры.
+
+
+def memory_mb():
+    result = {}
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            for line in file:
+                key, _, value = line.partition(':')
+                if key in ("Rss", "Anonymous"):
+                    result[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(result["Rss"], 1),
+        "anonymous_mb": round(result["Anonymous"], 1),
+        "file_mb": round(result["Rss"] - result["Anonymous"], 1),
+    }
+
+
+def run_mode(args):
+    from catalog import Catalog
+
+    catalog = Catalog(os.path.join(args.workdir, "movies.db"), os.path.join(args.workdir, "movies.json"))
+    catalog.store.import_json_once(catalog.json_file)
+    gc.collect()
+    before = memory_mb()
+    started = time.perf_counter()
+    if args.mode == "dicts":
+        # Те же словари id -> фильм, code -> фильм и позиции, что строит каталог; держит их он же,
+        # чтобы до замера памяти они не были собраны
+        movies = catalog.store.all_movies()
+        catalog.by_id, catalog.by_code, catalog.positions = (
+            {movie['id']: movie for movie in movies},
+            {movie['code']: movie for movie in movies if movie.get('code')},
+            {movie['id']: i for i, movie in enumerate(movies)},
+        )
+    else:
+        movies = catalog.movies()
+    load_seconds = time.perf_counter() - started
+    # Ссылки всех фильмов читаются, как при показе карточек
+    started = time.perf_counter()
+    url_bytes = sum(len(movie['watch_url']) + len(movie['photo_url']) for movie in movies)
+    urls_seconds = time.perf_counter() - started
+    gc.collect()
+    after = memory_mb()
+    return {
+        "mode": args.mode,
+        "movies": len(movies),
+        "load_seconds": round(load_seconds, 3),
+        "read_all_urls_seconds": round(urls_seconds, 3),
+        "url_mb": round(url_bytes / 1024 / 1024, 1),
+        **{f"catalog_{key}": round(after[key] - before[key], 1) for key in after},
+    }
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        write_catalog(os.path.join(workdir, "movies.json"), args.size)
+        runs = []
+        # Снимок пишется при первой загрузке записей: прогон «records» делается дважды
+        for mode in ("dicts", "records", "records"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", "--mode", mode, "--workdir", workdir],
+                capture_output=True, text=True, check=True
+            ).stdout
+            runs.append(json.loads(output))
+    return {"size": args.size, "runs": runs}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Память процесса под каталог фильмов")
+    parser.add_argument('--size', type=int, default=100000, help="фильмов в каталоге")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--mode', choices=("dicts", "records"), help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_mode(args), ensure_ascii=False))
+    else:
+        print(json.dumps(main(args), ensure_ascii=False, indent=2))
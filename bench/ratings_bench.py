@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Бенчмарк оценок при «вирусном» фильме: votes зрителей одновременно голосуют за один фильм
+# (и немного — за остальные). Голоса идут как нажатия кнопок через UpdateDispatcher, как в боте.
+# Сравниваются обработчики: запись каждого голоса своей транзакцией (per_vote), ожидание записи
+# пачки Ratings внутри обработчика (awaiting — очередь чата стоит до записи) и пачка, запись
+# которой ждут вне обработчика (background), плюс цена обновления топа против сортировки всех фильмов.
+
+
+def percentile(samples, share):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def make_votes(args):
+    rng = random.Random(7)
+    votes = []
+    for user_id in range(args.votes):
+        movie_id = "1" if rng.random() < 0.9 else str(rng.randrange(2, args.movies + 2))
+        votes.append((movie_id, user_id, rng.randint(1, 10)))
+    return votes
+
+
+# Нажатие кнопки оценки: ровно то, что диспетчер читает из telegram.Update
+def make_update(update_id, movie_id, user_id, score):
+    user = SimpleNamespace(id=user_id)
+    return SimpleNamespace(
+        update_id=update_id, effective_chat=user, effective_user=user, message=None,
+        callback_query=SimpleNamespace(data=f"vote:{movie_id}:{score}"),
+    )
+
+
+# Голоса приходят волнами по wave штук (обновления, разобранные за один проход цикла событий).
+# Задержка голоса — от передачи диспетчеру до конца обработчика, т. е. вместе с ожиданием в очереди.
+async def run_dispatched(store, votes, mode, flush_interval, wave):
+    from dispatcher import UpdateDispatcher
+    from ratings import Ratings
+
+    ratings = Ratings(store, flush_interval=flush_interval)
+    submitted = {}
+    samples = []
+    saving = []
+
+    async def handle(update):
+        movie_id, score = update.callback_query.data[len("vote:"):].rsplit(':', 1)
+        user_id = update.effective_user.id
+        if mode == "per_vote":
+            store.save_votes([(movie_id, user_id, int(score), None, time.time(), 0.0)])
+        elif mode == "awaiting":
+            await ratings.vote(movie_id, user_id, int(score))
+        else:
+            saving.append(ratings.vote(movie_id, user_id, int(score)))
+        samples.append(time.perf_counter() - submitted[update.update_id])
+
+    dispatcher = UpdateDispatcher(f"ratings-{mode}", handle, max_depth=len(votes) + 1,
+                                  flood_limit=len(votes) + 1, repeat_window=0.0)
+    dispatcher.start()
+    started = time.perf_counter()
+    for i in range(0, len(votes), wave):
+        for update_id, vote in enumerate(votes[i:i + wave], i):
+            submitted[update_id] = time.perf_counter()
+            dispatcher.submit(make_update(update_id, *vote))
+        await asyncio.sleep(0.001)
+    await dispatcher.stop(timeout=None)
+    handled_seconds = time.perf_counter() - started
+    await asyncio.gather(*saving)
+    saved_seconds = time.perf_counter() - started
+    return {
+        "votes": len(samples),
+        "handled_seconds": round(handled_seconds, 3),
+        "saved_seconds": round(saved_seconds, 3),
+        "votes_per_second": round(len(samples) / saved_seconds, 1),
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        "queue_wait_max_ms": round(dispatcher.wait_max * 1000, 2),
+        "transactions": len(votes) if mode == "per_vote" else ratings.counters['transactions'],
+        "flush_interval": None if mode == "per_vote" else flush_interval,
+    }
+
+
+# Обновление топа на каждый голос: TopK против полной сортировки всех фильмов
+def run_top(args):
+    from ratings import TopK
+
+    rng = random.Random(7)
+    scores = {str(i): rng.random() for i in range(args.movies)}
+    top = TopK()
+    for movie_id, key in scores.items():
+        top.scores[movie_id] = key
+    top.rebuild()
+    updates = [(str(rng.randrange(args.movies)), rng.random()) for _ in range(args.top_updates)]
+
+    started = time.perf_counter()
+    for movie_id, key in updates:
+        top.update(movie_id, key)
+        top.top(10)
+    topk_seconds = time.perf_counter() - started
+
+    sample = updates[:max(1, args.top_updates // 100)]
+    started = time.perf_counter()
+    for movie_id, key in sample:
+        scores[movie_id] = key
+        sorted(scores.items(), key=lambda item: item[1], reverse=True)[:10]
+    sort_seconds = (time.perf_counter() - started) / len(sample) * len(updates)
+    return {
+        "movies": args.movies,
+        "updates": len(updates),
+        "topk_us_per_update": round(topk_seconds / len(updates) * 10 ** 6, 2),
+        "sort_us_per_update": round(sort_seconds / len(updates) * 10 ** 6, 2),
+        "topk_rebuilds": top.rebuilds,
+    }
+
+
+async def main(args):
+    from storage import MovieStore
+
+    votes = make_votes(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        store = MovieStore(os.path.join(workdir, "per_vote.db"))
+        results["per_vote"] = await run_dispatched(store, votes, "per_vote", None, args.wave)
+        for flush_interval in args.flush_intervals:
+            for mode in ("awaiting", "background"):
+                store = MovieStore(os.path.join(workdir, f"{mode}_{flush_interval}.db"))
+                results[f"{mode}_{flush_interval}"] = await run_dispatched(
+                    store, votes, mode, flush_interval, args.wave
+                )
+    results["top"] = run_top(args)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк оценок фильмов")
+    parser.add_argument('--votes', type=int, default=5000, help="голосов всего")
+    parser.add_argument('--movies', type=int, default=100000, help="фильмов с оценками")
+    parser.add_argument('--wave', type=int, default=50, help="голосов в одной волне")
+    parser.add_argument('--flush-intervals', type=lambda value: [float(item) for item in value.split(',')],
+                        default=[0.02, 0.1], help="интервалы записи пачек, через запятую")
+    parser.add_argument('--top-updates', type=int, default=20000, help="обновлений топа")
+    print(json.dumps(asyncio.run(main(parser.parse_args())), ensure_ascii=False, indent=2))
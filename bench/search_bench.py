@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex
+from synthetic import synthetic_movies, TITLE_WORDS, DIRECTORS
+
+# Бенчмарк поискового индекса: построение, поиск (точный, с опечатками, по режиссёру)
+# и инкрементальное добавление/удаление фильмов.
+
+
+# Опечатка: пропуск, замена или перестановка одной буквы
+def make_typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(("drop", "swap", "replace"))
+    if kind == "drop":
+        return word[:i] + word[i + 1:]
+    if kind == "swap":
+        return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+    return word[:i] + rng.choice("аеиоуя") + word[i + 1:]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p99_ms": round(samples[int(len(samples) * 0.99) - 1] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def measure(index, queries, limit):
+    timings = []
+    hits = 0
+    for query in queries:
+        started = time.perf_counter()
+        found = index.search(query, limit)
+        timings.append(time.perf_counter() - started)
+        hits += bool(found)
+    return {**percentiles(timings), "queries": len(queries), "with_results": hits}
+
+
+def run(args):
+    rng = random.Random(1)
+    movies = list(synthetic_movies(args.movies))
+
+    started = time.perf_counter()
+    index = SearchIndex(movies)
+    build_seconds = time.perf_counter() - started
+
+    exact = [" ".join(rng.sample(TITLE_WORDS, 2)) for _ in range(args.queries)]
+    typos = [make_typo(rng.choice(TITLE_WORDS).lower(), rng) for _ in range(args.queries)]
+    directors = [rng.choice(DIRECTORS).split()[1].upper().replace("Ё", "Е") for _ in range(args.queries)]
+
+    results = {
+        "movies": args.movies,
+        "vocabulary": len(index.postings),
+        "build_seconds": round(build_seconds, 3),
+        "exact": measure(index, exact, args.limit),
+        "typo": measure(index, typos, args.limit),
+        "director_casefold": measure(index, directors, args.limit),
+    }
+
+    # Инкрементальные изменения: добавить и удалить фильм без перестройки индекса
+    extra = list(synthetic_movies(args.movies + 1000, seed=7))[args.movies:]
+    timings = []
+    for movie in extra:
+        started = time.perf_counter()
+        index.add(movie)
+        index.remove(movie["id"])
+        timings.append(time.perf_counter() - started)
+    results["add_remove"] = percentiles(timings)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска по названию")
+    parser.add_argument('--movies', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=10)
+    print(json.dumps(run(parser.parse_args()), ensure_ascii=False, indent=2))
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from fake_telegram import prepare_bot_environment
+from handler_bench import write_catalog
+
+# Бенчмарк холодного старта воркера: python server.py запускается заново несколько раз подряд
+# на одном каталоге и опрашивается /health. Меряется время от запуска процесса до первого
+# ответа и до готовности ботов (ready), плюс этапы запуска из /health (startup_ms).
+# Первый запуск переносит movies.json в SQLite и пишет снимок каталога, следующие читают снимок.
+
+
+def run_once(port, timeout):
+    env = dict(os.environ, PORT=str(port))
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SERVER], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_response = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"сервер завершился с кодом {process.returncode}")
+            try:
+                health = httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).json()
+            except httpx.TransportError:
+                time.sleep(0.005)
+                continue
+            first_response = first_response or time.perf_counter() - started
+            if health["ready"]:
+                return {
+                    "first_response_ms": round(first_response * 1000, 1),
+                    "ready_ms": round((time.perf_counter() - started) * 1000, 1),
+                    "startup_ms": health["startup_ms"],
+                }
+            time.sleep(0.005)
+        raise RuntimeError("сервер не запустился")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(args):
+    api = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_telegram.py"), "--port", str(args.api_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{api_url}/stats")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        workdir = prepare_bot_environment(api_url)
+        write_catalog(os.path.join(workdir, 'movies.json'), args.size)
+        runs = [run_once(args.port, args.timeout) for _ in range(args.runs)]
+    finally:
+        api.terminate()
+        api.wait()
+    return {"size": args.size, "runs": runs}
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER = os.path.join(os.path.dirname(BENCH_DIR), "server.py")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта воркера")
+    parser.add_argument('--size', type=int, default=100000, help="фильмов в каталоге")
+    parser.add_argument('--runs', type=int, default=3, help="запусков подряд")
+    parser.add_argument('--port', type=int, default=18120)
+    parser.add_argument('--api-port', type=int, default=18121)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    print(json.dumps(main(parser.parse_args()), ensure_ascii=False, indent=2))
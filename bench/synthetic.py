@@ -0,0 +1,55 @@
+import random
+from datetime import date, timedelta
+
+# Генератор синтетического каталога фильмов в формате movies.json
+
+TITLE_WORDS = [
+    "Ночной", "Дозор", "Брат", "Солнце", "Ёлки", "Москва", "Слезам", "Не", "Верит", "Белое",
+    "Пустыни", "Иван", "Васильевич", "Меняет", "Профессию", "Бриллиантовая", "Рука", "Сталкер",
+    "Солярис", "Зеркало", "Левиафан", "Звягинцев", "Экипаж", "Легенда", "Движение", "Вверх",
+    "Холоп", "Батальон", "Сволочи", "Штрафбат", "Война", "Мир", "Любовь", "Голуби", "Служебный",
+    "Роман", "Осенний", "Марафон", "Кин-дза-дза", "Ирония", "Судьбы", "Операция", "Кавказская",
+    "Пленница", "Девчата", "Весна", "Улице", "Заречной", "Летят", "Журавли", "Баллада", "Солдате",
+    "Десантный", "Батя", "Матрица", "Начало", "Интерстеллар", "Дюна", "Город", "Грехов", "Остров",
+    "Проклятых", "Тёмный", "Рыцарь", "Последний", "Герой", "Большой", "Куш", "Побег", "Шоушенка",
+]
+DIRECTORS = [
+    "Андрей Тарковский", "Никита Михалков", "Алексей Балабанов", "Эльдар Рязанов", "Леонид Гайдай",
+    "Георгий Данелия", "Фёдор Бондарчук", "Андрей Звягинцев", "Тимур Бекмамбетов", "Олег Штром",
+    "Кристофер Нолан", "Дени Вильнёв", "Гай Ричи", "Фрэнк Дарабонт", "Сергей Бодров",
+]
+GENRES = [
+    "Драма", "Комедия", "Военный", "Фантастика", "Боевик", "Триллер", "Мелодрама", "Детектив",
+    "Ужасы", "Приключения", "Криминал", "Исторический", "Семейный", "Мультфильм",
+]
+CODE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def make_movie(index, rng):
+    words = rng.randint(1, 4)
+    added = date(2020, 1, 1) + timedelta(days=rng.randint(0, 2000))
+    return {
+        "id": str(index).zfill(3),
+        "code": "".join(rng.choices(CODE_ALPHABET, k=6)),
+        "title": " ".join(rng.choices(TITLE_WORDS, k=words)) + f" {index}",
+        "year": rng.randint(1950, 2024),
+        "director": rng.choice(DIRECTORS),
+        "genre": rng.sample(GENRES, rng.randint(1, 3)),
+        "photo_url": f"AgACAgIAAxkBAAP{index:012d}",
+        "watch_url": f"https://example.com/movies/{index}/",
+        "added_date": added.isoformat(),
+        "ratings": [],
+        "reviews": [],
+    }
+
+
+# Генератор фильмов с уникальными кодами; seed делает каталог воспроизводимым
+def synthetic_movies(count, seed=42):
+    rng = random.Random(seed)
+    codes = set()
+    for index in range(1, count + 1):
+        movie = make_movie(index, rng)
+        while movie["code"] in codes:
+            movie["code"] = "".join(rng.choices(CODE_ALPHABET, k=6))
+        codes.add(movie["code"])
+        yield movie
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+import logging
+
+from telegram.error import Forbidden
+
+from catalog import catalog
+from cards import send_card
+from media import wait_prefetch
+from ratelimit import BULK
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений рассылки отправляется одновременно
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 20))
+
+# Сколько чатов читать из очереди за раз и после скольких отправок сохранять прогресс
+BROADCAST_CHUNK = 1000
+FLUSH_SIZE = 200
+
+# Как часто (в секундах) проверять очередь рассылок, поставленных другими процессами
+POLL_INTERVAL = 5
+
+# Как часто (в секундах) обновлять сообщение о ходе рассылки у администратора
+PROGRESS_INTERVAL = int(os.getenv('BROADCAST_PROGRESS_INTERVAL', 30))
+
+BROADCAST_HEADER = "🆕 *Новинка в КиноБоте!*\n\n"
+
+# Чаты, уже записанные в подписчики этим процессом: /start не пишет в базу повторно
+known_subscribers = set()
+
+
+def remember_subscriber(chat_id):
+    if chat_id in known_subscribers:
+        return
+    catalog.store.add_subscribers([chat_id])
+    known_subscribers.add(chat_id)
+
+
+# Рассылка новинки всем подписчикам.
+# Очередь чатов лежит в SQLite (broadcast_queue): отправленные чаты удаляются из неё
+# пачками, поэтому после перезапуска рассылка продолжается с того же места.
+# Чаты, заблокировавшие бота, удаляются из подписчиков.
+class Broadcaster:
+    def __init__(self, store, concurrency=BROADCAST_CONCURRENCY, progress_interval=PROGRESS_INTERVAL):
+        self.store = store
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.bot = None
+        self.admin_bot = None
+        self.task = None
+        self.wakeup = None
+        self.current = None
+
+    # bot рассылает, admin_bot сообщает администратору о ходе рассылки
+    def start(self, bot, admin_bot=None):
+        self.bot = bot
+        self.admin_bot = admin_bot
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()  # Сразу подхватить рассылки, прерванные прошлым запуском
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    # Поставить рассылку фильма в очередь; возвращает (id рассылки, число получателей)
+    def enqueue(self, movie, admin_chat_id=None):
+        broadcast_id = self.store.create_broadcast(movie['id'], admin_chat_id)
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return broadcast_id, self.store.get_broadcast(broadcast_id)['total']
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            for broadcast_id in self.store.unfinished_broadcasts():
+                try:
+                    await self.run(broadcast_id)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Рассылка {broadcast_id} прервана: {e}")
+
+    async def run(self, broadcast_id):
+        broadcast = self.store.get_broadcast(broadcast_id)
+        movie = catalog.get(broadcast['movie_id'])
+        if movie is None:
+            logger.warning(f"Рассылка {broadcast_id}: фильм {broadcast['movie_id']} удалён, рассылка отменена")
+            self.store.update_broadcast(broadcast_id, finished_at=time.time())
+            return
+
+        # Фото новинки сначала должно получить file_id cinemabot, иначе вся рассылка уйдёт без фото
+        await wait_prefetch()
+
+        self.current = progress = {
+            "id": broadcast_id, "total": broadcast['total'], "done": 0, "started": time.monotonic()
+        }
+        results = {"sent": [], "blocked": [], "failed": []}
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        def flush():
+            if any(results.values()):
+                self.store.complete_deliveries(broadcast_id, results["sent"], results["blocked"], results["failed"])
+                for chat_ids in results.values():
+                    chat_ids.clear()
+
+        async def worker():
+            while (chat_id := await queue.get()) is not None:
+                results[await self._deliver(chat_id, movie)].append(chat_id)
+                progress["done"] += 1
+                if sum(len(chat_ids) for chat_ids in results.values()) >= FLUSH_SIZE:
+                    flush()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self._report_progress(broadcast_id))
+        try:
+            after = -2 ** 63
+            while chat_ids := self.store.broadcast_chats(broadcast_id, after, BROADCAST_CHUNK):
+                for chat_id in chat_ids:
+                    await queue.put(chat_id)
+                after = chat_ids[-1]
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+            flush()
+            self.current = None
+
+        self.store.update_broadcast(broadcast_id, finished_at=time.time())
+        await self._send_progress(broadcast_id, progress, finished=True)
+
+    async def _deliver(self, chat_id, movie):
+        try:
+            await send_card(self.bot, chat_id, movie, header=BROADCAST_HEADER, rate_limit_args=BULK)
+            return "sent"
+        except Forbidden:
+            return "blocked"
+        except Exception as e:
+            logger.warning(f"Рассылка: не удалось отправить в чат {chat_id}: {e}")
+            return "failed"
+
+    async def _report_progress(self, broadcast_id):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._send_progress(broadcast_id, self.current)
+
+    # Одно сообщение у администратора, которое редактируется по ходу рассылки
+    async def _send_progress(self, broadcast_id, progress, finished=False):
+        broadcast = self.store.get_broadcast(broadcast_id)
+        if self.admin_bot is None or not broadcast['admin_chat_id']:
+            return
+        elapsed = time.monotonic() - progress["started"]
+        rate = progress["done"] / elapsed if elapsed else 0
+        text = (
+            f"{'✅ Рассылка завершена' if finished else '📣 Идёт рассылка'} (фильм {broadcast['movie_id']})\n"
+            f"Отправлено: {broadcast['sent']} из {broadcast['total']}\n"
+            f"Заблокировали бота: {broadcast['blocked']}\n"
+            f"Ошибок: {broadcast['failed']}\n"
+            f"Скорость: {rate:.1f} сообщ./с"
+        )
+        try:
+            if broadcast['progress_message_id']:
+                await self.admin_bot.edit_message_text(
+                    text, chat_id=broadcast['admin_chat_id'], message_id=broadcast['progress_message_id']
+                )
+            else:
+                message = await self.admin_bot.send_message(broadcast['admin_chat_id'], text)
+                self.store.update_broadcast(broadcast_id, progress_message_id=message.message_id)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить ход рассылки {broadcast_id}: {e}")
+
+    def stats(self):
+        if self.current is None:
+            return {"running": None}
+        elapsed = time.monotonic() - self.current["started"]
+        return {
+            "running": self.current["id"],
+            "total": self.current["total"],
+            "done": self.current["done"],
+            "rate": round(self.current["done"] / elapsed, 1) if elapsed else 0,
+        }
+
+
+broadcaster = Broadcaster(catalog.store)
@@ -0,0 +1,245 @@
+import asyncio
+import csv
+import itertools
+import json
+import os
+import re
+import tempfile
+import logging
+from datetime import datetime
+
+from catalog import catalog
+from storage import gc_relaxed
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк файла разбирать за раз и записывать в базу одной транзакцией
+IMPORT_BATCH = int(os.getenv('IMPORT_BATCH', 5000))
+
+# По сколько записанных фильмов добавлять в каталог в памяти за один проход event loop
+IMPORT_APPLY_CHUNK = 250
+
+# Поля CSV-выгрузки (она же — формат файла для импорта)
+EXPORT_FIELDS = ("id", "code", "title", "year", "director", "genre", "photo_url", "watch_url", "added_date")
+
+# Расширение файла -> формат
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+MIN_YEAR = 1800
+CODE_PATTERN = re.compile(r"^[A-Z0-9]{6}$")
+
+
+# Проверки полей фильма — общие для пошагового добавления в админ-боте и импорта из файла.
+# При ошибке ValueError с текстом для администратора.
+def parse_year(value):
+    try:
+        year = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"год «{value}» не число")
+    if year < MIN_YEAR or year > datetime.now().year:
+        raise ValueError(f"год {year} вне диапазона {MIN_YEAR}–{datetime.now().year}")
+    return year
+
+
+# Жанры строкой через запятую (CSV, ввод в чате) или списком (JSONL)
+def parse_genres(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    genres = [str(genre).strip() for genre in value or []]
+    genres = [genre for genre in genres if genre]
+    if not genres:
+        raise ValueError("не указан жанр")
+    return genres
+
+
+def parse_url(value):
+    url = str(value or "").strip()
+    if not url.startswith(("http://", "https://")):
+        raise ValueError(f"ссылка «{url}» должна начинаться с http:// или https://")
+    return url
+
+
+def detect_format(filename):
+    return FORMATS.get(os.path.splitext(filename or "")[1].lower())
+
+
+# Строки файла по одной: (номер строки, словарь полей или None, ошибка или None).
+# Файл не читается в память целиком.
+def read_rows(path, fmt):
+    if fmt == "csv":
+        with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+            sample = file.readline()
+            file.seek(0)
+            delimiter = max(",;\t", key=sample.count)
+            reader = csv.DictReader(file, delimiter=delimiter)
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+            for row in reader:
+                yield reader.line_num, row, None
+        return
+
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        for line_num, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_num, None, f"некорректный JSON: {e.msg}"
+                continue
+            if not isinstance(row, dict):
+                yield line_num, None, "строка должна быть JSON-объектом"
+                continue
+            yield line_num, row, None
+
+
+# Фильм из строки файла; ID и код (если его нет в файле) назначаются при записи
+def row_to_movie(row, today=None):
+    title = str(row.get("title") or "").strip()
+    if not title:
+        raise ValueError("нет названия")
+    director = str(row.get("director") or "").strip()
+    if not director:
+        raise ValueError("нет режиссёра")
+    code = str(row.get("code") or "").strip().upper() or None
+    if code and not CODE_PATTERN.match(code):
+        raise ValueError(f"код «{code}» должен состоять из 6 латинских букв и цифр")
+    ratings = row.get("ratings")
+    reviews = row.get("reviews")
+    return {
+        "id": None,
+        "code": code,
+        "title": title,
+        "year": parse_year(row.get("year")),
+        "director": director,
+        "genre": parse_genres(row.get("genre")),
+        "photo_url": str(row.get("photo_url") or "").strip(),
+        "watch_url": parse_url(row.get("watch_url")),
+        "added_date": str(row.get("added_date") or "").strip() or today or datetime.now().strftime('%Y-%m-%d'),
+        "ratings": ratings if isinstance(ratings, list) else [],
+        "reviews": reviews if isinstance(reviews, list) else [],
+    }
+
+
+# Импорт фильмов из CSV/JSONL.
+# Разбор и проверка строк идут пачками в отдельном потоке, запись каждой пачки —
+# одной транзакцией тоже в потоке. Каталог в памяти меняется только в event loop
+# (его читают обработчики): записанные фильмы добавляются в него небольшими частями.
+# Пока пачка записывается, её фото проверяются и загружаются для ботов (как у фильма,
+# добавленного в чате), чтобы первые карточки новых фильмов не ждали и не слали битые фото.
+# Ошибочные строки пропускаются и попадают в errors: [(номер строки, причина), ...].
+class MovieImporter:
+    def __init__(self, catalog=catalog, batch_size=IMPORT_BATCH, source_bot=None):
+        self.catalog = catalog
+        self.batch_size = batch_size
+        self.source_bot = source_bot
+        self.imported = 0
+        self.errors = []
+
+    def _read_batch(self, rows):
+        movies = []
+        read = 0
+        today = datetime.now().strftime('%Y-%m-%d')
+        for line_num, row, error in itertools.islice(rows, self.batch_size):
+            read += 1
+            if error is None:
+                try:
+                    movies.append((line_num, row_to_movie(row, today)))
+                    continue
+                except ValueError as e:
+                    error = str(e)
+            self.errors.append((line_num, error))
+        return movies, read < self.batch_size
+
+    # В потоке: проверка кодов и выдача ID и кодов только читают каталог, пишется одна база.
+    # (записанные фильмы, номер записи) или None, если записывать нечего или запись не удалась.
+    def _commit(self, movies):
+        batch_codes = set()
+        accepted = []
+        for line_num, movie in movies:
+            code = movie["code"]
+            if code and (code in batch_codes or self.catalog.get_by_code(code) is not None):
+                self.errors.append((line_num, f"код {code} уже занят"))
+                continue
+            if code:
+                batch_codes.add(code)
+            accepted.append((line_num, movie))
+        if not accepted:
+            return None
+
+        ids = self.catalog.next_ids(len(accepted))
+        codes = iter(self.catalog.new_codes(sum(1 for _, movie in accepted if not movie["code"]), batch_codes))
+        for movie_id, (_, movie) in zip(ids, accepted):
+            movie["id"] = movie_id
+            movie["code"] = movie["code"] or next(codes)
+        written = [movie for _, movie in accepted]
+        try:
+            revision = self.catalog.write_movies(written)
+        except Exception as e:
+            logger.error(f"Импорт: пачка строк {accepted[0][0]}–{accepted[-1][0]} не записана: {e}")
+            self.errors.extend((line_num, f"не записано в базу: {e}") for line_num, _ in accepted)
+            return None
+        self.imported += len(accepted)
+        return written, revision
+
+    # Записанная пачка — в каталог в памяти, по IMPORT_APPLY_CHUNK фильмов между обновлениями
+    async def _apply(self, written, revision):
+        for i in range(0, len(written), IMPORT_APPLY_CHUNK):
+            self.catalog.add_written(written[i:i + IMPORT_APPLY_CHUNK], revision)
+            await asyncio.sleep(0)
+
+    # Фото пачки, ещё не известные кэшу; без бота-источника (импорт вне админ-бота) не готовятся
+    async def _prefetch(self, movies):
+        if self.source_bot is None:
+            return
+        from media import prefetch_photos, unknown_photos
+
+        try:
+            sources = await asyncio.to_thread(unknown_photos, [movie["photo_url"] for _, movie in movies])
+            await prefetch_photos(sources, self.source_bot)
+        except Exception as e:
+            logger.warning(f"Импорт: фото пачки не подготовлены: {e}")
+
+    async def run(self, path, fmt):
+        rows = read_rows(path, fmt)
+        # Импорт создаёт десятки тысяч долгоживущих фильмов: полные сборки мусора откладываются
+        # до его конца, как при загрузке каталога, иначе каждая обходит всё уже добавленное
+        try:
+            with gc_relaxed():
+                done = False
+                while not done:
+                    try:
+                        movies, done = await asyncio.to_thread(self._read_batch, rows)
+                    except (UnicodeDecodeError, csv.Error) as e:
+                        self.errors.append((None, f"файл не прочитан: {e}"))
+                        break
+                    committed, _ = await asyncio.gather(
+                        asyncio.to_thread(self._commit, movies), self._prefetch(movies)
+                    )
+                    if committed is not None:
+                        await self._apply(*committed)
+        finally:
+            rows.close()
+        logger.info(f"Импорт из {fmt}: добавлено {self.imported}, ошибок {len(self.errors)}")
+        return self
+
+
+def _csv_row(movie):
+    return [
+        ", ".join(movie.get(field) or []) if field == "genre" else movie.get(field, "")
+        for field in EXPORT_FIELDS
+    ]
+
+
+# Выгрузка каталога в CSV или JSONL во временный файл: фильмы пишутся по одному,
+# весь файл в памяти не собирается. Возвращает путь к файлу.
+def export_movies(fmt):
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix=f'.{fmt}', delete=False) as file:
+        if fmt == "csv":
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_FIELDS)
+            for movie in catalog.movies():
+                writer.writerow(_csv_row(movie))
+        else:
+            for movie in catalog.movies():
+                file.write(json.dumps(dict(movie), ensure_ascii=False) + "\n")
+        return file.name
@@ -0,0 +1,109 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+from telegram.error import Forbidden
+
+from catalog import catalog
+from media import media_cache
+
+logger = logging.getLogger(__name__)
+
+# Сколько готовых карточек держать в памяти
+CARD_CACHE_SIZE = int(os.getenv('CARD_CACHE_SIZE', 1024))
+
+PARSE_MODE = "Markdown"
+
+
+# Текст карточки фильма в Markdown
+def render_caption(movie):
+    return (
+        f"🎥 *Название*: {movie['title']}\n"
+        f"🗓️ *Год*: {movie['year']}\n"
+        f"👨‍🎤 *Режиссер*: {movie['director']}\n"
+        f"🎭 *Жанр*: {', '.join(movie['genre'])}\n"
+        f"🔗 [Смотреть фильм]({movie.get('watch_url', '')})\n"
+    )
+
+
+# Готовые карточки фильмов (LRU): подпись, режим разметки, ссылка на фото.
+# Ключ — id фильма, рядом с карточкой хранится поколение каталога: когда каталог
+# перечитывается после записи другого процесса, поколение меняется и карточка строится заново.
+# Свои правки админ-бот сбрасывает явно через invalidate().
+class CardCache:
+    def __init__(self, size=CARD_CACHE_SIZE):
+        self.size = size
+        self.cards = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, movie):
+        key = movie['id']
+        generation = catalog.generation
+        with self._lock:
+            entry = self.cards.get(key)
+            if entry is not None and entry[0] == generation:
+                self.cards.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        caption = render_caption(movie)
+        card = {
+            "caption": caption,
+            "fallback": f"⚠️ Для этого фильма недоступно изображение.\n{caption}",
+            "parse_mode": PARSE_MODE,
+            "photo": movie.get("photo_url") or None,
+        }
+        with self._lock:
+            self.cards[key] = (generation, card)
+            self.cards.move_to_end(key)
+            if len(self.cards) > self.size:
+                self.cards.popitem(last=False)
+        return card
+
+    def invalidate(self, movie_id):
+        with self._lock:
+            self.cards.pop(movie_id, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cards)}
+
+
+card_cache = CardCache()
+
+
+# Отправка карточки в чат: фото по file_id этого бота, если он уже известен;
+# фото, которое недавно не удалось отправить, сразу заменяем текстом.
+# footer — строка под карточкой, которая меняется чаще самой карточки (рейтинг).
+# Forbidden (бот заблокирован) пробрасывается вызывающему.
+async def send_card(bot, chat_id, movie, reply_markup=None, header="", footer="", rate_limit_args=None):
+    card = card_cache.get(movie)
+    photo = media_cache.resolve(bot, card["photo"]) if card["photo"] else None
+    if photo:
+        try:
+            sent = await bot.send_photo(
+                chat_id=chat_id,
+                photo=photo,
+                caption=header + card["caption"] + footer,
+                parse_mode=card["parse_mode"],
+                reply_markup=reply_markup,
+                rate_limit_args=rate_limit_args
+            )
+            media_cache.remember_success(bot, card["photo"], sent.photo[-1].file_id)
+            return sent
+        except Forbidden:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка при отправке фото: {e}")
+            media_cache.remember_failure(bot, card["photo"], e)
+
+    return await bot.send_message(
+        chat_id=chat_id,
+        text=header + (card["fallback"] if card["photo"] else card["caption"]) + footer,
+        parse_mode=card["parse_mode"],
+        reply_markup=reply_markup,
+        rate_limit_args=rate_limit_args
+    )
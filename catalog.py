@@ -0,0 +1,457 @@
+import asyncio
+import os
+import random
+import string
+import threading
+import time
+import logging
+
+import metrics
+from records import MovieRecord
+from storage import MovieStore, DB_FILE, JSON_FILE, gc_relaxed
+from search import SearchIndex
+from facets import FacetIndex
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в секундах) проверять, не изменил ли базу другой процесс
+CHECK_INTERVAL = 1.0
+
+# Сколько чужих изменений фильмов применять по одному; если их больше (или журнал изменений
+# их уже не помнит), каталог перечитывается целиком в фоновом потоке
+CHANGES_LIMIT = int(os.getenv('CATALOG_CHANGES_LIMIT', 1000))
+
+# Коды фильмов: 6 символов из заглавных латинских букв и цифр
+CODE_LENGTH = 6
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+
+# Производные индексы: строятся в фоновом потоке после загрузки каталога (build_indexes),
+# обработчики ждут их через wait_indexes(); дальше обновляются по одному фильму
+# при добавлении/удалении
+DERIVED_INDEXES = {
+    "search": SearchIndex,
+    "facets": FacetIndex,
+}
+
+LOAD_SECONDS = metrics.Histogram(
+    "kinobot_catalog_load_seconds", "Загрузка раздела каталога из базы", ("section",)
+)
+WRITE_SECONDS = metrics.Histogram(
+    "kinobot_catalog_write_seconds", "Запись изменения каталога в базу", ("operation",)
+)
+WRITE_ROWS = metrics.Counter(
+    "kinobot_catalog_written_movies_total", "Фильмы, записанные в базу", ("operation",)
+)
+
+
+# Каталог фильмов в памяти поверх SQLite-хранилища.
+# База читается один раз, дальше поиск идёт по словарям id -> фильм и code -> фильм,
+# администраторы хранятся во frozenset. Фильмы — компактные записи records.MovieRecord.
+# Удалённый фильм в movie_list заменяется на None (позиция берётся из positions),
+# список без «дыр» пересобирается лениво — при следующем чтении страницы или построении индекса.
+# Если базу изменил другой процесс (PRAGMA data_version), перечитываем только
+# изменившийся раздел — по счётчикам movies_rev / admins_rev. Фильмы дочитываются по журналу
+# изменений (только изменённые строки); полная перезагрузка готовится в фоновом потоке,
+# а обработчики до её конца читают прежний каталог.
+# Каталог в памяти меняется только в главном потоке, где работает event loop (кроме первой
+# загрузки): обработчики читают словари и индексы без блокировки. Фоновые потоки лишь готовят
+# новые структуры, а подменяет их следующее обращение к каталогу из главного потока.
+class Catalog:
+    def __init__(self, path=DB_FILE, json_file=JSON_FILE):
+        self.store = MovieStore(path)
+        self.json_file = json_file
+        self._lock = threading.RLock()
+        self._version = None
+        self._revisions = {}
+        self._checked_at = 0.0
+        self._loaded = False
+        self.movie_list = []
+        self.admin_set = None
+        self.by_id = {}
+        self.by_code = {}
+        self.positions = {}
+        self.removed = 0
+        self.derived = {}
+        self.generation = 0
+        self._reloading = False
+        # Готовый в фоне каталог: (номер изменения, записи, словари, производные индексы)
+        self._prepared = None
+        # Пока индексы строятся в фоне: изменения фильмов за это время (id, фильм или None),
+        # готовые индексы (изменения, {имя: индекс}) и ждущие их обработчики (loop, future)
+        self._index_changes = None
+        self._building = False
+        self._built = None
+        self._index_waiters = []
+
+    # Новый список фильмов целиком (с уже построенными для него производными индексами).
+    # Словари строятся заранее и подменяются подряд, чтобы читатели не застали их наполовину.
+    def _install(self, movie_list, derived=None, maps=None):
+        by_id, by_code, positions = maps or _maps(movie_list)
+        self.movie_list, self.by_id, self.by_code, self.positions = movie_list, by_id, by_code, positions
+        self.removed = 0
+        self.derived = derived or {}
+        self.generation += 1
+        # Индексы, которые строились по прежнему списку, ему уже не соответствуют
+        self._index_changes = None
+
+    # Фильмы в конец списка, в словари и в производные индексы
+    def _insert(self, records):
+        for movie in records:
+            self.positions[movie.id] = len(self.movie_list)
+            self.movie_list.append(movie)
+            self.by_id[movie.id] = movie
+            if movie.code:
+                self.by_code[movie.code] = movie
+        for index in self.derived.values():
+            for movie in records:
+                index.add(movie)
+        if self._index_changes is not None:
+            self._index_changes.extend((movie.id, movie) for movie in records)
+
+    def _remove(self, movie_id):
+        movie = self.by_id.pop(movie_id)
+        self.movie_list[self.positions.pop(movie_id)] = None
+        self.removed += 1
+        # Больше половины списка — «дыры»: пересобираем сразу (амортизированно O(1) на удаление)
+        if self.removed > len(self.movie_list) // 2:
+            self._compact()
+        if movie.code:
+            self.by_code.pop(movie.code, None)
+        for index in self.derived.values():
+            index.remove(movie_id)
+        if self._index_changes is not None:
+            self._index_changes.append((movie_id, None))
+        return movie
+
+    # Чужие изменения: {id: фильм или None, если удалён}
+    def _apply_changes(self, changes):
+        for movie_id, movie in changes.items():
+            if movie_id in self.by_id:
+                self._remove(movie_id)
+            if movie is not None:
+                self._insert([MovieRecord.from_movie(movie)])
+        self.generation += 1
+
+    # Убрать из movie_list места удалённых фильмов
+    def _compact(self):
+        with self._lock:
+            if not self.removed:
+                return
+            self.movie_list = [movie for movie in self.movie_list if movie is not None]
+            self.positions = {movie.id: i for i, movie in enumerate(self.movie_list)}
+            self.removed = 0
+
+    # Индекс name. Обработчики сначала ждут wait_indexes(); без этого (бенчмарки, консоль)
+    # недостающий индекс строится прямо здесь.
+    def index(self, name):
+        self.refresh()
+        index = self.derived.get(name)
+        if index is None:
+            self._compact()
+            index = self.derived[name] = DERIVED_INDEXES[name](self.movie_list)
+        return index
+
+    # Дождаться производных индексов, не останавливая event loop: если их нет и никто
+    # их не строит — постройка запускается в потоке
+    async def wait_indexes(self):
+        while True:
+            self.refresh()
+            if all(name in self.derived for name in DERIVED_INDEXES):
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                waiting = self._building and self._built is None
+                if waiting:
+                    self._index_waiters.append((loop, future))
+            if waiting:
+                await future
+            elif self._built is None:
+                await asyncio.to_thread(self.build_indexes)
+
+    # Построить недостающие производные индексы по копии списка фильмов (вызывается из потока).
+    # Живой каталог поток не трогает: изменения фильмов за время постройки копятся
+    # в _index_changes, а готовые индексы дополняет ими и подключает главный поток (_take_built).
+    def build_indexes(self):
+        with self._lock:
+            missing = [name for name in DERIVED_INDEXES if name not in self.derived]
+            if not missing or self._building or self._built is not None:
+                return
+            self._building = True
+            changes = self._index_changes = []
+            movie_list = [movie for movie in self.movie_list if movie is not None]
+        try:
+            with LOAD_SECONDS.time("indexes"), gc_relaxed():
+                built = {name: DERIVED_INDEXES[name](movie_list) for name in missing}
+            self._built = (changes, built)
+            logger.info(f"Индексы каталога построены: {', '.join(missing)}")
+        finally:
+            with self._lock:
+                self._building = False
+                waiters, self._index_waiters = self._index_waiters, []
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(_wake, future)
+
+    # Подключить индексы, построенные build_indexes, применив к ним изменения за время постройки
+    def _take_built(self):
+        changes, built = self._built
+        self._built = None
+        # Каталог с тех пор перезагружен: индексы построены по прежнему списку
+        if changes is not self._index_changes:
+            return
+        self._index_changes = None
+        for index in built.values():
+            for movie_id, movie in changes:
+                if movie is None:
+                    index.remove(movie_id)
+                else:
+                    index.add(movie)
+        for name, index in built.items():
+            self.derived.setdefault(name, index)
+
+    # Перечитать базу, если её изменили (проверка не чаще раза в CHECK_INTERVAL).
+    # Плановая проверка не ждёт блокировку: её держит запись, и тогда каталог проверится
+    # при следующем обращении. Из других потоков (выгрузка файла) каталог после первой
+    # загрузки не обновляется — они читают его как есть.
+    def refresh(self, force=False):
+        if self._loaded and threading.current_thread() is not threading.main_thread():
+            return
+        if self._prepared is not None:
+            self._swap_prepared()
+        if self._built is not None:
+            self._take_built()
+        now = time.monotonic()
+        if not force and self._loaded and now - self._checked_at < CHECK_INTERVAL:
+            return
+        if not self._lock.acquire(blocking=force or not self._loaded):
+            return
+        try:
+            self._refresh(now)
+        finally:
+            self._lock.release()
+
+    def _refresh(self, now):
+        self._checked_at = now
+        if not self._loaded:
+            self.store.import_json_once(self.json_file)
+        version = self.store.data_version()
+        if self._loaded and version == self._version:
+            return
+        revisions = self.store.revisions()
+        if not self._loaded:
+            with LOAD_SECONDS.time("movies"), gc_relaxed():
+                revision, movie_list = self._load_movies(revisions.get('movies_rev', 0))
+                self._install(movie_list)
+            revisions['movies_rev'] = revision
+            logger.info(f"Каталог загружен: {len(self.by_id)} фильмов")
+        elif revisions.get('movies_rev', 0) != self._revisions.get('movies_rev', 0):
+            revisions['movies_rev'] = self._catch_up()
+        if not self._loaded or revisions.get('admins_rev', 0) != self._revisions.get('admins_rev', 0):
+            with LOAD_SECONDS.time("admins"):
+                self._set_admins(self.store.get_admins())
+        self._revisions = revisions
+        self._version = version
+        self._loaded = True
+
+    # Дочитать чужие изменения фильмов по журналу; номер, до которого каталог актуален.
+    # Если журнал их не покрывает — фоновая перезагрузка, а пока остаётся прежний номер.
+    def _catch_up(self):
+        current = self._revisions.get('movies_rev', 0)
+        if self._reloading:
+            return current
+        with LOAD_SECONDS.time("changes"):
+            revision, changes = self.store.movie_changes_since(current, CHANGES_LIMIT)
+            if changes is None:
+                self._start_reload()
+                return current
+            self._apply_changes(changes)
+        return revision
+
+    def _start_reload(self):
+        self._reloading = True
+        threading.Thread(target=self._reload, name="catalog-reload", daemon=True).start()
+
+    # Полная перезагрузка в фоновом потоке: записи, словари и уже построенные производные
+    # индексы готовятся, пока обработчики читают прежний каталог. Живой каталог поток не трогает.
+    def _reload(self):
+        try:
+            with LOAD_SECONDS.time("movies"), gc_relaxed():
+                revision, movie_list = self._load_movies(None, save_snapshot=False)
+                building = self._building or self._built is not None
+                names = list(DERIVED_INDEXES) if building else list(self.derived)
+                derived = {name: DERIVED_INDEXES[name](movie_list) for name in names}
+                self._prepared = (revision, movie_list, _maps(movie_list), derived)
+            logger.info(f"Каталог перечитан: {len(movie_list)} фильмов")
+        except Exception as e:
+            logger.error(f"Не удалось перезагрузить каталог: {e}")
+            self._version = None
+            self._reloading = False
+
+    # Подмена каталога, подготовленного _reload (в главном потоке). Изменения, сделанные за время
+    # загрузки (в том числе свои), дочитываются из журнала при следующей проверке.
+    def _swap_prepared(self):
+        with self._lock:
+            revision, movie_list, maps, derived = self._prepared
+            self._prepared = None
+            self._install(movie_list, derived, maps)
+            self._revisions['movies_rev'] = revision
+            self._version = None
+            self._checked_at = 0.0
+            self._reloading = False
+
+    # (номер изменения, записи каталога). Каталог берётся из двоичного снимка, если он актуален
+    # (ссылки фильмов — из того же файла через mmap); иначе читается из базы, снимок пишется
+    # заново (save_snapshot) и записи строятся уже по нему
+    def _load_movies(self, revision, save_snapshot=True):
+        records = self.store.load_binary_snapshot(revision) if revision is not None else None
+        if records is not None:
+            logger.info("Каталог прочитан из двоичного снимка")
+            return revision, records
+        revision, movies = self.store.movies_at_revision()
+        if save_snapshot:
+            try:
+                self.store.save_binary_snapshot(revision, movies)
+                records = self.store.load_binary_snapshot(revision)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить двоичный снимок каталога: {e}")
+        else:
+            # Снимок этой версии мог уже записать компактор
+            records = self.store.load_binary_snapshot(revision)
+        # Без снимка (или его уже заменил другой процесс) ссылки остаются в записях
+        if records is None:
+            shared = {}
+            records = [MovieRecord.from_movie(movie, shared) for movie in movies]
+        return revision, records
+
+    def _set_admins(self, admins):
+        self.admin_set = frozenset(admins) if admins is not None else None
+
+    # Своя запись уже отражена в памяти: запоминаем её номер, чтобы не перечитывать раздел.
+    # Если между нашими записями вклинился другой процесс, номер не совпадёт и раздел перечитается.
+    def _note_own_write(self, key, revision):
+        if self._revisions.get(key, 0) + 1 == revision:
+            self._revisions[key] = revision
+
+    # Снимок списка фильмов: его можно обходить в другом потоке, пока каталог меняется
+    def movies(self):
+        self.refresh()
+        return [movie for movie in self.movie_list if movie is not None]
+
+    # Срез каталога для постраничного просмотра
+    def page(self, offset, limit):
+        self.refresh()
+        self._compact()
+        return self.movie_list[offset:offset + limit]
+
+    def get(self, movie_id):
+        self.refresh()
+        return self.by_id.get(movie_id)
+
+    def get_by_code(self, code):
+        self.refresh()
+        return self.by_code.get(code)
+
+    # Поиск по ID или по 6-символьному коду фильма
+    def find(self, query):
+        self.refresh()
+        query = query.strip()
+        return self.by_id.get(query) or self.by_code.get(query.upper())
+
+    # Полнотекстовый поиск по названию, режиссёру и жанрам (с опечатками)
+    def search(self, query, limit=10):
+        found = self.index("search").search(query, limit)
+        return [self.by_id[movie_id] for movie_id, _ in found if movie_id in self.by_id]
+
+    # Просмотр по жанру и/или десятилетию: (фильмы страницы, всего найдено)
+    def browse(self, genre=None, decade=None, offset=0, limit=10):
+        ids, total = self.index("facets").browse(genre, decade, offset, limit)
+        return [self.by_id[movie_id] for movie_id in ids if movie_id in self.by_id], total
+
+    # frozenset ID администраторов или None, если список ещё не заведён
+    def admins(self):
+        self.refresh()
+        return self.admin_set
+
+    def __len__(self):
+        self.refresh()
+        return len(self.by_id)
+
+    # Запись идёт одной строкой в базу, индексы в памяти обновляем на месте
+    def add_movie(self, movie):
+        self.add_movies([movie])
+
+    # Пачка фильмов (импорт из файла): одна транзакция, индексы дополняются по одному фильму.
+    # В каталог попадают записи MovieRecord, построенные по словарям movies.
+    def add_movies(self, movies):
+        with self._lock:
+            self.refresh(force=True)
+            self.add_written(movies, self.write_movies(movies))
+
+    # Запись пачки фильмов в базу без изменения каталога в памяти (можно вызывать из потока);
+    # возвращает номер записи для add_written
+    def write_movies(self, movies):
+        with WRITE_SECONDS.time("add"):
+            revision = self.store.add_movies(movies)
+        WRITE_ROWS.inc("add", amount=len(movies))
+        return revision
+
+    # Фильмы, записанные write_movies, — в каталог (в главном потоке, можно частями).
+    # Уже подхваченные по журналу изменений второй раз не добавляются.
+    def add_written(self, movies, revision):
+        self._note_own_write('movies_rev', revision)
+        self._insert([MovieRecord.from_movie(movie) for movie in movies if movie['id'] not in self.by_id])
+
+    # count новых ID из последовательности в базе (общей для всех процессов)
+    def next_ids(self, count=1):
+        return self.store.allocate_ids(count)
+
+    # Новые уникальные 6-символьные коды: не заняты ни в каталоге, ни в reserved
+    def new_codes(self, count=1, reserved=()):
+        self.refresh()
+        codes = []
+        taken = set(reserved)
+        while len(codes) < count:
+            code = ''.join(random.choices(CODE_ALPHABET, k=CODE_LENGTH))
+            if code not in taken and code not in self.by_code:
+                taken.add(code)
+                codes.append(code)
+        return codes
+
+    # Удаление без прохода по каталогу: словари — O(1), индексы поиска и жанров — по ключам фильма
+    def delete_movie(self, movie_id):
+        with self._lock:
+            self.refresh(force=True)
+            movie = self.by_id.get(movie_id)
+            if not movie:
+                return None
+            with WRITE_SECONDS.time("delete"):
+                revision = self.store.delete_movie(movie_id)
+            if revision is None:
+                return None
+            WRITE_ROWS.inc("delete")
+            self._note_own_write('movies_rev', revision)
+            return self._remove(movie_id)
+
+    def add_admin(self, user_id):
+        with self._lock:
+            self.refresh(force=True)
+            revision = self.store.add_admin(user_id)
+            self._note_own_write('admins_rev', revision)
+            self._set_admins((self.admin_set or frozenset()) | {user_id})
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Словари id -> фильм, code -> фильм и id -> позиция для списка фильмов
+def _maps(movie_list):
+    by_id = {movie.id: movie for movie in movie_list}
+    by_code = {movie.code: movie for movie in movie_list if movie.code}
+    positions = {movie.id: i for i, movie in enumerate(movie_list)}
+    return by_id, by_code, positions
+
+
+# Общий каталог для обоих ботов
+catalog = Catalog()
@@ -1,28 +1,51 @@
-import json
 from dotenv import load_dotenv
 import os
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     ConversationHandler,
     MessageHandler,
     filters,
     CallbackContext,
 )
+from catalog import catalog
+from persistence import SQLitePersistence, SharedConversationHandler
+from ratelimit import SendScheduler
+from broadcast import remember_subscriber
+from cards import send_card, card_cache
+from coalesce import Coalescer
+from media import register_bot
+from metrics import instrument
+from ratings import ratings, SCORES, REVIEW_MAX_LENGTH
+from storage import RATING_SCALE
 
 # Загрузка переменных окружения
 load_dotenv()
 BOT_TOKEN = os.getenv('MAIN_BOT_TOKEN')
+# Адрес Bot API (для локального сервера или тестов) и размер пула HTTP-соединений
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+CONNECTION_POOL_SIZE = int(os.getenv('CONNECTION_POOL_SIZE', 64))
 
 if not BOT_TOKEN:
     raise ValueError("Отсутствует переменная окружения MAIN_BOT_TOKEN")
 
 # Константы для состояний диалога
-FIND_ID = range(1)
+FIND_ID, SEARCH_TITLE, REVIEW_TEXT = range(3)
 
-# Путь к JSON файлу
-JSON_FILE = 'movies.json'
+# Сколько результатов показывать при поиске по названию
+SEARCH_RESULTS = 10
+
+# Просмотр по жанрам и годам: фильмов на странице и жанров в меню
+BROWSE_PAGE_SIZE = 10
+MENU_GENRES = 30
+
+# Фильмов в списках «Лучшие» и «Популярное», отзывов под карточкой и символов отзыва в списке
+TOP_SHOWN = 10
+REVIEWS_SHOWN = 5
+REVIEW_SHOWN_LENGTH = 500
 
 # Логирование
 import logging
@@ -32,59 +55,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Проверка наличия lock-файла
-LOCK_FILE = 'cinemabot.lock'
-
-if os.path.exists(LOCK_FILE):
-    print("Основной бот уже запущен. Удалите файл cinemabot.lock, если уверены, что другой экземпляр не работает.")
-    exit()
-
-with open(LOCK_FILE, 'w') as f:
-    f.write(str(os.getpid()))
-
-def cleanup_lock_file():
-    if os.path.exists(LOCK_FILE):
-        os.remove(LOCK_FILE)
-
-import atexit
-atexit.register(cleanup_lock_file)  # Удаляем lock-файл при завершении работы бота
-
-
-# Загрузка данных из JSON файла
-def load_data():
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            if "movies" not in data:
-                data["movies"] = []
-            return data
-    except FileNotFoundError:
-        logger.info("Файл movies.json не найден. Создание нового...")
-        return {"movies": []}
-    except json.JSONDecodeError:
-        logger.error("Ошибка чтения JSON-файла. Файл повреждён или пуст.")
-        return {"movies": []}
-
-# Получение фильма по ID
-def get_movie_by_id(movies, movie_id):
-    return next((movie for movie in movies if movie['id'] == movie_id), None)
-
-# Генерация главного меню с обычными кнопками
-def generate_main_menu():
-    keyboard = [
-        ["🎬 Найти фильм"],
-        ["<< Назад"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
-
-# Приветствие
+# Клавиатуры не меняются, поэтому создаются один раз при загрузке модуля
+MAIN_MENU = ReplyKeyboardMarkup([
+    ["🎬 Найти фильм"],
+    ["🔎 Поиск по названию"],
+    ["🎭 По жанрам", "📅 По годам"],
+    ["🏆 Лучшие", "🔥 Популярное"],
+    ["<< Назад"]
+], resize_keyboard=True, one_time_keyboard=True)
+BACK_KEYBOARD = ReplyKeyboardMarkup([["<< Назад"]], resize_keyboard=True)
+
+# Приветствие; чат запоминается как подписчик новинок
 async def start(update: Update, context: CallbackContext):
+    remember_subscriber(update.effective_chat.id)
     await update.message.reply_text(
         "👋 Добро пожаловать в *КиноБот*! 🎥\n"
-        "Здесь вы можете находить фильмы по их ID.\n\n"
+        "Здесь вы можете находить фильмы по их ID или коду, а также по названию.\n\n"
         "Что вы хотите сделать?",
         parse_mode="Markdown",
-        reply_markup=generate_main_menu()
+        reply_markup=MAIN_MENU
     )
 
 # Обработка текстовых команд
@@ -93,110 +82,389 @@ async def handle_command(update: Update, context: CallbackContext):
 
     if command == "🎬 Найти фильм":
         await find_movie_start(update, context)
+    elif command == "🔎 Поиск по названию":
+        await search_movie_start(update, context)
+    elif command == "🎭 По жанрам":
+        await browse_genres(update, context)
+    elif command == "📅 По годам":
+        await browse_decades(update, context)
+    elif command == "🏆 Лучшие":
+        await show_top_rated(update, context)
+    elif command == "🔥 Популярное":
+        await show_trending(update, context)
     elif command == "<< Назад":
         await show_main_menu(update, context)
     else:
         logger.warning(f"Неизвестная команда: {command}")
-        await update.message.reply_text("❌ Неизвестная команда.", reply_markup=generate_main_menu())
+        await update.message.reply_text("❌ Неизвестная команда.", reply_markup=MAIN_MENU)
 
 # Возврат в главное меню
 async def show_main_menu(update: Update, context: CallbackContext):
     await update.message.reply_text(
         "🤖 Главное меню:\nЧто вы хотите сделать дальше?",
-        reply_markup=generate_main_menu()
+        reply_markup=MAIN_MENU
     )
 
 # Поиск фильма
 async def find_movie_start(update: Update, context: CallbackContext):
-    await update.message.reply_text("🔍 Введите ID фильма для поиска:", reply_markup=ReplyKeyboardMarkup([["<< Назад"]], resize_keyboard=True))
+    await update.message.reply_text("🔍 Введите ID или код фильма для поиска:", reply_markup=BACK_KEYBOARD)
     return FIND_ID
 
 async def find_movie(update: Update, context: CallbackContext):
-    movie_id = update.message.text.strip()
-    if movie_id.lower() == "<< назад":
+    query = update.message.text.strip()
+    if query.lower() == "<< назад":
         await show_main_menu(update, context)
         return ConversationHandler.END
 
-    data = load_data()
-    movies = data.setdefault("movies", [])  # Защита от KeyError
-    movie = get_movie_by_id(movies, movie_id)
+    movie = catalog.find(query)
 
     if not movie:
         await update.message.reply_text(
-            f"❌ Фильм с ID {movie_id} не найден.",
-            reply_markup=generate_main_menu()
+            f"❌ Фильм с ID или кодом {query} не найден.",
+            reply_markup=MAIN_MENU
         )
         return ConversationHandler.END
 
-    response = (
-        f"🎥 *Название*: {movie['title']}\n"
-        f"🗓️ *Год*: {movie['year']}\n"
-        f"👨‍🎤 *Режиссер*: {movie['director']}\n"
-        f"🎭 *Жанр*: {', '.join(movie['genre'])}\n"
-        f"🔗 [Смотреть фильм]({movie.get('watch_url', '')})\n"
-    )
+    await send_movie_card(update.message, movie)
+    return ConversationHandler.END
 
-    if movie.get("photo_url"):
-        try:
-            await update.message.reply_photo(
-                photo=movie["photo_url"],
-                caption=response,
-                parse_mode="Markdown",
-                reply_markup=generate_main_menu()
+# Отправленные карточки по (чат, id фильма): повторный запрос того же фильма в тот же чат
+# (ID отправлен ещё раз, фильм нажат в результатах дважды) не шлёт карточку заново —
+# она только что пришла и видна в чате
+card_requests = Coalescer("cards")
+
+# Карточка фильма: фото с описанием или просто текст, под ней рейтинг и кнопки оценки
+async def send_movie_card(message, movie):
+    await card_requests.run((message.chat_id, movie['id']), lambda: send_card(
+        message.get_bot(), message.chat_id, movie,
+        reply_markup=rating_keyboard(movie['id']), footer=f"\n{ratings.summary_text(movie['id'])}"
+    ))
+
+# Кнопки под карточкой фильма
+def rating_keyboard(movie_id):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("⭐ Оценить", callback_data=f"rate:{movie_id}")],
+        [
+            InlineKeyboardButton("✍️ Написать отзыв", callback_data=f"review:{movie_id}"),
+            InlineKeyboardButton("💬 Отзывы", callback_data=f"reviews:{movie_id}"),
+        ],
+    ])
+
+# Оценки от 1 до 10 на месте кнопок карточки
+def score_keyboard(movie_id):
+    buttons = [InlineKeyboardButton(str(score), callback_data=f"vote:{movie_id}:{score}") for score in SCORES]
+    half = len(buttons) // 2
+    return InlineKeyboardMarkup([
+        buttons[:half],
+        buttons[half:],
+        [InlineKeyboardButton("✖️ Отмена", callback_data=f"card:{movie_id}")],
+    ])
+
+# Обновить рейтинг под уже отправленной карточкой и вернуть её кнопки
+async def refresh_movie_card(message, movie):
+    card = card_cache.get(movie)
+    footer = f"\n{ratings.summary_text(movie['id'])}"
+    try:
+        if message.photo:
+            await message.edit_caption(
+                card["caption"] + footer, parse_mode=card["parse_mode"], reply_markup=rating_keyboard(movie['id'])
             )
-        except Exception as e:
-            logger.warning(f"Ошибка при отправке фото: {e}")
-            await update.message.reply_text(
-                f"⚠️ Для этого фильма недоступно изображение.\n{response}",
-                parse_mode="Markdown",
-                reply_markup=generate_main_menu()
+        else:
+            await message.edit_text(
+                (card["fallback"] if card["photo"] else card["caption"]) + footer,
+                parse_mode=card["parse_mode"], reply_markup=rating_keyboard(movie['id'])
             )
-    else:
+    except BadRequest as e:
+        # Рейтинг не изменился (та же оценка ещё раз) — Telegram отвечает «message is not modified»
+        logger.debug(f"Карточка не обновлена: {e}")
+
+# Кнопки карточки: rate:<id> — показать оценки, card:<id> — вернуть кнопки карточки
+async def rate_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    kind, movie_id = query.data.split(':', 1)
+    markup = score_keyboard(movie_id) if kind == "rate" else rating_keyboard(movie_id)
+    await query.edit_message_reply_markup(reply_markup=markup)
+
+# Оценка фильма: vote:<id>:<оценка>. У зрителя один голос за фильм, повторный заменяет прежний.
+async def vote_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    movie_id, score = query.data[len("vote:"):].rsplit(':', 1)
+    movie = catalog.get(movie_id)
+    if not movie:
+        await query.answer("❌ Фильм больше не доступен.")
+        return
+    try:
+        saved = ratings.vote(movie_id, query.from_user.id, int(score))
+    except ValueError as e:
+        logger.error(f"Ошибка при сохранении оценки: {e}")
+        await query.answer("❌ Не удалось сохранить оценку, попробуйте позже.")
+        return
+    await query.answer(f"✅ Ваша оценка: {score}/{RATING_SCALE}")
+    # Запись пачки голосов ждём вне обработчика: очередь чата не стоит, пока пачка копится
+    context.application.create_task(refresh_after_vote(saved, query.message, movie))
+
+# Карточка обновляется, когда голос записан; если запись не удалась — сообщаем зрителю
+async def refresh_after_vote(saved, message, movie):
+    try:
+        await saved
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении оценки: {e}")
+        await message.reply_text("❌ Не удалось сохранить оценку, попробуйте позже.")
+        return
+    await refresh_movie_card(message, movie)
+
+# Отзыв о фильме: кнопка под карточкой, затем текст отзыва
+async def review_start(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    movie = catalog.get(query.data.split(':', 1)[1])
+    if not movie:
+        await query.message.reply_text("❌ Фильм больше не доступен.", reply_markup=MAIN_MENU)
+        return ConversationHandler.END
+    context.user_data['review_movie'] = movie['id']
+    await query.message.reply_text(
+        f"✍️ Напишите отзыв о фильме «{movie['title']}» (до {REVIEW_MAX_LENGTH} символов):",
+        reply_markup=BACK_KEYBOARD
+    )
+    return REVIEW_TEXT
+
+async def review_text(update: Update, context: CallbackContext):
+    text = update.message.text.strip()
+    if text.lower() == "<< назад":
+        await show_main_menu(update, context)
+        return ConversationHandler.END
+
+    movie_id = context.user_data.pop('review_movie', None)
+    if movie_id is None or not catalog.get(movie_id):
+        await update.message.reply_text("❌ Фильм больше не доступен.", reply_markup=MAIN_MENU)
+        return ConversationHandler.END
+    saved = ratings.review(movie_id, update.effective_user.id, text)
+    await update.message.reply_text("✅ Спасибо! Отзыв сохранён.", reply_markup=MAIN_MENU)
+    context.application.create_task(report_review_failure(saved, update.message))
+    return ConversationHandler.END
+
+# Отзыв записывается с пачкой голосов уже после ответа; если запись не удалась — сообщаем
+async def report_review_failure(saved, message):
+    try:
+        await saved
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении отзыва: {e}")
+        await message.reply_text("❌ Не удалось сохранить отзыв, попробуйте позже.", reply_markup=MAIN_MENU)
+
+# Рейтинг, распределение оценок и последние отзывы о фильме
+async def reviews_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    movie = catalog.get(query.data.split(':', 1)[1])
+    if not movie:
+        await query.message.reply_text("❌ Фильм больше не доступен.", reply_markup=MAIN_MENU)
+        return
+
+    lines = [f"💬 «{movie['title']}»", ratings.summary_text(movie['id'])]
+    summary = ratings.summary(movie['id'])
+    if summary is not None:
+        count, _, histogram = summary
+        for score in reversed(SCORES):
+            votes = histogram[score - 1]
+            lines.append(f"{score:>2} {'▇' * round(votes / count * 10)} {votes}")
+    reviews = ratings.reviews(movie['id'], REVIEWS_SHOWN)
+    for _, score, text, _ in reviews:
+        shown = text if len(text) <= REVIEW_SHOWN_LENGTH else text[:REVIEW_SHOWN_LENGTH] + "…"
+        lines.append(f"\n{f'⭐ {score}/{RATING_SCALE} · ' if score else ''}{shown}")
+    if not reviews:
+        lines.append("\nОтзывов пока нет.")
+    await query.message.reply_text("\n".join(lines))
+
+# Список фильмов из рейтинга кнопками, как результаты поиска
+async def send_ranked(message, title, ranked):
+    if not ranked:
+        await message.reply_text("⭐ Оценок пока нет — оцените фильм первым!", reply_markup=MAIN_MENU)
+        return
+    keyboard = [
+        [InlineKeyboardButton(
+            f"🎬 {movie['title']} ({movie['year']}) · ⭐ {average:.1f}", callback_data=f"movie:{movie['id']}"
+        )]
+        for movie, (_, average, _) in ranked
+    ]
+    await message.reply_text(title, reply_markup=InlineKeyboardMarkup(keyboard))
+
+# Лучшие по оценкам зрителей
+async def show_top_rated(update: Update, context: CallbackContext):
+    await send_ranked(update.message, "🏆 Лучшие фильмы по оценкам зрителей:", ratings.top_rated(TOP_SHOWN))
+
+# Больше всего оценок за последние часы
+async def show_trending(update: Update, context: CallbackContext):
+    await send_ranked(update.message, "🔥 Сейчас чаще всего оценивают:", ratings.trending_now(TOP_SHOWN))
+
+# Поиск по названию, режиссёру или жанру
+async def search_movie_start(update: Update, context: CallbackContext):
+    await update.message.reply_text("🔎 Введите название фильма (можно с опечатками), режиссера или жанр:", reply_markup=BACK_KEYBOARD)
+    return SEARCH_TITLE
+
+async def search_movie(update: Update, context: CallbackContext):
+    query = update.message.text.strip()
+    if query.lower() == "<< назад":
+        await show_main_menu(update, context)
+        return ConversationHandler.END
+
+    await catalog.wait_indexes()
+    movies = catalog.search(query, SEARCH_RESULTS)
+
+    if not movies:
         await update.message.reply_text(
-            response,
-            parse_mode="Markdown",
-            reply_markup=generate_main_menu()
+            f"❌ По запросу «{query}» ничего не найдено.",
+            reply_markup=MAIN_MENU
         )
+        return ConversationHandler.END
 
+    keyboard = [
+        [InlineKeyboardButton(f"🎬 {movie['title']} ({movie['year']})", callback_data=f"movie:{movie['id']}")]
+        for movie in movies
+    ]
+    await update.message.reply_text(
+        f"🔎 Найдено по запросу «{query}»:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
     return ConversationHandler.END
 
-# Отмена операции
-async def cancel(update: Update, context: CallbackContext):
-    await update.message.reply_text(" OPERATION CANCELLED.", reply_markup=generate_main_menu())
-    return ConversationHandler.END
+# Нажатие на фильм в результатах поиска
+async def show_movie_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    movie = catalog.get(query.data.split(':', 1)[1])
+    if not movie:
+        await query.message.reply_text("❌ Фильм больше не доступен.", reply_markup=MAIN_MENU)
+        return
+    await send_movie_card(query.message, movie)
+
+# Ограничение Telegram на callback_data
+def callback_fits(data):
+    return len(data.encode()) <= 64
+
+# Влезают ли все callback_data, которые строятся из ключа жанра: кнопка уточнения
+# десятилетия и листание до последней страницы с любым десятилетием.
+# Жанры, которые не влезают, в меню не показываем.
+def genre_fits(key, count):
+    last_page = max(0, (count - 1) // BROWSE_PAGE_SIZE)
+    return callback_fits(f"browse:{key}:0000:{last_page}") and callback_fits(f"facet:decades:{key}")
+
+# Меню жанров (в пределах десятилетия, если оно выбрано)
+def genre_menu(decade=None):
+    facets = catalog.index("facets")
+    buttons = []
+    for key, count in facets.genres(decade)[:MENU_GENRES]:
+        if not genre_fits(key, count):
+            continue
+        data = f"browse:{key}:{'' if decade is None else decade}:0"
+        buttons.append(InlineKeyboardButton(f"{facets.genre_label(key)} ({count})", callback_data=data))
+    return InlineKeyboardMarkup([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+# Меню десятилетий (в пределах жанра, если он выбран)
+def decade_menu(genre=None):
+    buttons = [
+        InlineKeyboardButton(f"{decade}-е ({count})", callback_data=f"browse:{genre or ''}:{decade}:0")
+        for decade, count in catalog.index("facets").decades(genre)
+    ]
+    return InlineKeyboardMarkup([buttons[i:i + 3] for i in range(0, len(buttons), 3)])
 
-# Функция для обработки входящих обновлений
-async def process_update(update_data):
-    application = Application.builder().token(BOT_TOKEN).build()
-    update = Update.de_json(update_data, application.bot)
-    await application.process_update(update)
+# Страница фильмов по жанру и/или десятилетию, сначала новые
+def render_browse_page(genre, decade, page):
+    movies, total = catalog.browse(genre, decade, page * BROWSE_PAGE_SIZE, BROWSE_PAGE_SIZE)
+    pages = max(1, (total + BROWSE_PAGE_SIZE - 1) // BROWSE_PAGE_SIZE)
 
-# Основная функция
-async def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+    filters_text = []
+    if genre is not None:
+        filters_text.append(f"🎭 {catalog.index('facets').genre_label(genre)}")
+    if decade is not None:
+        filters_text.append(f"📅 {decade}-е")
+    text = f"{' · '.join(filters_text)}\nНайдено фильмов: {total}, страница {page + 1} из {pages}"
 
-    # Удаляем старый webhook
-    await application.bot.delete_webhook()
+    keyboard = [
+        [InlineKeyboardButton(f"🎬 {movie['title']} ({movie['year']})", callback_data=f"movie:{movie['id']}")]
+        for movie in movies
+    ]
+    base = f"browse:{genre or ''}:{'' if decade is None else decade}"
+    # Жанр мог попасть в меню при меньшем каталоге: кнопки, которые уже не влезают, не показываем
+    navigation = []
+    if page > 0 and callback_fits(f"{base}:{page - 1}"):
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{base}:{page - 1}"))
+    if page < pages - 1 and callback_fits(f"{base}:{page + 1}"):
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"{base}:{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    if decade is None and callback_fits(f"facet:decades:{genre}"):
+        keyboard.append([InlineKeyboardButton("📅 Уточнить десятилетие", callback_data=f"facet:decades:{genre}")])
+    elif genre is None:
+        keyboard.append([InlineKeyboardButton("🎭 Уточнить жанр", callback_data=f"facet:genres:{decade}")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+# Просмотр по жанрам
+async def browse_genres(update: Update, context: CallbackContext):
+    if not len(catalog):
+        await update.message.reply_text("❌ В базе пока нет фильмов.", reply_markup=MAIN_MENU)
+        return
+    await catalog.wait_indexes()
+    await update.message.reply_text("🎭 Выберите жанр:", reply_markup=genre_menu())
+
+# Просмотр по годам
+async def browse_decades(update: Update, context: CallbackContext):
+    if not len(catalog):
+        await update.message.reply_text("❌ В базе пока нет фильмов.", reply_markup=MAIN_MENU)
+        return
+    await catalog.wait_indexes()
+    await update.message.reply_text("📅 Выберите десятилетие:", reply_markup=decade_menu())
+
+# Кнопки просмотра: browse:<жанр>:<десятилетие>:<страница> и facet:<genres|decades>:<фильтр>
+async def browse_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    await catalog.wait_indexes()
+
+    if query.data.startswith("facet:"):
+        _, kind, value = query.data.split(':', 2)
+        if kind == "genres":
+            await query.edit_message_text("🎭 Выберите жанр:", reply_markup=genre_menu(int(value)))
+        else:
+            await query.edit_message_text("📅 Выберите десятилетие:", reply_markup=decade_menu(value))
+        return
+
+    genre, decade, page = query.data[len("browse:"):].rsplit(':', 2)
+    text, markup = render_browse_page(genre or None, int(decade) if decade else None, int(page))
+    await query.edit_message_text(text, reply_markup=markup)
 
-    # Устанавливаем новый webhook
-    WEBHOOK_URL = f"https://YOUR_RAILWAY_APP_URL/cinemabot"
-    await application.bot.set_webhook(url=WEBHOOK_URL)
+# Отмена операции
+async def cancel(update: Update, context: CallbackContext):
+    await update.message.reply_text(" OPERATION CANCELLED.", reply_markup=MAIN_MENU)
+    return ConversationHandler.END
 
-    # Запуск бота через webhook
-    logger.info("Основной бот запущен!")
-    await application.start()
-    await application.run_webhook(
-        listen="0.0.0.0",
-        port=int(os.getenv('PORT', 8080)),  # Использует порт из переменных окружения Railway
-        url_path="cinemabot",
-        webhook_url=WEBHOOK_URL
+# Создание приложения со всеми обработчиками.
+# Приложение создаётся один раз при старте и переиспользуется для всех обновлений.
+def build_application():
+    builder = (
+        Application.builder().token(BOT_TOKEN)
+        .connection_pool_size(CONNECTION_POOL_SIZE)
+        .rate_limiter(SendScheduler())
+        .persistence(SQLitePersistence("cinemabot"))
     )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
+    register_bot("cinemabot", application.bot)
 
     # Настройка обработчиков
-    conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("^🎬 Найти фильм$"), find_movie_start)],
+    conv_handler = SharedConversationHandler(
+        name="main",
+        persistent=True,
+        entry_points=[
+            MessageHandler(filters.Regex("^🎬 Найти фильм$"), find_movie_start),
+            MessageHandler(filters.Regex("^🔎 Поиск по названию$"), search_movie_start),
+            CallbackQueryHandler(review_start, pattern="^review:")
+        ],
         states={
             FIND_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, find_movie)],
+            SEARCH_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_movie)],
+            REVIEW_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, review_text)],
         },
         fallbacks=[
             CommandHandler("cancel", cancel),
@@ -205,22 +473,40 @@ async def main():
     )
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(MessageHandler(filters.Regex("^🎭 По жанрам$"), browse_genres))
+    application.add_handler(MessageHandler(filters.Regex("^📅 По годам$"), browse_decades))
+    application.add_handler(MessageHandler(filters.Regex("^🏆 Лучшие$"), show_top_rated))
+    application.add_handler(MessageHandler(filters.Regex("^🔥 Популярное$"), show_trending))
     application.add_handler(conv_handler)
+    # Под карточкой фильма теперь кнопки оценки, поэтому «<< Назад» работает и вне диалога
+    application.add_handler(MessageHandler(filters.Regex("^<< Назад$"), show_main_menu))
+    application.add_handler(CallbackQueryHandler(show_movie_callback, pattern="^movie:"))
+    application.add_handler(CallbackQueryHandler(browse_callback, pattern="^(browse|facet):"))
+    application.add_handler(CallbackQueryHandler(rate_callback, pattern="^(rate|card):"))
+    application.add_handler(CallbackQueryHandler(vote_callback, pattern="^vote:"))
+    application.add_handler(CallbackQueryHandler(reviews_callback, pattern="^reviews:"))
+
+    # Замер времени каждого обработчика (гистограммы для /metrics)
+    instrument(application, "cinemabot")
+
+    return application
+
+# Основная функция
+async def main():
+    application = build_application()
+    WEBHOOK_URL = f"https://YOUR_RAILWAY_APP_URL/cinemabot"
 
+    await application.initialize()
 
+    # Удаляем старый webhook
+    await application.bot.delete_webhook()
 
     # Запуск бота через webhook
-    logger.info("Основной бот запущен!")
-    await application.run_webhook(
+    await application.updater.start_webhook(
         listen="0.0.0.0",
-        port=8080,
+        port=int(os.getenv('PORT', 8080)),  # Использует порт из переменных окружения Railway
         url_path="cinemabot",
-        webhook_url=f"https://YOUR_RAILWAY_APP_URL/cinemabot"
+        webhook_url=WEBHOOK_URL
     )
-    
-
- # Функция для обработки входящих обновлений
-async def process_update(update_data):
-    application = Application.builder().token(BOT_TOKEN).build()
-    update = Update.de_json(update_data, application.bot)
-    await application.process_update(update)
\ No newline at end of file
+    await application.start()
+    logger.info("Основной бот запущен!")
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import time
+from collections import Counter, OrderedDict
+
+# Сколько секунд повторный запрос того же ключа получает готовый результат без повторной работы
+COALESCE_TTL = float(os.getenv('COALESCE_TTL', 5))
+
+# Сколько последних результатов помнить
+COALESCE_SIZE = int(os.getenv('COALESCE_SIZE', 4096))
+
+
+# Склейка одинаковых запросов по ключу.
+# Пока запрос выполняется, такие же запросы ждут его результата, а не запускают работу заново;
+# ещё ttl секунд после завершения получают тот же результат сразу. Ошибки не запоминаются:
+# ждавшие получают ту же ошибку, следующий запрос выполняется заново.
+class Coalescer:
+    def __init__(self, name, ttl=COALESCE_TTL, size=COALESCE_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.size = size
+        self.in_flight = {}
+        self.recent = OrderedDict()
+        self.counters = Counter()
+
+    # (результат, True) — если результат взят у другого запроса, иначе (результат, False)
+    async def run(self, key, work):
+        entry = self.recent.get(key)
+        if entry is not None:
+            if time.monotonic() - entry[0] < self.ttl:
+                self.counters['cached'] += 1
+                return entry[1], True
+            del self.recent[key]
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.counters['joined'] += 1
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        self.counters['executed'] += 1
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Если ошибку никто больше не ждал — без предупреждения «exception was never retrieved»
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self.recent[key] = (time.monotonic(), result)
+            if len(self.recent) > self.size:
+                self.recent.popitem(last=False)
+            return result, False
+        finally:
+            del self.in_flight[key]
+
+    def stats(self):
+        return {**self.counters, "in_flight": len(self.in_flight), "recent": len(self.recent)}
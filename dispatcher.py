@@ -0,0 +1,208 @@
+import asyncio
+import os
+import time
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Количество параллельных обработчиков на одного бота
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', 8))
+
+# Максимальная глубина очереди; сверх неё новые обновления отклоняются (503)
+MAX_QUEUE_DEPTH = int(os.getenv('MAX_QUEUE_DEPTH', 1000))
+
+# Сколько последних update_id помнить для отсева повторов от Telegram
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 10000))
+
+# Флуд: больше FLOOD_LIMIT обновлений от одного пользователя за FLOOD_WINDOW секунд отбрасываются.
+# Лимиты (и окно повторов ниже) считаются в памяти процесса, поэтому воркер один (см. run.WORKERS):
+# при нескольких лимит умножился бы на их число, а повтор в другом воркере не отсеивался бы
+FLOOD_LIMIT = int(os.getenv('FLOOD_LIMIT', 20))
+FLOOD_WINDOW = float(os.getenv('FLOOD_WINDOW', 10))
+
+# Тот же текст или та же кнопка из того же чата повторно в пределах REPEAT_WINDOW секунд
+# (пользователь жмёт кнопку несколько раз подряд) обрабатывается один раз
+REPEAT_WINDOW = float(os.getenv('REPEAT_WINDOW', 1.5))
+
+# Результаты submit()
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+FLOODED = 'flooded'
+REPEATED = 'repeated'
+OVERLOADED = 'overloaded'
+
+
+# Ключ для шардирования: все обновления одного чата попадают к одному обработчику,
+# поэтому шаги диалога (ADD_TITLE -> ADD_YEAR -> ...) выполняются строго по порядку
+def chat_key(update):
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return 0
+
+
+# Содержимое обновления для отсева повторов: текст сообщения или данные кнопки
+def payload_key(update):
+    if update.callback_query is not None:
+        return "callback", update.callback_query.data
+    if update.message is not None and update.message.text is not None:
+        return "text", update.message.text
+    return None
+
+
+# Диспетчер обновлений между webhook и обработчиками бота:
+# отсев дублей по update_id, флуда и повторных нажатий, очереди по чатам, N обработчиков и сброс нагрузки.
+# Флуд и повторы отбрасываются до очереди: обработчики и Bot API их не видят.
+# Всё это состояние — в памяти процесса и общим для воркеров не является (см. run.WORKERS).
+class UpdateDispatcher:
+    def __init__(self, name, process, workers=DISPATCH_WORKERS, max_depth=MAX_QUEUE_DEPTH,
+                 dedup_window=DEDUP_WINDOW, flood_limit=FLOOD_LIMIT, flood_window=FLOOD_WINDOW,
+                 repeat_window=REPEAT_WINDOW):
+        self.name = name
+        self.process = process
+        self.max_depth = max_depth
+        self.dedup_window = dedup_window
+        self.flood_limit = flood_limit
+        self.flood_window = flood_window
+        self.repeat_window = repeat_window
+        self.queues = [asyncio.Queue() for _ in range(workers)]
+        self.depth = 0
+        self._seen = OrderedDict()
+        # Пользователь -> моменты его последних обновлений; чат -> (содержимое, момент) последнего обновления
+        self._recent_by_user = {}
+        self._last_by_chat = {}
+        self._cleanup_at = 1024
+        self._tasks = []
+
+        # Метрики
+        self.accepted = 0
+        self.duplicates = 0
+        self.flooded = 0
+        self.repeated = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_seen_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._worker(queue), name=f"{self.name}-worker-{i}")
+            for i, queue in enumerate(self.queues)
+        ]
+
+    # Дождаться разбора очереди (не дольше timeout) и остановить обработчики
+    async def stop(self, timeout=10):
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name}: не обработано {self.depth} обновлений при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _remember(self, update_id):
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_window:
+            self._seen.popitem(last=False)
+
+    # Записи давно молчавших пользователей и чатов не нужны ни для флуда, ни для повторов.
+    # Порог растёт вместе с числом активных, чтобы не перебирать их на каждом обновлении.
+    def _cleanup(self, now):
+        if len(self._recent_by_user) + len(self._last_by_chat) <= self._cleanup_at:
+            return
+        self._recent_by_user = {
+            user: recent for user, recent in self._recent_by_user.items() if now - recent[-1] < self.flood_window
+        }
+        self._last_by_chat = {
+            chat: last for chat, last in self._last_by_chat.items() if now - last[1] < self.repeat_window
+        }
+        self._cleanup_at = max(1024, 2 * (len(self._recent_by_user) + len(self._last_by_chat)))
+
+    # Больше flood_limit обновлений пользователя за flood_window секунд (отброшенные не считаются)
+    def _is_flood(self, update, now):
+        user = update.effective_user.id if update.effective_user else chat_key(update)
+        recent = self._recent_by_user.get(user)
+        if recent is None:
+            recent = self._recent_by_user[user] = deque()
+        while recent and now - recent[0] >= self.flood_window:
+            recent.popleft()
+        if len(recent) >= self.flood_limit:
+            return True
+        recent.append(now)
+        return False
+
+    # То же содержимое, что и у предыдущего обновления чата, меньше repeat_window секунд назад
+    def _is_repeat(self, update, now):
+        payload = payload_key(update)
+        if payload is None:
+            return False
+        chat = chat_key(update)
+        last = self._last_by_chat.get(chat)
+        self._last_by_chat[chat] = (payload, now)
+        return last is not None and last[0] == payload and now - last[1] < self.repeat_window
+
+    def submit(self, update):
+        if update.update_id in self._seen:
+            self.duplicates += 1
+            return DUPLICATE
+        # Отклонённое при перегрузке Telegram пришлёт снова: его не запоминаем и не считаем
+        if self.depth >= self.max_depth:
+            self.rejected += 1
+            return OVERLOADED
+
+        self._remember(update.update_id)
+        now = time.monotonic()
+        self._cleanup(now)
+        if self._is_flood(update, now):
+            self.flooded += 1
+            logger.debug(f"{self.name}: флуд от {chat_key(update)}, обновление {update.update_id} отброшено")
+            return FLOODED
+        if self._is_repeat(update, now):
+            self.repeated += 1
+            return REPEATED
+
+        queue = self.queues[hash(chat_key(update)) % len(self.queues)]
+        queue.put_nowait((time.monotonic(), update))
+        self.depth += 1
+        self.accepted += 1
+        self.max_seen_depth = max(self.max_seen_depth, self.depth)
+        return ACCEPTED
+
+    async def _worker(self, queue):
+        while True:
+            enqueued_at, update = await queue.get()
+            self.depth -= 1
+            wait = time.monotonic() - enqueued_at
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки обновления {update.update_id} для {self.name}: {e}")
+            finally:
+                queue.task_done()
+
+    def stats(self):
+        started = self.processed + self.failed
+        return {
+            "queue_depth": self.depth,
+            "queue_depth_max": self.max_seen_depth,
+            "queue_limit": self.max_depth,
+            "workers": len(self.queues),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "flooded": self.flooded,
+            "repeated": self.repeated,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_avg_ms": round(self.wait_total / started * 1000, 3) if started else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
@@ -0,0 +1,131 @@
+from bisect import bisect_left, insort
+
+from search import normalize
+
+
+def genre_key(genre):
+    return normalize(genre).strip()
+
+
+def decade_of(year):
+    try:
+        return int(year) // 10 * 10
+    except (TypeError, ValueError):
+        return None
+
+
+# Списки фильмов по жанрам и десятилетиям.
+# Каждый список отсортирован по (added_date, id), поэтому страница «сначала новые»
+# берётся срезом с конца без просмотра всего каталога. Рядом лежат множества id
+# для быстрого пересечения («Военный» + 2000-е).
+class FacetIndex:
+    def __init__(self, movies=()):
+        self.by_genre = {}
+        self.by_decade = {}
+        self.genre_ids = {}
+        self.decade_ids = {}
+        self.genre_labels = {}
+        self.movie_facets = {}
+        for movie in movies:
+            self.add(movie)
+
+    @staticmethod
+    def _insert(lists, sets, key, sort_key):
+        insort(lists.setdefault(key, []), sort_key)
+        sets.setdefault(key, set()).add(sort_key[1])
+
+    @staticmethod
+    def _discard(lists, sets, key, sort_key):
+        items = lists.get(key)
+        if items is None:
+            return
+        i = bisect_left(items, sort_key)
+        if i < len(items) and items[i] == sort_key:
+            del items[i]
+        sets[key].discard(sort_key[1])
+        if not items:
+            del lists[key]
+            del sets[key]
+
+    def add(self, movie):
+        movie_id = movie['id']
+        if movie_id in self.movie_facets:
+            self.remove(movie_id)
+        sort_key = (movie.get('added_date') or '', movie_id)
+        genres = []
+        for genre in movie.get('genre') or []:
+            key = genre_key(genre)
+            if key and key not in genres:
+                genres.append(key)
+                self.genre_labels.setdefault(key, genre.strip())
+                self._insert(self.by_genre, self.genre_ids, key, sort_key)
+        decade = decade_of(movie.get('year'))
+        if decade is not None:
+            self._insert(self.by_decade, self.decade_ids, decade, sort_key)
+        self.movie_facets[movie_id] = (sort_key, genres, decade)
+
+    def remove(self, movie_id):
+        facets = self.movie_facets.pop(movie_id, None)
+        if facets is None:
+            return
+        sort_key, genres, decade = facets
+        for key in genres:
+            self._discard(self.by_genre, self.genre_ids, key, sort_key)
+            if key not in self.by_genre:
+                self.genre_labels.pop(key, None)
+        if decade is not None:
+            self._discard(self.by_decade, self.decade_ids, decade, sort_key)
+
+    def genre_label(self, key):
+        return self.genre_labels.get(key, key)
+
+    # Жанры с количеством фильмов (при заданном десятилетии — только в его пределах)
+    def genres(self, decade=None):
+        if decade is None:
+            counts = ((key, len(ids)) for key, ids in self.genre_ids.items())
+        else:
+            decade_ids = self.decade_ids.get(decade, set())
+            counts = ((key, len(ids & decade_ids)) for key, ids in self.genre_ids.items())
+        return sorted(((key, count) for key, count in counts if count), key=lambda item: (-item[1], item[0]))
+
+    # Десятилетия с количеством фильмов (при заданном жанре — только в его пределах)
+    def decades(self, genre=None):
+        if genre is None:
+            counts = ((decade, len(ids)) for decade, ids in self.decade_ids.items())
+        else:
+            genre_ids = self.genre_ids.get(genre, set())
+            counts = ((decade, len(ids & genre_ids)) for decade, ids in self.decade_ids.items())
+        return sorted((decade, count) for decade, count in counts if count)
+
+    # Страница id фильмов по жанру и/или десятилетию, сначала новые.
+    # Возвращает (список id, всего найдено).
+    def browse(self, genre=None, decade=None, offset=0, limit=10):
+        lists = []
+        if genre is not None:
+            lists.append((self.by_genre.get(genre, []), self.genre_ids.get(genre, set())))
+        if decade is not None:
+            lists.append((self.by_decade.get(decade, []), self.decade_ids.get(decade, set())))
+        if not lists:
+            return [], 0
+
+        if len(lists) == 1:
+            items = lists[0][0]
+            end = max(len(items) - offset, 0)
+            page = items[max(end - limit, 0):end]
+            return [movie_id for _, movie_id in reversed(page)], len(items)
+
+        # Пересечение: идём по меньшему списку и проверяем членство в множестве другого
+        (items, _), (_, other_ids) = sorted(lists, key=lambda pair: len(pair[0]))
+        total = len(lists[0][1] & lists[1][1])
+        result = []
+        skipped = 0
+        for _, movie_id in reversed(items):
+            if movie_id not in other_ids:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            result.append(movie_id)
+            if len(result) == limit:
+                break
+        return result, total
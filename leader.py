@@ -0,0 +1,63 @@
+import asyncio
+import fcntl
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Файл блокировки лидера (рядом с базой); сам файл не удаляется, важна только flock-блокировка
+LEADER_LOCK_FILE = os.getenv('LEADER_LOCK', 'kinobot.leader.lock')
+
+# Как часто (в секундах) остальные процессы пробуют стать лидером
+LEADER_RETRY_INTERVAL = float(os.getenv('LEADER_RETRY_INTERVAL', 5))
+
+
+# Выбор лидера среди воркеров через flock: блокировку держит открытый файл,
+# ядро снимает её, когда процесс завершается (в том числе аварийно),
+# поэтому «зависшего» lock-файла после падения не бывает.
+class LeaderLock:
+    def __init__(self, path=LEADER_LOCK_FILE):
+        self.path = path
+        self.fd = None
+
+    @property
+    def is_leader(self):
+        return self.fd is not None
+
+    def try_acquire(self):
+        if self.fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        logger.info(f"Процесс {os.getpid()} стал лидером")
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    # Ждать лидерства и выполнить on_elected(), когда блокировка получена. Если он упал
+    # (например, временная ошибка setWebhook), блокировка остаётся у этого процесса,
+    # а on_elected() повторяется через interval — иначе работу лидера не выполнял бы никто
+    async def campaign(self, on_elected, interval=LEADER_RETRY_INTERVAL):
+        while not self.try_acquire():
+            await asyncio.sleep(interval)
+        while True:
+            try:
+                await on_elected()
+                return
+            except Exception as e:
+                logger.error(f"Не удалось запустить работу лидера: {e!r}, повтор через {interval:g} с")
+            await asyncio.sleep(interval)
+
+
+leader = LeaderLock()
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+import logging
+
+import httpx
+
+from catalog import catalog
+from ratelimit import BULK
+
+logger = logging.getLogger(__name__)
+
+# Чат, куда боты могут загружать фото, чтобы получить собственный file_id
+# (file_id у каждого бота свой, чужой file_id отправить нельзя)
+MEDIA_CHAT_ID = os.getenv('MEDIA_CHAT_ID')
+
+# Сколько секунд не повторять отправку фото после ошибки
+FAILURE_TTL = int(os.getenv('MEDIA_FAILURE_TTL', 3600))
+
+# Сколько фото подготавливается одновременно в фоне
+PREFETCH_CONCURRENCY = int(os.getenv('MEDIA_PREFETCH_CONCURRENCY', 4))
+
+# Боты процесса: имя -> Bot, регистрируются в build_application()
+bots = {}
+
+
+def register_bot(name, bot):
+    bots[name] = bot
+
+
+# Ключ бота — числовой ID из токена
+def bot_key(bot):
+    return bot.token.split(':', 1)[0]
+
+
+# Кэш фото по ботам: исходная ссылка/file_id -> рабочий file_id этого бота,
+# а также недавние ошибки, чтобы битое фото не пытаться отправить при каждом запросе.
+# Хранится в памяти и в таблице media, чтобы знание разделяли все процессы.
+class MediaCache:
+    def __init__(self, store):
+        self.store = store
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def _entry(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.store.get_media(*key)
+            if entry is not None:
+                self.entries[key] = entry
+        return entry or (None, None)
+
+    # Что отправлять: свой file_id, исходную ссылку (ещё не пробовали) или None (недавно не удалось)
+    def resolve(self, bot, source):
+        file_id, failed_at = self._entry((bot_key(bot), source))
+        if file_id:
+            self.hits += 1
+            return file_id
+        if failed_at and time.time() - failed_at < FAILURE_TTL:
+            self.skipped += 1
+            return None
+        self.misses += 1
+        return source
+
+    def is_known(self, bot, source):
+        file_id, failed_at = self._entry((bot_key(bot), source))
+        return bool(file_id) or bool(failed_at and time.time() - failed_at < FAILURE_TTL)
+
+    def remember_success(self, bot, source, file_id):
+        key = (bot_key(bot), source)
+        if self.entries.get(key) == (file_id, None):
+            return
+        self.entries[key] = (file_id, None)
+        self.store.set_media(*key, file_id=file_id)
+
+    def remember_failure(self, bot, source, error):
+        key = (bot_key(bot), source)
+        failed_at = time.time()
+        self.entries[key] = (None, failed_at)
+        self.store.set_media(*key, failed_at=failed_at, error=str(error)[:500])
+        logger.warning(f"Фото {source[:60]} недоступно для бота {key[0]}: {error}")
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "skipped": self.skipped, "entries": len(self.entries)}
+
+
+media_cache = MediaCache(catalog.store)
+
+prefetch_semaphore = None
+prefetch_tasks = set()
+
+
+def _init_semaphore():
+    global prefetch_semaphore
+    if prefetch_semaphore is None:
+        prefetch_semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+
+# Подготовка фото нового фильма для всех ботов в фоне, не более PREFETCH_CONCURRENCY одновременно
+def schedule_prefetch(movie, source_bot):
+    if not movie.get("photo_url"):
+        return None
+    _init_semaphore()
+    task = asyncio.create_task(prefetch_photo(movie["photo_url"], source_bot))
+    prefetch_tasks.add(task)
+    task.add_done_callback(prefetch_tasks.discard)
+    return task
+
+
+# Фото, о которых кэш ещё ничего не знает хотя бы для одного бота (без повторов).
+# Читает таблицу media, поэтому вызывается из потока.
+def unknown_photos(sources):
+    unknown = []
+    for source in dict.fromkeys(sources):
+        if source and not all(media_cache.is_known(bot, source) for bot in list(bots.values())):
+            unknown.append(source)
+    return unknown
+
+
+# Подготовка пачки фото (импорт из файла) с ожиданием результата
+async def prefetch_photos(sources, source_bot):
+    _init_semaphore()
+    await asyncio.gather(*(prefetch_photo(source, source_bot) for source in sources))
+
+
+async def prefetch_photo(source, source_bot):
+    async with prefetch_semaphore:
+        if source.startswith(("http://", "https://")) and not await _url_reachable(source):
+            return
+        for bot in list(bots.values()):
+            if bot_key(bot) == bot_key(source_bot) or media_cache.is_known(bot, source):
+                continue
+            if not MEDIA_CHAT_ID:
+                continue
+            try:
+                await _upload_for_bot(bot, source, source_bot)
+            except Exception as e:
+                media_cache.remember_failure(bot, source, e)
+
+
+# Стоит ли загружать фото по ссылке для других ботов. Сначала HEAD; если сервер его
+# не принимает (405) или ответил ошибкой — GET только первого байта (Range). Неудачная
+# проверка лишь пропускает загрузку: ошибку в кэше запоминает только настоящий send_photo,
+# а Telegram принимает и ссылки, на которые HEAD не отвечает или отдаёт не image/*.
+async def _url_reachable(source):
+    try:
+        async with httpx.AsyncClient(timeout=10, follow_redirects=True) as client:
+            response = await client.head(source)
+            if response.status_code >= 400:
+                async with client.stream("GET", source, headers={"Range": "bytes=0-0"}) as response:
+                    pass
+    except httpx.HTTPError as e:
+        logger.info(f"Фото {source[:60]} не проверено: {e}")
+        return False
+    if response.status_code >= 400:
+        logger.info(f"Фото {source[:60]} недоступно: HTTP {response.status_code}")
+        return False
+    return True
+
+
+# Загрузка фото ботом в служебный чат, чтобы получить его собственный file_id
+async def _upload_for_bot(bot, source, source_bot):
+    if source.startswith(("http://", "https://")):
+        photo = source
+    else:
+        file = await source_bot.get_file(source)
+        photo = bytes(await file.download_as_bytearray())
+    message = await bot.send_photo(
+        chat_id=MEDIA_CHAT_ID, photo=photo, disable_notification=True, rate_limit_args=BULK
+    )
+    media_cache.remember_success(bot, source, message.photo[-1].file_id)
+    await message.delete(rate_limit_args=BULK)
+
+
+async def wait_prefetch(timeout=10):
+    if prefetch_tasks:
+        await asyncio.wait(list(prefetch_tasks), timeout=timeout)
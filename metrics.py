@@ -0,0 +1,162 @@
+import functools
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Все метрики процесса и функции, которые считают значения в момент запроса /metrics
+registry = []
+collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+# Счётчик (только растёт): значения по наборам меток
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+# Гистограмма: на каждое наблюдение — поиск корзины делением пополам и два сложения.
+# Накопительные суммы по корзинам (как требует формат Prometheus) считаются только при выдаче.
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}
+        registry.append(self)
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    # Замер времени блока: with histogram.time("label"): ...
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+# Метрики, значения которых уже есть в stats() модулей (очереди, кэши и т.п.), не дублируются:
+# collector при каждом запросе /metrics возвращает [(имя, тип, описание, [(метки, значение), ...]), ...]
+def register_collector(collector):
+    collectors.append(collector)
+
+
+def _render_collected():
+    for collector in collectors:
+        for name, kind, description, samples in collector():
+            yield f"# HELP {name} {description}"
+            yield f"# TYPE {name} {kind}"
+            for labels, value in samples:
+                yield f"{name}{_labels(labels.keys(), labels.values())} {value}"
+
+
+# Текст для Prometheus (формат text/plain; version=0.0.4).
+# Метрики у каждого воркера свои, поэтому в ответе есть pid ответившего процесса.
+def render():
+    lines = [
+        "# HELP kinobot_worker_info Процесс, ответивший на запрос метрик",
+        "# TYPE kinobot_worker_info gauge",
+        f'kinobot_worker_info{{pid="{os.getpid()}"}} 1',
+    ]
+    for metric in registry:
+        lines.extend(metric.render())
+    lines.extend(_render_collected())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_SECONDS = Histogram(
+    "kinobot_handler_seconds", "Время работы обработчика обновления", ("bot", "handler")
+)
+HANDLER_ERRORS = Counter(
+    "kinobot_handler_errors_total", "Исключения в обработчиках обновлений", ("bot", "handler")
+)
+
+
+# Замер времени асинхронного обработчика; ошибки считаются и пробрасываются дальше
+def timed(bot, handler=None):
+    def decorate(func):
+        name = handler or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(bot, name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, bot, name)
+
+        return wrapper
+
+    return decorate
+
+
+def _walk_handlers(handlers):
+    # telegram импортируется здесь: метрики нужны и модулям без ботов (catalog, storage)
+    from telegram.ext import ConversationHandler
+
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _walk_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _walk_handlers(state_handlers)
+            yield from _walk_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+# Обернуть замером все обработчики приложения, включая шаги диалогов (ConversationHandler).
+# Метка handler — имя функции-обработчика: find_movie, admin_add_year и т.д.
+def instrument(application, bot):
+    for group in application.handlers.values():
+        for handler in _walk_handlers(group):
+            if not getattr(handler.callback, '__wrapped__', None):
+                handler.callback = timed(bot)(handler.callback)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import logging
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+from storage import MovieStore, DB_FILE
+
+logger = logging.getLogger(__name__)
+
+# База для состояния ботов (по умолчанию та же, что и каталог)
+PERSISTENCE_FILE = os.getenv('PERSISTENCE_DB', DB_FILE)
+
+# Как часто (в секундах) python-telegram-bot сбрасывает изменённое состояние.
+# Все изменения за интервал записываются одной транзакцией.
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', 1))
+
+# Состояние в базе не отличается от того, что уже есть в памяти
+UNCHANGED = object()
+
+
+def _dump(data):
+    return json.dumps(data, ensure_ascii=False, sort_keys=True)
+
+
+# Хранение user_data, chat_data и состояний диалогов в SQLite.
+# Записи копятся в памяти и уходят в базу пачкой (write-behind); перед обработкой
+# обновления данные пользователя и чата перечитываются, если их изменил другой
+# процесс, поэтому несколько воркеров за server.py видят общее состояние.
+class SQLitePersistence(BasePersistence):
+    def __init__(self, bot_name, path=PERSISTENCE_FILE, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.bot_name = bot_name
+        self.store = MovieStore(path)
+        self.pending = {}
+        self.known = {}
+        self.flush_handle = None
+        self.counters = Counter()
+
+    # Изменение ставится в очередь; запись в базу — одной транзакцией в конце цикла обновления
+    def _stage(self, kind, key, data):
+        if self.known.get((kind, key)) == data:
+            return
+        self.known[(kind, key)] = data
+        self.pending[(kind, key)] = data
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self._write_pending)
+
+    def _write_pending(self):
+        self.flush_handle = None
+        if not self.pending:
+            return
+        changes, self.pending = self.pending, {}
+        try:
+            self.store.save_states(self.bot_name, changes)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние {self.bot_name}: {e}")
+            self.pending = {**changes, **self.pending}
+            return
+        self.counters['transactions'] += 1
+        self.counters['rows'] += len(changes)
+
+    def _load(self, kind):
+        rows = self.store.load_states(self.bot_name, kind)
+        for key, data in rows.items():
+            self.known[(kind, key)] = data
+        return rows
+
+    # Свежее значение из базы или UNCHANGED, если в памяти уже оно (или ещё не записанное своё)
+    def _reload(self, kind, key):
+        if (kind, key) in self.pending:
+            return UNCHANGED
+        data = self.store.load_state(self.bot_name, kind, key)
+        if data == self.known.get((kind, key)):
+            return UNCHANGED
+        self.known[(kind, key)] = data
+        self.counters['reloads'] += 1
+        return data
+
+    async def get_user_data(self):
+        return {int(key): json.loads(data) for key, data in self._load('user').items()}
+
+    async def get_chat_data(self):
+        return {int(key): json.loads(data) for key, data in self._load('chat').items()}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = self._load(f'conversation:{name}')
+        return {tuple(json.loads(key)): json.loads(data) for key, data in rows.items()}
+
+    async def update_user_data(self, user_id, data):
+        self._stage('user', str(user_id), _dump(data) if data else None)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage('chat', str(chat_id), _dump(data) if data else None)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(f'conversation:{name}', _dump(list(key)), None if new_state is None else _dump(new_state))
+
+    async def drop_user_data(self, user_id):
+        self._stage('user', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage('chat', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        data = self._reload('user', str(user_id))
+        if data is not UNCHANGED:
+            user_data.clear()
+            user_data.update(json.loads(data) if data else {})
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        data = self._reload('chat', str(chat_id))
+        if data is not UNCHANGED:
+            chat_data.clear()
+            chat_data.update(json.loads(data) if data else {})
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Состояние диалога из базы (для SharedConversationHandler): UNCHANGED, None или состояние
+    def conversation_state(self, name, key):
+        data = self._reload(f'conversation:{name}', _dump(list(key)))
+        if data is UNCHANGED or data is None:
+            return data
+        return json.loads(data)
+
+    async def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self._write_pending()
+        self.store.close()
+
+    def stats(self):
+        return {**self.counters, "pending": len(self.pending)}
+
+
+# ConversationHandler, который перед проверкой обновления берёт состояние диалога из базы,
+# если его изменил другой процесс (следующее сообщение пользователя может прийти в другой воркер)
+class SharedConversationHandler(ConversationHandler):
+    async def _initialize_persistence(self, application):
+        self._shared_persistence = application.persistence
+        return await super()._initialize_persistence(application)
+
+    def check_update(self, update):
+        persistence = getattr(self, '_shared_persistence', None)
+        if isinstance(persistence, SQLitePersistence) and isinstance(update, Update):
+            try:
+                key = self._get_key(update)
+            except RuntimeError:
+                key = None
+            # Незавершённые неблокирующие обработчики (PendingState) живут только в этом процессе
+            if key is not None and isinstance(self._conversations.get(key), (int, str, type(None))):
+                state = persistence.conversation_state(self.name, key)
+                if state is None:
+                    self._conversations.data.pop(key, None)
+                elif state is not UNCHANGED:
+                    self._conversations.update_no_track({key: state})
+        return super().check_update(update)
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+import logging
+from collections import Counter
+
+from telegram.error import BadRequest, Conflict, Forbidden, InvalidToken, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в личный чат, 20 в минуту в группу
+GLOBAL_RATE = float(os.getenv('RATE_LIMIT_GLOBAL', 30))
+CHAT_RATE = float(os.getenv('RATE_LIMIT_CHAT', 1))
+CHAT_BURST = int(os.getenv('RATE_LIMIT_CHAT_BURST', 3))
+GROUP_RATE = float(os.getenv('RATE_LIMIT_GROUP', 20)) / 60
+
+# Сколько раз повторять запрос после 429
+MAX_RETRIES = int(os.getenv('RATE_LIMIT_RETRIES', 3))
+
+# Приоритеты отправки: ответы пользователям идут раньше массовых рассылок и выгрузок.
+# Передаются в методы бота как rate_limit_args=BULK.
+INTERACTIVE = 0
+BULK = 1
+
+API_SECONDS = metrics.Histogram(
+    "kinobot_telegram_api_seconds", "Время запроса к Bot API (без ожидания лимитов)", ("endpoint",)
+)
+API_ERRORS = metrics.Counter(
+    "kinobot_telegram_api_errors_total", "Ошибки Bot API по кодам", ("endpoint", "code")
+)
+
+
+# Код ошибки Bot API для метрик (сетевые ошибки — без HTTP-кода)
+def error_code(error):
+    if isinstance(error, RetryAfter):
+        return "429"
+    if isinstance(error, Forbidden):
+        return "403"
+    if isinstance(error, InvalidToken):
+        return "401"
+    if isinstance(error, Conflict):
+        return "409"
+    if isinstance(error, BadRequest):
+        return "400"
+    if isinstance(error, TimedOut):
+        return "timeout"
+    if isinstance(error, NetworkError):
+        return "network"
+    return type(error).__name__
+
+
+# Корзина токенов: rate токенов в секунду, не больше burst сразу
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Взять токен: 0, если получилось, иначе сколько секунд ждать следующего
+    def take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+
+# Планировщик исходящих запросов для python-telegram-bot (Application.builder().rate_limiter()).
+# Общая корзина на бота и корзины по чатам; пока ждут интерактивные ответы, массовые
+# запросы (BULK) не берут токены из общей корзины. При 429 все запросы бота ждут
+# один общий срок retry_after, а не повторяют каждый сам по себе.
+class SendScheduler(BaseRateLimiter):
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 group_rate=GROUP_RATE, max_retries=MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self._cleanup_at = 1024
+        self.paused_until = 0.0
+        self.interactive_waiting = 0
+        self.counters = Counter()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        # Корзины давно молчавших чатов полны — их можно выбросить.
+        # Порог растёт вместе с числом активных чатов, чтобы при рассылке не перебирать их на каждом запросе.
+        if len(self.chat_buckets) > self._cleanup_at:
+            for key, bucket in list(self.chat_buckets.items()):
+                if key != chat_id and bucket.is_full():
+                    del self.chat_buckets[key]
+            self._cleanup_at = max(1024, 2 * len(self.chat_buckets))
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_pause(self):
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    # Дождаться токенов чата и общей корзины; True, если пришлось ждать
+    async def _acquire(self, chat_id, priority):
+        waited = False
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            while (delay := bucket.take()):
+                waited = True
+                await asyncio.sleep(delay)
+
+        if priority == INTERACTIVE:
+            self.interactive_waiting += 1
+        try:
+            while True:
+                await self._wait_pause()
+                if priority != INTERACTIVE and self.interactive_waiting:
+                    waited = True
+                    await asyncio.sleep(1 / self.global_bucket.rate)
+                    continue
+                delay = self.global_bucket.take()
+                if not delay:
+                    return waited
+                waited = True
+                await asyncio.sleep(delay)
+        finally:
+            if priority == INTERACTIVE:
+                self.interactive_waiting -= 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args or INTERACTIVE
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        for attempt in range(self.max_retries + 1):
+            if await self._acquire(chat_id, priority):
+                self.counters['throttled'] += 1
+            started = time.perf_counter()
+            try:
+                result = await callback(*args, **kwargs)
+                self.counters['sent'] += 1
+                return result
+            except Exception as e:
+                API_ERRORS.inc(endpoint, error_code(e))
+                if not isinstance(e, RetryAfter):
+                    raise
+                self.counters['retry_after'] += 1
+                if attempt == self.max_retries:
+                    self.counters['failed'] += 1
+                    logger.error(f"{endpoint}: превышен лимит Telegram после {attempt} повторов")
+                    raise
+                # Один общий срок паузы для всех запросов бота
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after + 0.1)
+                logger.info(f"{endpoint}: лимит Telegram, пауза {e.retry_after} с")
+            finally:
+                API_SECONDS.observe(time.perf_counter() - started, endpoint)
+
+    def stats(self):
+        return {**self.counters, "chats": len(self.chat_buckets), "interactive_waiting": self.interactive_waiting}
@@ -0,0 +1,269 @@
+import asyncio
+import heapq
+import json
+import os
+import time
+import logging
+from collections import Counter
+from operator import itemgetter
+
+from catalog import catalog
+from storage import RATING_SCALE
+
+logger = logging.getLogger(__name__)
+
+# Сколько фильмов держать в списках «Лучшие» и «Популярное сейчас»
+TOP_SIZE = int(os.getenv('TOP_SIZE', 50))
+
+# Голоса копятся в памяти и раз в VOTE_FLUSH_INTERVAL секунд записываются одной транзакцией
+VOTE_FLUSH_INTERVAL = float(os.getenv('VOTE_FLUSH_INTERVAL', 0.1))
+
+# Как часто (в секундах) подхватывать оценки, записанные другими процессами
+CHECK_INTERVAL = 1.0
+
+# Место в списке лучших — по байесовскому среднему: к оценкам фильма добавляются PRIOR_VOTES
+# голосов со средней PRIOR_MEAN, чтобы фильм с единственной «десяткой» не оказался первым
+PRIOR_VOTES = 10
+PRIOR_MEAN = 6.0
+
+# «Популярное сейчас»: вес оценки убывает в e раз за TREND_SECONDS. Популярность фильма —
+# log(сумма e^(время оценки / TREND_SECONDS)): она только растёт, а порядок фильмов
+# тот же, что у суммы весов на текущий момент
+TREND_SECONDS = 6 * 3600
+
+REVIEW_MAX_LENGTH = 1000
+
+SCORES = range(1, RATING_SCALE + 1)
+
+
+def _plural(n, one, few, many):
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+
+# Ключ фильма в списке лучших: (байесовское среднее, число оценок)
+def rating_key(count, total):
+    return ((total + PRIOR_VOTES * PRIOR_MEAN) / (count + PRIOR_VOTES), count)
+
+
+# Топ-k по ключу без сортировки всех фильмов.
+# Ключи всех фильмов — в scores, k лучших — в members и в куче (минимальный сверху):
+# новый ключ сравнивается только с порогом топа, O(log k). Старые записи кучи
+# пропускаются лениво. outside — верхняя граница ключей вне топа: если фильм из топа
+# опустился ниже неё, его мог обогнать кто-то снаружи, и топ пересобирается при чтении.
+class TopK:
+    def __init__(self, size=TOP_SIZE):
+        self.size = size
+        self.scores = {}
+        self.members = {}
+        self.heap = []
+        self.outside = None
+        self.stale = False
+        self.rebuilds = 0
+
+    def _push(self, item_id, key):
+        self.members[item_id] = key
+        heapq.heappush(self.heap, (key, item_id))
+        if len(self.heap) > 4 * self.size:
+            self.heap = [(key, item_id) for item_id, key in self.members.items()]
+            heapq.heapify(self.heap)
+
+    # Наименьшая действующая запись кучи
+    def _floor(self):
+        heap = self.heap
+        while self.members.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def _raise_outside(self, key):
+        if self.outside is None or key > self.outside:
+            self.outside = key
+
+    def update(self, item_id, key):
+        self.scores[item_id] = key
+        if self.stale:
+            return
+        old = self.members.get(item_id)
+        if old is not None:
+            self._push(item_id, key)
+            if key < old and self.outside is not None and key < self.outside:
+                self.stale = True
+        elif len(self.members) < self.size:
+            self._push(item_id, key)
+        else:
+            floor_key, floor_id = self._floor()
+            if key > floor_key:
+                heapq.heappop(self.heap)
+                del self.members[floor_id]
+                self._raise_outside(floor_key)
+                self._push(item_id, key)
+            else:
+                self._raise_outside(key)
+
+    def rebuild(self):
+        best = heapq.nlargest(self.size + 1, self.scores.items(), key=itemgetter(1))
+        self.members = dict(best[:self.size])
+        self.heap = [(key, item_id) for item_id, key in self.members.items()]
+        heapq.heapify(self.heap)
+        self.outside = best[self.size][1] if len(best) > self.size else None
+        self.stale = False
+        self.rebuilds += 1
+
+    # [(id, ключ), ...] от лучшего
+    def top(self, limit=None):
+        if self.stale:
+            self.rebuild()
+        return sorted(self.members.items(), key=itemgetter(1), reverse=True)[:limit]
+
+
+# Оценки и отзывы зрителей.
+# Голоса пишутся пачками (group commit): сотня голосов за популярный фильм — это одна транзакция
+# и одна строка сводки, а не сотня записей подряд. Голос сразу попадает в пачку в памяти;
+# запись пачки обработчик не ждёт, а получает её future и ждёт (если нужно) вне очереди чата.
+# Повторный голос того же зрителя за тот же фильм до записи пачки заменяет предыдущий.
+# Сводки фильмов (rating_stats) и списки лучших/популярных держатся в памяти и обновляются
+# по изменённым строкам — своим после записи и чужим по номеру seq.
+class Ratings:
+    def __init__(self, store, flush_interval=VOTE_FLUSH_INTERVAL, top_size=TOP_SIZE):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.summaries = {}
+        self.best = TopK(top_size)
+        self.trending = TopK(top_size)
+        self.seq = None
+        self._checked_at = 0.0
+        self.pending = {}
+        self.batch = None
+        self.flush_handle = None
+        self.counters = Counter()
+
+    # Новые сводки фильмов; при первой загрузке списки строятся сразу по всем фильмам
+    def _apply(self, rows, initial=False):
+        for movie_id, count, total, histogram, heat, seq in rows:
+            self.summaries[movie_id] = (count, total, tuple(json.loads(histogram)))
+            if initial:
+                self.best.scores[movie_id] = rating_key(count, total)
+                self.trending.scores[movie_id] = heat
+            else:
+                self.best.update(movie_id, rating_key(count, total))
+                self.trending.update(movie_id, heat)
+        if initial:
+            self.best.rebuild()
+            self.trending.rebuild()
+
+    # Подхватить сводки, изменённые с прошлой проверки (не чаще раза в CHECK_INTERVAL)
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self.seq is not None and now - self._checked_at < CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        rows = self.store.rating_stats_since(self.seq or 0)
+        if not rows:
+            self.seq = self.seq or 0
+            return
+        self._apply(rows, initial=self.seq is None)
+        self.seq = rows[-1][5]
+
+    # (число оценок, среднее, гистограмма) или None, если оценок нет
+    def summary(self, movie_id):
+        self.refresh()
+        summary = self.summaries.get(movie_id)
+        if not summary or not summary[0]:
+            return None
+        count, total, histogram = summary
+        return count, total / count, histogram
+
+    def summary_text(self, movie_id):
+        summary = self.summary(movie_id)
+        if summary is None:
+            return "⭐ Оценок пока нет"
+        count, average, _ = summary
+        return f"⭐ {average:.1f}/{RATING_SCALE} · {count} {_plural(count, 'оценка', 'оценки', 'оценок')}"
+
+    # Лучшие и популярные: [(фильм, (число оценок, среднее, гистограмма)), ...]; удалённые пропускаются
+    def _ranked(self, top, limit):
+        self.refresh()
+        result = []
+        for movie_id, _ in top.top():
+            movie = catalog.get(movie_id)
+            if movie is not None:
+                result.append((movie, self.summary(movie_id)))
+                if len(result) == limit:
+                    break
+        return result
+
+    def top_rated(self, limit=10):
+        return self._ranked(self.best, limit)
+
+    def trending_now(self, limit=10):
+        return self._ranked(self.trending, limit)
+
+    def vote(self, movie_id, user_id, score):
+        if score not in SCORES:
+            raise ValueError(f"оценка должна быть от 1 до {RATING_SCALE}")
+        self.counters['votes'] += 1
+        return self._submit(movie_id, user_id, score=score)
+
+    def review(self, movie_id, user_id, text):
+        self.counters['reviews'] += 1
+        return self._submit(movie_id, user_id, review=text.strip()[:REVIEW_MAX_LENGTH])
+
+    # Голос в текущую пачку. Возвращает future, который завершится записью пачки (с её ошибкой);
+    # отмена ожидающего не отменяет пачку. Пачка запишется и без ожидающих.
+    def _submit(self, movie_id, user_id, score=None, review=None):
+        key = (movie_id, user_id)
+        previous = self.pending.get(key)
+        if previous is not None:
+            self.counters['coalesced'] += 1
+            score = previous[0] if score is None else score
+            review = previous[1] if review is None else review
+        self.pending[key] = (score, review, time.time())
+        if self.batch is None:
+            loop = asyncio.get_running_loop()
+            self.batch = loop.create_future()
+            self.flush_handle = loop.call_later(self.flush_interval, self.flush)
+        waiter = asyncio.shield(self.batch)
+        # Ошибка записи уже в логе: не ждавшим её — без предупреждения «exception was never retrieved»
+        waiter.add_done_callback(lambda future: future.cancelled() or future.exception())
+        return waiter
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.batch = self.batch, None
+        pending, self.pending = self.pending, {}
+        if batch is None:
+            return
+        try:
+            rows = self.store.save_votes([
+                (movie_id, user_id, score, review, at, at / TREND_SECONDS)
+                for (movie_id, user_id), (score, review, at) in pending.items()
+            ])
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(pending)} голосов: {e}")
+            self.counters['failed'] += len(pending)
+            batch.set_exception(e)
+            return
+        self.counters['transactions'] += 1
+        self.counters['rows'] += len(pending)
+        # Свои изменения видны сразу; seq не сдвигаем — чужие записи до нашей подхватит refresh
+        self._apply(rows)
+        batch.set_result(None)
+
+    def reviews(self, movie_id, limit=5):
+        return self.store.latest_reviews(movie_id, limit)
+
+    def stats(self):
+        return {
+            **self.counters,
+            "pending": len(self.pending),
+            "rated_movies": len(self.summaries),
+            "top_rebuilds": self.best.rebuilds + self.trending.rebuilds,
+        }
+
+
+ratings = Ratings(catalog.store)
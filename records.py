@@ -0,0 +1,136 @@
+import mmap
+import sys
+from collections.abc import Mapping
+
+# Поля фильма в том порядке, в каком их отдаёт dict(movie) (как в таблице movies)
+FIELDS = (
+    "id", "code", "title", "year", "director", "genre",
+    "photo_url", "watch_url", "added_date", "ratings", "reviews"
+)
+
+# Поля, которые хранятся в самой записи (остальные — ссылки в файле URL)
+SLOT_FIELDS = frozenset(("id", "code", "title", "year", "director", "genre", "added_date", "ratings", "reviews"))
+
+# Поле -> номер ссылки в паре (watch_url, photo_url)
+URL_FIELDS = {"watch_url": 0, "photo_url": 1}
+
+
+# Ссылки фильмов в файле снимка, отображённом в память (mmap, только чтение).
+# Страницы файла общие для всех воркеров в кэше ОС: ссылки не копируются в память процесса,
+# пока их не запросят, и запрошенная ссылка — это декодирование пары байтовых отрезков.
+# Формат записи: watch_url \0 photo_url \0; смещения отсчитываются от base.
+class UrlBlob:
+    def __init__(self, file, base):
+        self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.base = base
+
+    def read(self, offset):
+        start = self.base + offset
+        middle = self.map.find(b"\0", start)
+        end = self.map.find(b"\0", middle + 1)
+        return self.map[start:middle].decode(), self.map[middle + 1:end].decode()
+
+    def __len__(self):
+        return len(self.map) - self.base
+
+
+# Запись ссылок фильмов для UrlBlob: части файла и смещения по порядку фильмов
+def pack_urls(movies):
+    parts = []
+    offsets = []
+    size = 0
+    for movie in movies:
+        part = f"{movie.get('watch_url') or ''}\0{movie.get('photo_url') or ''}\0".encode()
+        offsets.append(size)
+        parts.append(part)
+        size += len(part)
+    return b"".join(parts), offsets
+
+
+# Фильм каталога: вместо словаря — объект со __slots__ (без словаря атрибутов на каждый фильм).
+# Режиссёр, год, дата и жанры общие для всех фильмов с тем же значением (см. _shared),
+# пустые ratings/reviews — общий пустой кортеж, ссылки лежат в UrlBlob.
+# Читается как словарь: movie['title'], movie.get('photo_url'), dict(movie); изменять нельзя —
+# одна и та же запись лежит во всех индексах каталога.
+class MovieRecord(Mapping):
+    __slots__ = ("id", "code", "title", "year", "director", "genre", "added_date", "ratings", "reviews",
+                 "_urls", "_blob")
+
+    def __init__(self, id, code, title, year, director, genre, added_date, ratings, reviews, urls, blob=None):
+        self.id = id
+        self.code = code
+        self.title = title
+        self.year = year
+        self.director = director
+        self.genre = genre
+        self.added_date = added_date
+        self.ratings = ratings
+        self.reviews = reviews
+        # Смещение в blob или, если файла ссылок нет (фильм добавлен после загрузки), пара строк
+        self._urls = urls
+        self._blob = blob
+
+    # Фильм из словаря (новый фильм, строка базы); shared — общий кэш значений на всю загрузку
+    @classmethod
+    def from_movie(cls, movie, shared=None):
+        shared = {} if shared is None else shared
+        return cls(
+            movie.get("id"), movie.get("code"), movie.get("title"), _shared(movie.get("year"), shared),
+            _shared(movie.get("director"), shared), _genres(movie.get("genre"), shared),
+            _shared(movie.get("added_date"), shared),
+            movie.get("ratings") or (), movie.get("reviews") or (),
+            (movie.get("watch_url") or "", movie.get("photo_url") or ""),
+        )
+
+    def urls(self):
+        return self._urls if self._blob is None else self._blob.read(self._urls)
+
+    def __getitem__(self, key):
+        if key in URL_FIELDS:
+            return self.urls()[URL_FIELDS[key]]
+        if key in SLOT_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return f"MovieRecord(id={self.id!r}, title={self.title!r})"
+
+
+# Одно значение на все фильмы, где оно встречается: строки интернируются,
+# числа и кортежи жанров берутся из кэша shared
+def _shared(value, shared):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if value is None:
+        return None
+    return shared.setdefault(value, value)
+
+
+def _genres(value, shared):
+    return _shared(tuple(_shared(genre, shared) for genre in value or ()), shared)
+
+
+# Поля строки двоичного снимка; последнее — смещение ссылок фильма в UrlBlob
+def snapshot_row(movie, url_offset):
+    return (
+        movie.get("id"), movie.get("code"), movie.get("title"), movie.get("year"), movie.get("director"),
+        list(movie.get("genre") or ()), movie.get("added_date"),
+        list(movie.get("ratings") or ()), list(movie.get("reviews") or ()), url_offset,
+    )
+
+
+# Записи каталога из строк снимка (shared — общий кэш значений на всю загрузку)
+def records_from_snapshot(rows, blob, shared):
+    records = []
+    for movie_id, code, title, year, director, genre, added_date, ratings, reviews, url_offset in rows:
+        records.append(MovieRecord(
+            movie_id, code, title, _shared(year, shared), _shared(director, shared), _genres(genre, shared),
+            _shared(added_date, shared), ratings or (), reviews or (), url_offset, blob,
+        ))
+    return records
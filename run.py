@@ -1,26 +1,114 @@
 import asyncio
-from dotenv import load_dotenv
+import multiprocessing
 import os
+import signal
+import socket
+import time
+import logging
+from dotenv import load_dotenv
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Импортируем функции main из обоих ботов
-from cinemabot import main as cinemabot_main
-from adminbot import main as adminbot_main
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Число воркеров и адрес, который они слушают вместе.
+# Пока воркер может быть только один: состояние диспетчера обновлений (отсев дублей
+# по update_id, порядок обновлений одного чата, лимиты флуда и повторов) хранится в памяти
+# процесса, состояние диалогов пишется в базу с задержкой, а сокет раздаёт запросы воркерам
+# без привязки к чату. С несколькими воркерами повтор от Telegram обработался бы дважды,
+# а шаги диалога — не по порядку, поэтому WORKERS > 1 супервизор не запускает.
+WORKERS = int(os.getenv('WORKERS', 1))
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', 8080))
+
+# Воркер, не отметившийся дольше LIVENESS_TIMEOUT секунд (завис event loop), перезапускается
+HEARTBEAT_INTERVAL = 1.0
+LIVENESS_TIMEOUT = float(os.getenv('LIVENESS_TIMEOUT', 30))
+
+# Воркеры запускаются через spawn: каждый импортирует ботов и открывает базу заново
+context = multiprocessing.get_context('spawn')
+
+
+# Воркер: uvicorn на общем сокете и отметка «жив» из event loop
+def run_worker(sock, heartbeat):
+    import uvicorn
+    from server import app
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def serve():
+        server = uvicorn.Server(uvicorn.Config(app, lifespan='on'))
+        task = asyncio.create_task(beat())
+        try:
+            await server.serve(sockets=[sock])
+        finally:
+            task.cancel()
+
+    asyncio.run(serve())
+
+
+# Супервизор: открывает сокет, держит WORKERS воркеров и перезапускает упавшие и зависшие
+class Supervisor:
+    def __init__(self, workers=WORKERS, host=HOST, port=PORT):
+        if workers != 1:
+            raise SystemExit(f"WORKERS={workers}: поддерживается только один воркер (см. run.WORKERS)")
+        self.workers = workers
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.set_inheritable(True)
+        self.processes = []
+        self.stopping = False
+
+    def spawn(self):
+        heartbeat = context.Value('d', time.time())
+        process = context.Process(target=run_worker, args=(self.sock, heartbeat), daemon=False)
+        process.start()
+        logger.info(f"Запущен воркер {process.pid}")
+        return process, heartbeat
+
+    def check(self):
+        now = time.time()
+        for i, (process, heartbeat) in enumerate(self.processes):
+            if not process.is_alive():
+                logger.warning(f"Воркер {process.pid} завершился с кодом {process.exitcode}, перезапуск")
+            elif now - heartbeat.value > LIVENESS_TIMEOUT:
+                logger.warning(f"Воркер {process.pid} не отвечает {now - heartbeat.value:.0f} с, перезапуск")
+                process.kill()
+                process.join()
+            else:
+                continue
+            self.processes[i] = self.spawn()
 
-async def run_bots():
-    # Запускаем основной бот
-    asyncio.create_task(cinemabot_main())
+    def stop(self, *args):
+        self.stopping = True
 
-    # Запускаем админ-бот
-    asyncio.create_task(adminbot_main())
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.processes = [self.spawn() for _ in range(self.workers)]
+        try:
+            while not self.stopping:
+                time.sleep(HEARTBEAT_INTERVAL)
+                self.check()
+        finally:
+            for process, _ in self.processes:
+                process.terminate()
+            for process, _ in self.processes:
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.kill()
+            self.sock.close()
+            logger.info("Боты остановлены.")
 
-    # Ждём завершения задач
-    await asyncio.gather(cinemabot_main(), adminbot_main())
 
 if __name__ == '__main__':
-    try:
-        asyncio.run(run_bots())
-    except KeyboardInterrupt:
-        print("Боты остановлены.")
\ No newline at end of file
+    Supervisor().run()
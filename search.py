@@ -0,0 +1,133 @@
+import heapq
+import re
+from collections import defaultdict
+
+# Слова: последовательности букв/цифр в любом алфавите
+TOKEN_RE = re.compile(r"\w+")
+
+# Вес совпадения в зависимости от поля фильма
+FIELD_WEIGHTS = {"title": 3.0, "director": 2.0, "genre": 1.0}
+
+# Минимальное сходство по триграммам (коэффициент Жаккара) для нечёткого совпадения
+FUZZY_THRESHOLD = 0.3
+
+
+# Нормализация: регистр (casefold корректно работает с кириллицей) и ё -> е
+def normalize(text):
+    return str(text).casefold().replace('ё', 'е')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+# Триграммы слова с отступами по краям, как в pg_trgm: "кот" -> "  к", " ко", "кот", "от "
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Инвертированный индекс по названию, режиссёру и жанрам.
+# Слово -> {id фильма: вес}, плюс триграммный индекс по словарю для поиска с опечатками.
+# Фильмы добавляются и удаляются по одному, без перестройки всего индекса.
+class SearchIndex:
+    def __init__(self, movies=()):
+        self.postings = {}
+        self.movie_tokens = {}
+        self.trigram_index = defaultdict(set)
+        self.token_trigrams = {}
+        for movie in movies:
+            self.add(movie)
+
+    def __len__(self):
+        return len(self.movie_tokens)
+
+    @staticmethod
+    def _movie_weights(movie):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            value = movie.get(field) or ""
+            if isinstance(value, (list, tuple)):
+                value = " ".join(value)
+            for token in tokenize(value):
+                if weights.get(token, 0) < weight:
+                    weights[token] = weight
+        return weights
+
+    def _add_token(self, token):
+        grams = trigrams(token)
+        self.token_trigrams[token] = len(grams)
+        for gram in grams:
+            self.trigram_index[gram].add(token)
+
+    def _remove_token(self, token):
+        for gram in trigrams(token):
+            tokens = self.trigram_index.get(gram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.trigram_index[gram]
+        del self.token_trigrams[token]
+
+    def add(self, movie):
+        movie_id = movie['id']
+        if movie_id in self.movie_tokens:
+            self.remove(movie_id)
+        weights = self._movie_weights(movie)
+        self.movie_tokens[movie_id] = weights
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                self._add_token(token)
+            posting[movie_id] = weight
+
+    def remove(self, movie_id):
+        weights = self.movie_tokens.pop(movie_id, None)
+        if not weights:
+            return
+        for token in weights:
+            posting = self.postings[token]
+            posting.pop(movie_id, None)
+            if not posting:
+                del self.postings[token]
+                self._remove_token(token)
+
+    # Слова из словаря, похожие на token: [(слово, сходство), ...]
+    def similar_tokens(self, token):
+        grams = trigrams(token)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self.trigram_index.get(gram, ()):
+                shared[candidate] += 1
+        result = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + self.token_trigrams[candidate] - count)
+            if similarity >= FUZZY_THRESHOLD:
+                result.append((candidate, similarity))
+        return result
+
+    # Лучшие limit фильмов по запросу: [(id фильма, оценка), ...] по убыванию оценки.
+    # Слово из запроса, которого нет в словаре, ищется нечётко по триграммам.
+    def search(self, query, limit=10):
+        tokens = tokenize(query)
+        if any(len(token) > 1 for token in tokens):
+            tokens = [token for token in tokens if len(token) > 1]
+
+        scores = defaultdict(float)
+        for token in dict.fromkeys(tokens):
+            if token in self.postings:
+                matches = [(token, 1.0)]
+            else:
+                matches = self.similar_tokens(token)
+
+            best = {}
+            for matched, similarity in matches:
+                for movie_id, weight in self.postings[matched].items():
+                    score = similarity * weight
+                    if score > best.get(movie_id, 0):
+                        best[movie_id] = score
+            for movie_id, score in best.items():
+                scores[movie_id] += score
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
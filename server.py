@@ -1,42 +1,275 @@
-from flask import Flask, request, jsonify
+import asyncio
+import gc
+import logging
 import os
+import signal
+from contextlib import asynccontextmanager
 
-app = Flask(__name__)
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
 
-# Endpoint для основного бота
-@app.route('/cinemabot', methods=['POST'])
-async def cinemabot_webhook():
-    from cinemabot import process_update
-    update_data = request.get_json(force=True)
-    if not update_data:
-        return jsonify({"status": "error", "message": "Empty request"}), 400
+import metrics
+import startup
+from catalog import catalog
+from dispatcher import UpdateDispatcher, FLOODED, OVERLOADED, REPEATED
+from leader import leader
+from ratings import ratings
+from storage import SNAPSHOT_FILE
+
+logger = logging.getLogger(__name__)
+
+# Публичный адрес сервера: лидер регистрирует по нему webhook каждого бота (<адрес>/<имя бота>)
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')
+
+# Приложения ботов и их диспетчеры: создаются один раз при старте сервера
+applications = {}
+dispatchers = {}
+
+# Боты запущены и каталог загружен; до этого webhook и /stats ждут, а /health отвечает сразу
+ready = asyncio.Event()
+
+
+def load_catalog():
+    catalog.refresh()
+    startup.mark("catalog_loaded")
+
+
+# python-telegram-bot и модули ботов импортируются здесь, а не при импорте server,
+# и в отдельном потоке: воркер начинает отвечать, пока боты и каталог ещё загружаются
+def build_bots():
+    import cinemabot
+    import adminbot
+    startup.mark("bots_imported")
+    return {"cinemabot": cinemabot.build_application(), "adminbot": adminbot.build_application()}
+
+
+async def start_bots():
+    # Каталог читается одновременно с импортом ботов и их getMe
+    loading = asyncio.create_task(asyncio.to_thread(load_catalog))
+    built = await asyncio.to_thread(build_bots)
+    await asyncio.gather(loading, *(application.initialize() for application in built.values()))
+    startup.mark("bots_initialized")
+    for name, application in built.items():
+        await application.start()
+        applications[name] = application
+        dispatchers[name] = UpdateDispatcher(name, application.process_update)
+        dispatchers[name].start()
+    # Загруженное при старте (модули, каталог) живёт до конца процесса: один раз, до первого
+    # обновления, выводим его из поколений сборщика мусора, чтобы полные проходы его не обходили
+    gc.collect()
+    gc.freeze()
+    ready.set()
+    startup.mark("ready")
+    startup.log_summary()
+    # Индексы поиска и жанров строятся в потоке, уже после готовности; обработчики поиска
+    # и жанров до конца постройки ждут её (catalog.wait_indexes), не останавливая event loop
     try:
-        await process_update(update_data)
+        await asyncio.to_thread(catalog.build_indexes)
     except Exception as e:
-        print(f"Error processing update for CinemaBot: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
-    return jsonify({"status": "ok"}), 200
-
-# Endpoint для админ-бота
-@app.route('/adminbot', methods=['POST'])
-async def adminbot_webhook():
-    from adminbot import process_update
-    update_data = request.get_json(force=True)
+        logger.error(f"Не удалось построить индексы каталога: {e}")
+
+
+async def stop_bots():
+    from media import wait_prefetch
+
+    ready.clear()
+    for dispatcher in dispatchers.values():
+        await dispatcher.stop()
+    dispatchers.clear()
+    ratings.flush()
+    await wait_prefetch()
+    for application in applications.values():
+        await application.stop()
+        await application.shutdown()
+    applications.clear()
+
+
+# Общий обработчик webhook: обновление ставится в очередь диспетчера, ответ сразу.
+# При переполненной очереди отвечаем 503 — Telegram повторит доставку позже.
+async def webhook(request: Request):
+    await ready.wait()
+    from telegram import Update
+
+    name = request.url.path.strip('/')
+    application = applications[name]
+    try:
+        update_data = await request.json()
+    except ValueError:
+        update_data = None
     if not update_data:
-        return jsonify({"status": "error", "message": "Empty request"}), 400
+        return JSONResponse({"status": "error", "message": "Empty request"}, status_code=400)
+
+    update = Update.de_json(update_data, application.bot)
+    result = dispatchers[name].submit(update)
+    if result == OVERLOADED:
+        return JSONResponse(
+            {"status": "error", "message": "Overloaded"},
+            status_code=503,
+            headers={"Retry-After": "1"}
+        )
+    startup.mark("first_webhook")
+    # Отброшенное нажатие кнопки всё равно нужно подтвердить, иначе у пользователя крутится
+    # индикатор загрузки. Ответ идёт прямо в ответе на webhook — без отдельного запроса к Bot API.
+    if result in (FLOODED, REPEATED) and update.callback_query is not None:
+        return JSONResponse({"method": "answerCallbackQuery", "callback_query_id": update.callback_query.id})
+    return JSONResponse({"status": result})
+
+
+# Состояние очередей обработки
+async def stats(request: Request):
+    await ready.wait()
+    from broadcast import broadcaster
+    from cards import card_cache
+    from cinemabot import card_requests
+    from media import media_cache
+
+    result = {name: dispatcher.stats() for name, dispatcher in dispatchers.items()}
+    result["media"] = media_cache.stats()
+    result["cards"] = card_cache.stats()
+    result["ratings"] = ratings.stats()
+    result["coalesced"] = {"cards": card_requests.stats()}
+    result["broadcast"] = broadcaster.stats()
+    result["outbound"] = {name: application.bot.rate_limiter.stats() for name, application in applications.items()}
+    result["persistence"] = {name: application.persistence.stats() for name, application in applications.items()}
+    return JSONResponse(result)
+
+
+def _file_size(path):
     try:
-        await process_update(update_data)
-    except Exception as e:
-        print(f"Error processing update for AdminBot: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
-    return jsonify({"status": "ok"}), 200
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# Значения для /metrics из stats() диспетчеров, кэшей, планировщика отправки и рассылки
+def collect_runtime():
+    if not ready.is_set():
+        return
+    from broadcast import broadcaster
+    from cards import card_cache
+    from cinemabot import card_requests
+    from media import media_cache
+
+    yield "kinobot_queue_depth", "gauge", "Обновления в очереди диспетчера", [
+        ({"bot": name}, dispatcher.depth) for name, dispatcher in dispatchers.items()
+    ]
+    for key in ("accepted", "duplicates", "flooded", "repeated", "rejected", "processed", "failed"):
+        yield f"kinobot_updates_{key}_total", "counter", f"Обновления webhook: {key}", [
+            ({"bot": name}, getattr(dispatcher, key)) for name, dispatcher in dispatchers.items()
+        ]
+    caches = {"media": media_cache.stats(), "cards": card_cache.stats()}
+    yield "kinobot_cache_hits_total", "counter", "Попадания в кэш", [
+        ({"cache": name}, stats["hits"]) for name, stats in caches.items()
+    ]
+    yield "kinobot_cache_misses_total", "counter", "Промахи кэша", [
+        ({"cache": name}, stats["misses"]) for name, stats in caches.items()
+    ]
+    yield "kinobot_cache_entries", "gauge", "Записей в кэше", [
+        ({"cache": "media"}, caches["media"]["entries"]), ({"cache": "cards"}, caches["cards"]["size"])
+    ]
+    coalesced = card_requests.stats()
+    yield "kinobot_coalesced_total", "counter", "Повторные запросы карточки, получившие готовый результат", [
+        ({"kind": kind}, coalesced.get(kind, 0)) for kind in ("cached", "joined")
+    ]
+    outbound = {name: application.bot.rate_limiter.stats() for name, application in applications.items()}
+    for key in ("sent", "throttled", "retry_after", "failed"):
+        yield f"kinobot_outbound_{key}_total", "counter", f"Исходящие запросы к Bot API: {key}", [
+            ({"bot": name}, stats.get(key, 0)) for name, stats in outbound.items()
+        ]
+    yield "kinobot_outbound_interactive_waiting", "gauge", "Ответы пользователям, ждущие лимита", [
+        ({"bot": name}, stats["interactive_waiting"]) for name, stats in outbound.items()
+    ]
+    yield "kinobot_persistence_pending", "gauge", "Изменения состояния, ещё не записанные в базу", [
+        ({"bot": name}, application.persistence.stats()["pending"]) for name, application in applications.items()
+    ]
+    progress = broadcaster.stats()
+    yield "kinobot_broadcast_remaining", "gauge", "Получатели текущей рассылки, которым ещё не отправлено", [
+        ({}, progress["total"] - progress["done"] if progress["running"] is not None else 0)
+    ]
+    yield "kinobot_catalog_movies", "gauge", "Фильмов в каталоге", [({}, len(catalog))]
+    yield "kinobot_catalog_bytes", "gauge", "Размер файлов каталога", [
+        ({"file": "database"}, _file_size(catalog.store.path) + _file_size(f"{catalog.store.path}-wal")),
+        ({"file": "snapshot"}, _file_size(SNAPSHOT_FILE)),
+    ]
+
+
+metrics.register_collector(collect_runtime)
+
+
+# Метрики в формате Prometheus
+async def metrics_endpoint(request: Request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 # Проверка работы сервера
-@app.route('/')
-def index():
-    return "Bots are running!"
+async def index(request: Request):
+    return PlainTextResponse("Bots are running!")
+
+
+# Проверка живости воркера
+async def health(request: Request):
+    startup.mark("first_response")
+    return JSONResponse({
+        "pid": os.getpid(), "leader": leader.is_leader, "ready": ready.is_set(), "startup_ms": startup.stages
+    })
+
+
+# Работа, которая должна выполняться в одном процессе: её берёт на себя лидер
+async def start_leader_tasks():
+    await ready.wait()
+    from broadcast import broadcaster
+
+    if WEBHOOK_BASE_URL:
+        for name, application in applications.items():
+            await application.bot.set_webhook(f"{WEBHOOK_BASE_URL.rstrip('/')}/{name}")
+            logger.info(f"Webhook {name} зарегистрирован")
+    # Фоновый компактор: сбрасывает журнал SQLite и атомарно обновляет снимок movies.json
+    catalog.store.start_compactor()
+    # Рассылки новинок: рассылает cinemabot, о ходе рассылки сообщает adminbot
+    broadcaster.start(applications['cinemabot'].bot, applications['adminbot'].bot)
+
+
+# Без ботов воркер бесполезен: завершаем процесс, супервизор запустит новый
+def _check_boot(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Не удалось запустить ботов: {task.exception()!r}")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    startup.mark("server_started")
+    boot = asyncio.create_task(start_bots())
+    boot.add_done_callback(_check_boot)
+    # Если лидер уже есть, этот процесс ждёт и займёт его место, когда тот завершится
+    election = asyncio.create_task(leader.campaign(start_leader_tasks))
+    yield
+    election.cancel()
+    boot.cancel()
+    from broadcast import broadcaster
+    await broadcaster.stop()
+    await stop_bots()
+    leader.release()
+
+
+app = Starlette(
+    routes=[
+        Route('/cinemabot', webhook, methods=['POST']),
+        Route('/adminbot', webhook, methods=['POST']),
+        Route('/stats', stats),
+        Route('/health', health),
+        Route('/metrics', metrics_endpoint),
+        Route('/', index),
+    ],
+    lifespan=lifespan,
+)
+
+startup.mark("server_imported")
 
 if __name__ == '__main__':
+    import uvicorn
+
     port = int(os.getenv('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
-    
\ No newline at end of file
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,34 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Момент запуска процесса (вместе со стартом интерпретатора): время с загрузки системы
+# из /proc/uptime минус момент старта процесса из /proc/self/stat (оба с точностью до 10 мс).
+# Если /proc недоступен — момент импорта этого модуля.
+def _process_started_at():
+    try:
+        with open('/proc/self/stat') as file:
+            start_ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as file:
+            uptime = float(file.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.time()
+    return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+
+
+started_at = _process_started_at()
+
+# Этапы запуска воркера: этап -> миллисекунды от старта процесса (первая отметка каждого этапа)
+stages = {}
+
+
+def mark(stage):
+    if stage not in stages:
+        stages[stage] = round((time.time() - started_at) * 1000, 1)
+
+
+def log_summary():
+    logger.info("Запуск воркера: " + ", ".join(f"{stage} {ms:.0f} мс" for stage, ms in stages.items()))
@@ -0,0 +1,785 @@
+import gc
+import json
+import marshal
+import math
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+import metrics
+from records import UrlBlob, pack_urls, records_from_snapshot, snapshot_row
+
+logger = logging.getLogger(__name__)
+
+# Файл базы данных SQLite
+DB_FILE = os.getenv('MOVIES_DB', 'movies.db')
+
+# Старый JSON файл, из которого один раз импортируются данные
+JSON_FILE = 'movies.json'
+
+# Снимок базы в формате movies.json, который периодически пишет компактор. Отдельный файл:
+# movies.json — исходные данные администратора, их не перезаписываем. Снимок можно
+# загрузить в новую базу так же: python storage.py movies.snapshot.json
+SNAPSHOT_FILE = os.getenv('CATALOG_JSON_SNAPSHOT', 'movies.snapshot.json')
+
+# Двоичный снимок каталога (marshal) для быстрого старта: читается в разы быстрее,
+# чем таблица movies с разбором JSON-полей. Действителен только для той же базы
+# и того же номера изменения movies_rev, иначе каталог читается из SQLite.
+# Он же хранит ссылки фильмов, которые воркеры читают через mmap.
+# По умолчанию лежит рядом с базой: movies.db.snapshot.
+BINARY_SNAPSHOT_FILE = os.getenv('CATALOG_SNAPSHOT')
+BINARY_SNAPSHOT_FORMAT = (2, marshal.version, *sys.version_info[:2])
+BINARY_SNAPSHOT_MAGIC = b"KINOSNAP"
+BINARY_SNAPSHOT_HEADER = struct.Struct("<8sQ")
+
+# Фильмов в одной части снимка. Снимок читается по частям, чтобы поток загрузки
+# отдавал GIL event loop'у и воркер отвечал на запросы, пока каталог загружается.
+BINARY_SNAPSHOT_CHUNK = 5000
+
+# Период работы компактора (секунды)
+COMPACT_INTERVAL = int(os.getenv('COMPACT_INTERVAL', 300))
+
+# Журнал изменений фильмов (movie_changes) хранит последние CHANGE_LOG_KEEP номеров movies_rev:
+# процесс, отставший не больше чем на них, дочитывает только изменившиеся фильмы
+CHANGE_LOG_KEEP = int(os.getenv('CHANGE_LOG_KEEP', 1000))
+
+SNAPSHOT_SECONDS = metrics.Histogram(
+    "kinobot_snapshot_seconds", "Компактор: чтение каталога и запись снимков"
+)
+
+# Оценки фильмов: от 1 до RATING_SCALE
+RATING_SCALE = 10
+
+# Поля фильма, которые хранятся в виде JSON-списков
+LIST_FIELDS = ("genre", "ratings", "reviews")
+
+MOVIE_FIELDS = (
+    "id", "code", "title", "year", "director", "genre",
+    "photo_url", "watch_url", "added_date", "ratings", "reviews"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movies (
+    id TEXT PRIMARY KEY,
+    code TEXT UNIQUE,
+    title TEXT NOT NULL,
+    year INTEGER,
+    director TEXT,
+    genre TEXT NOT NULL DEFAULT '[]',
+    photo_url TEXT NOT NULL DEFAULT '',
+    watch_url TEXT NOT NULL DEFAULT '',
+    added_date TEXT,
+    ratings TEXT NOT NULL DEFAULT '[]',
+    reviews TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS movies_title ON movies(title);
+CREATE TABLE IF NOT EXISTS movie_changes (
+    rev INTEGER NOT NULL,
+    movie_id TEXT NOT NULL,
+    PRIMARY KEY (rev, movie_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS admins (
+    user_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS media (
+    bot_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    file_id TEXT,
+    failed_at REAL,
+    error TEXT,
+    PRIMARY KEY (bot_id, source)
+);
+CREATE TABLE IF NOT EXISTS subscribers (
+    chat_id INTEGER PRIMARY KEY,
+    subscribed_at TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    movie_id TEXT NOT NULL,
+    admin_chat_id INTEGER,
+    progress_message_id INTEGER,
+    created_at REAL,
+    finished_at REAL,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS broadcast_queue (
+    broadcast_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (broadcast_id, chat_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS votes (
+    movie_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    score INTEGER,
+    voted_at REAL,
+    review TEXT,
+    reviewed_at REAL,
+    PRIMARY KEY (movie_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS votes_reviews ON votes(movie_id, reviewed_at) WHERE review IS NOT NULL;
+CREATE TABLE IF NOT EXISTS rating_stats (
+    movie_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    histogram TEXT NOT NULL,
+    heat REAL,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rating_stats_seq ON rating_stats(seq);
+CREATE TABLE IF NOT EXISTS bot_state (
+    bot TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (bot, kind, key)
+) WITHOUT ROWID;
+"""
+
+
+def _movie_to_row(movie):
+    row = []
+    for field in MOVIE_FIELDS:
+        value = movie.get(field)
+        if field in LIST_FIELDS:
+            value = json.dumps(value, ensure_ascii=False) if value else "[]"
+        elif field in ("photo_url", "watch_url") and value is None:
+            value = ""
+        row.append(value)
+    return row
+
+
+# Счётчик изменений раздела (фильмы/админы) в таблице meta.
+# По нему другие процессы понимают, какую часть каталога перечитать.
+def _bump_revision(conn, key):
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES (?, 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (key,)
+    )
+    return int(conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0])
+
+
+# Фильмы, изменённые записью с номером revision (см. movie_changes_since)
+def _log_changes(conn, revision, movie_ids):
+    conn.executemany(
+        "INSERT OR IGNORE INTO movie_changes (rev, movie_id) VALUES (?, ?)",
+        ((revision, movie_id) for movie_id in movie_ids)
+    )
+
+
+# Журнал покрывает только номера после changes_from: всё, что раньше (очищенный журнал,
+# массовый импорт), можно узнать, лишь перечитав каталог целиком
+def _reset_changes(conn, revision):
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('changes_from', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), excluded.value)",
+        (revision,)
+    )
+    conn.execute("DELETE FROM movie_changes WHERE rev <= ?", (revision,))
+
+
+# Следующий числовой ID из последовательности next_movie_id в meta.
+# Если последовательности ещё нет (база до её появления), она начинается после наибольшего числового ID.
+def _next_id_value(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'next_movie_id'").fetchone()
+    if row is not None:
+        return int(row[0])
+    last = conn.execute(
+        "SELECT MAX(CAST(id AS INTEGER)) FROM movies WHERE id != '' AND id NOT GLOB '*[^0-9]*'"
+    ).fetchone()[0]
+    return (last or 0) + 1
+
+
+def _set_next_id(conn, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_movie_id', ?)", (str(value),))
+
+
+# log(e^a + e^b) без переполнения: «популярность» хранится в логарифмах
+def _log_add(a, b):
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+# Порог старшего поколения сборщика мусора, пока создаются сотни тысяч объектов каталога:
+# полная сборка — не раньше чем через столько сборок поколения 1
+GC_LOAD_THRESHOLD = 1000
+
+_gc_lock = threading.Lock()
+_gc_loaders = 0
+_gc_thresholds = None
+
+
+# Сборщик мусора на время создания сотен тысяч объектов каталога: с обычными порогами
+# полные сборки идут одна за другой и каждая обходит все уже созданные (и заведомо живые)
+# фильмы, держа GIL. Откладываются только полные сборки: молодые поколения, где мусор
+# обработчиков event loop, собираются как обычно. Пороги общие для процесса, поэтому
+# возвращаются, когда закончит последний из загрузчиков.
+@contextmanager
+def gc_relaxed():
+    global _gc_loaders, _gc_thresholds
+    with _gc_lock:
+        if not _gc_loaders:
+            _gc_thresholds = gc.get_threshold()
+            gc.set_threshold(*_gc_thresholds[:2], max(GC_LOAD_THRESHOLD, _gc_thresholds[2]))
+        _gc_loaders += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_loaders -= 1
+            if not _gc_loaders:
+                gc.set_threshold(*_gc_thresholds)
+
+
+def _row_to_movie(row):
+    movie = dict(zip(MOVIE_FIELDS, row))
+    for field in LIST_FIELDS:
+        movie[field] = json.loads(movie[field])
+    return movie
+
+
+# Хранилище фильмов и администраторов в SQLite (режим WAL).
+# Каждое изменение — одна строка в одной транзакции, читатели не блокируются писателем.
+class MovieStore:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._snapshot_stamp = None
+        self.binary_snapshot_path = BINARY_SNAPSHOT_FILE or f"{path}.snapshot"
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: каждая транзакция (пачка голосов, пачка импорта, правка администратора) — один fsync
+        # журнала WAL при COMMIT. С NORMAL подтверждённая запись могла пропасть при сбое питания/ОС.
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        # База, созданная до журнала изменений: журнал начинается с текущего номера
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) "
+            "SELECT 'changes_from', COALESCE((SELECT value FROM meta WHERE key = 'movies_rev'), '0')"
+        )
+        return conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # Транзакция на запись: BEGIN IMMEDIATE сразу берёт блокировку писателя
+    def _write(self, func):
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    # Меняется, когда базу изменил другой процесс или соединение
+    def data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def all_movies(self, conn=None):
+        cursor = (conn or self.conn).execute(f"SELECT {', '.join(MOVIE_FIELDS)} FROM movies ORDER BY rowid")
+        with gc_relaxed():
+            return [_row_to_movie(row) for row in cursor]
+
+    # Отдельное соединение для долгих операций (чтение всего каталога, checkpoint):
+    # блокировка хранилища не берётся, и записи через основное соединение идут параллельно (WAL)
+    @contextmanager
+    def _side_connection(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        try:
+            conn.execute("PRAGMA busy_timeout=5000")
+            yield conn
+        finally:
+            conn.close()
+
+    # Изменения фильмов после номера revision: (текущий номер, {id: фильм или None, если удалён}).
+    # Вместо словаря None, если журнал не покрывает этот промежуток или изменённых фильмов
+    # больше limit — тогда дешевле перечитать каталог целиком.
+    def movie_changes_since(self, revision, limit):
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN")
+            try:
+                meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('movies_rev', 'changes_from')"))
+                current = int(meta.get('movies_rev', 0))
+                if revision < int(meta.get('changes_from', 0)):
+                    return current, None
+                ids = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT movie_id FROM movie_changes WHERE rev > ? LIMIT ?", (revision, limit + 1)
+                )]
+                if len(ids) > limit:
+                    return current, None
+                changes = dict.fromkeys(ids)
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT {', '.join(MOVIE_FIELDS)} FROM movies WHERE id IN ({', '.join('?' for _ in chunk)})",
+                        chunk
+                    )
+                    for row in rows:
+                        movie = _row_to_movie(row)
+                        changes[movie['id']] = movie
+            finally:
+                conn.execute("COMMIT")
+        return current, changes
+
+    # Номер изменения movies_rev и фильмы, прочитанные в одной транзакции
+    def movies_at_revision(self):
+        with self._side_connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'movies_rev'").fetchone()
+                revision = int(row[0]) if row else 0
+                movies = self.all_movies(conn)
+            finally:
+                conn.execute("COMMIT")
+        return revision, movies
+
+    # Случайный идентификатор базы: снимок от другой базы с теми же номерами изменений не подойдёт
+    def catalog_id(self):
+        catalog_id = self.get_meta('catalog_id')
+        if catalog_id is None:
+            def do_create(conn):
+                conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_id', lower(hex(randomblob(8))))")
+                return conn.execute("SELECT value FROM meta WHERE key = 'catalog_id'").fetchone()[0]
+
+            catalog_id = self._write(do_create)
+        return catalog_id
+
+    def _binary_snapshot_key(self, revision):
+        return (*BINARY_SNAPSHOT_FORMAT, self.catalog_id(), revision)
+
+    # Записи каталога (records.MovieRecord) из двоичного снимка или None, если снимка нет
+    # или он от другой версии каталога. Формат файла: заголовок (метка, начало ссылок),
+    # marshal (ключ, [части по BINARY_SNAPSHOT_CHUNK строк]), затем ссылки всех фильмов.
+    # Ссылки не читаются, а отображаются в память (UrlBlob) — записи ссылаются на смещения в файле.
+    def load_binary_snapshot(self, revision):
+        try:
+            with open(self.binary_snapshot_path, 'rb') as file:
+                magic, urls_start = BINARY_SNAPSHOT_HEADER.unpack(file.read(BINARY_SNAPSHOT_HEADER.size))
+                if magic != BINARY_SNAPSHOT_MAGIC:
+                    return None
+                key, chunks = marshal.loads(file.read(urls_start - BINARY_SNAPSHOT_HEADER.size))
+                if key != self._binary_snapshot_key(revision):
+                    return None
+                blob = UrlBlob(file, urls_start)
+            movies = []
+            shared = {}
+            with gc_relaxed():
+                for chunk in chunks:
+                    movies.extend(records_from_snapshot(marshal.loads(chunk), blob, shared))
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            return None
+        return movies
+
+    # Запись снимка во временный файл и os.replace: читатели видят старый или новый файл целиком.
+    # Воркеры, которые уже отобразили старый файл, продолжают читать его до перезагрузки каталога.
+    def save_binary_snapshot(self, revision, movies):
+        urls, offsets = pack_urls(movies)
+        chunks = []
+        for start in range(0, len(movies), BINARY_SNAPSHOT_CHUNK):
+            end = start + BINARY_SNAPSHOT_CHUNK
+            rows = [snapshot_row(movie, offset) for movie, offset in zip(movies[start:end], offsets[start:end])]
+            chunks.append(marshal.dumps(rows))
+        payload = marshal.dumps((self._binary_snapshot_key(revision), chunks))
+        tmp_path = f"{self.binary_snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(BINARY_SNAPSHOT_HEADER.pack(BINARY_SNAPSHOT_MAGIC, BINARY_SNAPSHOT_HEADER.size + len(payload)))
+            file.write(payload)
+            file.write(urls)
+        os.replace(tmp_path, self.binary_snapshot_path)
+
+    # Пачка фильмов одним executemany в одной транзакции; номер изменения — один на пачку
+    def add_movies(self, movies):
+        placeholders = ", ".join("?" for _ in MOVIE_FIELDS)
+
+        def do_add(conn):
+            conn.executemany(
+                f"INSERT INTO movies ({', '.join(MOVIE_FIELDS)}) VALUES ({placeholders})",
+                (_movie_to_row(movie) for movie in movies)
+            )
+            revision = _bump_revision(conn, 'movies_rev')
+            _log_changes(conn, revision, (movie["id"] for movie in movies))
+            return revision
+
+        return self._write(do_add)
+
+    # count новых ID фильмов (001, 002, ...). Последовательность хранится в meta и только растёт,
+    # поэтому ID удалённых фильмов не выдаются повторно, а процессы не получают одинаковых ID.
+    def allocate_ids(self, count=1):
+        def do_allocate(conn):
+            first = _next_id_value(conn)
+            _set_next_id(conn, first + count)
+            return first
+
+        first = self._write(do_allocate)
+        return [str(i).zfill(3) for i in range(first, first + count)]
+
+    # Возвращает новый номер изменения или None, если фильма не было
+    def delete_movie(self, movie_id):
+        def do_delete(conn):
+            if conn.execute("DELETE FROM movies WHERE id = ?", (movie_id,)).rowcount == 0:
+                return None
+            revision = _bump_revision(conn, 'movies_rev')
+            _log_changes(conn, revision, (movie_id,))
+            return revision
+
+        return self._write(do_delete)
+
+    # None, если список администраторов ещё не заведён
+    def get_admins(self, conn=None):
+        rows = (conn or self.conn).execute("SELECT user_id FROM admins ORDER BY rowid").fetchall()
+        return [row[0] for row in rows] if rows else None
+
+    def add_admin(self, user_id):
+        def do_add(conn):
+            conn.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+            return _bump_revision(conn, 'admins_rev')
+
+        return self._write(do_add)
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    # Номера изменений разделов каталога: {'movies_rev': ..., 'admins_rev': ...}
+    def revisions(self, conn=None):
+        rows = (conn or self.conn).execute("SELECT key, value FROM meta WHERE key IN ('movies_rev', 'admins_rev')")
+        return {key: int(value) for key, value in rows}
+
+    # Известный file_id или время последней ошибки для фото в конкретном боте
+    def get_media(self, bot_id, source):
+        row = self.conn.execute(
+            "SELECT file_id, failed_at FROM media WHERE bot_id = ? AND source = ?", (bot_id, source)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def set_media(self, bot_id, source, file_id=None, failed_at=None, error=None):
+        self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO media (bot_id, source, file_id, failed_at, error) VALUES (?, ?, ?, ?, ?)",
+            (bot_id, source, file_id, failed_at, error)
+        ))
+
+    # Подписчики cinemabot: все, кто нажимал /start
+    def add_subscribers(self, chat_ids):
+        self._write(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO subscribers (chat_id, subscribed_at) VALUES (?, datetime('now'))",
+            [(chat_id,) for chat_id in chat_ids]
+        ))
+
+    def count_subscribers(self):
+        return self.conn.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+
+    # Рассылка: очередь заполняется одним запросом из таблицы подписчиков
+    def create_broadcast(self, movie_id, admin_chat_id=None):
+        def do_create(conn):
+            cursor = conn.execute(
+                "INSERT INTO broadcasts (movie_id, admin_chat_id, created_at) VALUES (?, ?, ?)",
+                (movie_id, admin_chat_id, time.time())
+            )
+            broadcast_id = cursor.lastrowid
+            total = conn.execute(
+                "INSERT INTO broadcast_queue (broadcast_id, chat_id) SELECT ?, chat_id FROM subscribers",
+                (broadcast_id,)
+            ).rowcount
+            conn.execute("UPDATE broadcasts SET total = ? WHERE id = ?", (total, broadcast_id))
+            return broadcast_id
+
+        return self._write(do_create)
+
+    def get_broadcast(self, broadcast_id):
+        cursor = self.conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        row = cursor.fetchone()
+        return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+    # Незавершённые рассылки (в том числе прерванные перезапуском)
+    def unfinished_broadcasts(self):
+        rows = self.conn.execute("SELECT id FROM broadcasts WHERE finished_at IS NULL ORDER BY id").fetchall()
+        return [row[0] for row in rows]
+
+    # Следующая порция чатов рассылки по возрастанию chat_id
+    def broadcast_chats(self, broadcast_id, after, limit):
+        rows = self.conn.execute(
+            "SELECT chat_id FROM broadcast_queue WHERE broadcast_id = ? AND chat_id > ? ORDER BY chat_id LIMIT ?",
+            (broadcast_id, after, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    # Итог отправки пачки одной транзакцией: убрать чаты из очереди, обновить счётчики,
+    # удалить подписчиков, заблокировавших бота
+    def complete_deliveries(self, broadcast_id, sent, blocked, failed):
+        def do_complete(conn):
+            for chat_ids in (sent, blocked, failed):
+                conn.executemany(
+                    "DELETE FROM broadcast_queue WHERE broadcast_id = ? AND chat_id = ?",
+                    [(broadcast_id, chat_id) for chat_id in chat_ids]
+                )
+            conn.executemany("DELETE FROM subscribers WHERE chat_id = ?", [(chat_id,) for chat_id in blocked])
+            conn.execute(
+                "UPDATE broadcasts SET sent = sent + ?, blocked = blocked + ?, failed = failed + ? WHERE id = ?",
+                (len(sent), len(blocked), len(failed), broadcast_id)
+            )
+
+        self._write(do_complete)
+
+    def update_broadcast(self, broadcast_id, **fields):
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        self._write(lambda conn: conn.execute(
+            f"UPDATE broadcasts SET {assignments} WHERE id = ?", (*fields.values(), broadcast_id)
+        ))
+
+    # Состояние ботов (user_data, chat_data, диалоги) в виде JSON
+    def load_states(self, bot, kind):
+        rows = self.conn.execute("SELECT key, data FROM bot_state WHERE bot = ? AND kind = ?", (bot, kind))
+        return dict(rows.fetchall())
+
+    def load_state(self, bot, kind, key):
+        row = self.conn.execute(
+            "SELECT data FROM bot_state WHERE bot = ? AND kind = ? AND key = ?", (bot, kind, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    # Пачка изменений состояния одной транзакцией: {(kind, key): data}, data=None — удалить
+    def save_states(self, bot, changes):
+        def do_save(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO bot_state (bot, kind, key, data) VALUES (?, ?, ?, ?)",
+                [(bot, kind, key, data) for (kind, key), data in changes.items() if data is not None]
+            )
+            conn.executemany(
+                "DELETE FROM bot_state WHERE bot = ? AND kind = ? AND key = ?",
+                [(bot, kind, key) for (kind, key), data in changes.items() if data is None]
+            )
+
+        self._write(do_save)
+
+    # Голоса и отзывы пачкой одной транзакцией:
+    # [(id фильма, id пользователя, оценка или None, отзыв или None, время, вклад в популярность), ...].
+    # У пользователя один голос на фильм: повторная оценка заменяет прежнюю. Сводка фильма
+    # (число оценок, сумма, гистограмма, популярность) меняется на разницу со старой оценкой — O(1) на голос,
+    # строка сводки пишется один раз на фильм за пачку. Возвращает новые строки rating_stats.
+    def save_votes(self, votes):
+        def do_save(conn):
+            changed = {}
+            for movie_id, user_id, score, review, at, heat in votes:
+                row = conn.execute(
+                    "SELECT score FROM votes WHERE movie_id = ? AND user_id = ?", (movie_id, user_id)
+                ).fetchone()
+                conn.execute(
+                    "INSERT INTO votes (movie_id, user_id, score, voted_at, review, reviewed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(movie_id, user_id) DO UPDATE SET "
+                    "score = COALESCE(excluded.score, score), voted_at = COALESCE(excluded.voted_at, voted_at), "
+                    "review = COALESCE(excluded.review, review), reviewed_at = COALESCE(excluded.reviewed_at, reviewed_at)",
+                    (movie_id, user_id, score, at if score is not None else None,
+                     review, at if review is not None else None)
+                )
+                old = row[0] if row else None
+                if score is None or score == old:
+                    continue
+                stats = changed.get(movie_id)
+                if stats is None:
+                    row = conn.execute(
+                        "SELECT count, total, histogram, heat FROM rating_stats WHERE movie_id = ?", (movie_id,)
+                    ).fetchone()
+                    stats = changed[movie_id] = (
+                        [row[0], row[1], json.loads(row[2]), row[3]] if row else [0, 0, [0] * RATING_SCALE, None]
+                    )
+                if old is None:
+                    stats[0] += 1
+                else:
+                    stats[1] -= old
+                    stats[2][old - 1] -= 1
+                stats[1] += score
+                stats[2][score - 1] += 1
+                stats[3] = _log_add(stats[3], heat)
+            if not changed:
+                return []
+            seq = _bump_revision(conn, 'ratings_rev')
+            rows = [
+                (movie_id, count, total, json.dumps(histogram), heat, seq)
+                for movie_id, (count, total, histogram, heat) in changed.items()
+            ]
+            conn.executemany(
+                "INSERT OR REPLACE INTO rating_stats (movie_id, count, total, histogram, heat, seq) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            return rows
+
+        return self._write(do_save)
+
+    # Сводки оценок, изменённые после номера seq (все — при seq=0)
+    def rating_stats_since(self, seq):
+        return self.conn.execute(
+            "SELECT movie_id, count, total, histogram, heat, seq FROM rating_stats WHERE seq > ? ORDER BY seq",
+            (seq,)
+        ).fetchall()
+
+    # Последние отзывы о фильме: [(id пользователя, оценка, отзыв, время), ...]
+    def latest_reviews(self, movie_id, limit):
+        return self.conn.execute(
+            "SELECT user_id, score, review, reviewed_at FROM votes "
+            "WHERE movie_id = ? AND review IS NOT NULL ORDER BY reviewed_at DESC LIMIT ?",
+            (movie_id, limit)
+        ).fetchall()
+
+    # Однократный импорт из movies.json.
+    # В старом файле поля одного фильма оказались прямо в корне документа — их тоже забираем.
+    # Повреждённый файл не считаем пустым каталогом — импорт прерывается с ошибкой.
+    def import_json(self, path=JSON_FILE, only_once=False):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except json.JSONDecodeError as e:
+            logger.error(f"Файл {path} повреждён или пуст, импорт отменён: {e}")
+            raise
+
+        movies = list(data.get("movies", []))
+        stray = {key: value for key, value in data.items() if key not in ("movies", "admins")}
+        if stray.get("title"):
+            movies.append(stray)
+        admins = data.get("admins", [])
+
+        def do_import(conn):
+            if only_once and conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return None
+            used_ids = {row[0] for row in conn.execute("SELECT id FROM movies")}
+            used_codes = {row[0] for row in conn.execute("SELECT code FROM movies WHERE code IS NOT NULL")}
+            numeric = [int(i) for i in used_ids | {m.get("id", "") for m in movies} if str(i).isdigit()]
+            next_id = max(max(numeric, default=0) + 1, _next_id_value(conn))
+            imported = 0
+            placeholders = ", ".join("?" for _ in MOVIE_FIELDS)
+            for movie in movies:
+                movie = dict(movie)
+                if not movie.get("id") or movie["id"] in used_ids:
+                    new_id = str(next_id).zfill(3)
+                    logger.warning(f"Фильм «{movie.get('title')}»: ID {movie.get('id')} занят, присвоен ID {new_id}")
+                    movie["id"] = new_id
+                    next_id += 1
+                if movie.get("code") in used_codes:
+                    logger.warning(f"Фильм «{movie.get('title')}»: код {movie['code']} занят, код сброшен")
+                    movie["code"] = None
+                conn.execute(
+                    f"INSERT INTO movies ({', '.join(MOVIE_FIELDS)}) VALUES ({placeholders})",
+                    _movie_to_row(movie)
+                )
+                used_ids.add(movie["id"])
+                if movie.get("code"):
+                    used_codes.add(movie["code"])
+                imported += 1
+            _set_next_id(conn, next_id)
+            for user_id in admins:
+                conn.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (int(user_id),))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', ?)", (os.path.abspath(path),))
+            _reset_changes(conn, _bump_revision(conn, 'movies_rev'))
+            _bump_revision(conn, 'admins_rev')
+            return imported
+
+        imported = self._write(do_import)
+        if imported is None:
+            return 0
+        logger.info(f"Импортировано из {path}: {imported} фильмов, {len(admins)} администраторов")
+        return imported
+
+    # Импорт при первом запуске, если база ещё пустая
+    def import_json_once(self, path=JSON_FILE):
+        if self.get_meta("json_imported") is not None or not os.path.exists(path):
+            return 0
+        return self.import_json(path, only_once=True)
+
+    # Снимок базы в формате movies.json.
+    # Пишем во временный файл, fsync и os.replace — файл всегда либо старый, либо новый целиком.
+    def export_json(self, path=SNAPSHOT_FILE, movies=None, admins=None):
+        data = {
+            "movies": self.all_movies() if movies is None else movies,
+            "admins": (self.get_admins() if admins is None else admins) or [],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return len(data["movies"])
+
+    # Компактор: переносит WAL-журнал в основной файл базы и обновляет снимки,
+    # если с прошлого раза изменились фильмы или администраторы (оценки, фото и подписчики
+    # в снимки не входят). Всё — через отдельное соединение, без блокировки хранилища:
+    # записи из event loop не ждут, пока читается и сохраняется весь каталог.
+    def compact(self, snapshot_path=SNAPSHOT_FILE):
+        stamp = self.revisions()
+        if stamp.get('movies_rev', 0) > CHANGE_LOG_KEEP:
+            self._write(lambda conn: _reset_changes(conn, stamp['movies_rev'] - CHANGE_LOG_KEEP))
+        with self._side_connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            stamp = self.revisions(conn)
+            admins = self.get_admins(conn)
+        if stamp == self._snapshot_stamp:
+            return False
+        with SNAPSHOT_SECONDS.time():
+            revision, movies = self.movies_at_revision()
+            count = self.export_json(snapshot_path, movies, admins)
+            self.save_binary_snapshot(revision, movies)
+        # Номера прочитаны до каталога: запись между ними даст лишний снимок, но не пропущенный
+        self._snapshot_stamp = stamp
+        logger.info(f"Снимок базы сохранён в {snapshot_path}: {count} фильмов")
+        return True
+
+    def start_compactor(self, interval=COMPACT_INTERVAL, snapshot_path=SNAPSHOT_FILE):
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact(snapshot_path)
+                except Exception as e:
+                    logger.error(f"Ошибка компактора: {e}")
+
+        thread = threading.Thread(target=loop, name="catalog-compactor", daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    source = sys.argv[1] if len(sys.argv) > 1 else JSON_FILE
+    MovieStore().import_json(source)